@@ -0,0 +1,213 @@
+"""
+Incrementally maintained insight aggregates per (niche, platform)
+- niche_aggregates: one row per niche/platform with running sentiment and
+  usefulness sums, a bounded top-K of posts by engagement and a bounded,
+  frequency-ranked set of audience questions (Space-Saving counts, so new
+  questions can displace stale ones once the set is full)
+- update: folds a run's analyses into the row (one read-modify-write); the
+  niche_aggregate_posts link table records which posts each niche has
+  counted, so a post is counted once per niche, even when its analysis is
+  reused from another niche's run
+- get_summary: the precomputed summary generation prompts draw on, by primary key
+"""
+
+import os
+import re
+import json
+import datetime
+from typing import List, Optional
+import storage
+import post_store
+
+AGGREGATE_TOP_POSTS = int(os.getenv("AGGREGATE_TOP_POSTS", "10"))
+# Distinct questions tracked per niche; beyond this a new question replaces the least frequent
+AGGREGATE_MAX_QUESTIONS = int(os.getenv("AGGREGATE_MAX_QUESTIONS", "50"))
+
+_PUNCT = re.compile(r"[^\w\s]")
+
+
+def init_aggregate_table():
+    with storage.transaction() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS niche_aggregates (
+                niche_key TEXT,
+                platform TEXT,
+                niche TEXT,
+                analyses_count INTEGER DEFAULT 0,
+                sentiment_sum REAL DEFAULT 0,
+                usefulness_sum REAL DEFAULT 0,
+                top_posts TEXT DEFAULT '[]',
+                questions TEXT DEFAULT '{}',
+                updated_at TEXT,
+                PRIMARY KEY (niche_key, platform)
+            )
+        """)
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'niche_aggregate_posts'").fetchone()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS niche_aggregate_posts (
+                niche_key TEXT,
+                platform TEXT,
+                post_key TEXT,
+                added_at TEXT,
+                PRIMARY KEY (niche_key, platform, post_key)
+            )
+        """)
+        if not exists:
+            _link_counted_posts(conn)
+
+
+def _link_counted_posts(conn):
+    """Link the posts in run history to niches whose aggregate was built before the link table."""
+    counted = {(r["niche_key"], r["platform"]) for r in conn.execute("SELECT niche_key, platform FROM niche_aggregates")}
+    if not counted:
+        return
+    links = set()
+    for row in conn.execute("SELECT niche, platform, post_url, post_text, created_at FROM analyses"):
+        scope = (_niche_key(row["niche"] or ""), row["platform"])
+        if scope in counted and (row["post_url"] or row["post_text"]):
+            key = post_store.post_key({"url": row["post_url"], "text": row["post_text"]})
+            links.add((*scope, key, row["created_at"]))
+    conn.executemany(
+        "INSERT OR IGNORE INTO niche_aggregate_posts (niche_key, platform, post_key, added_at) VALUES (?, ?, ?, ?)",
+        sorted(links)
+    )
+
+
+def _niche_key(niche: str) -> str:
+    return " ".join(niche.lower().split())
+
+
+def _question_key(question: str) -> str:
+    return " ".join(_PUNCT.sub("", question.lower()).split())
+
+
+def _count_question(questions: dict, qk: str, text: str, seen: str):
+    """
+    Space-Saving update of {key: [count, text, last seen]}: a new question
+    arriving at a full set replaces the least frequent (oldest seen on ties)
+    and inherits its count + 1, so it can outrank entries that stopped recurring.
+    """
+    if qk in questions:
+        count, text = questions[qk][0], questions[qk][1]
+        questions[qk] = [count + 1, text, seen]
+        return
+    count = 0
+    if len(questions) >= AGGREGATE_MAX_QUESTIONS:
+        victim = min(questions, key=lambda k: (questions[k][0], questions[k][2] if len(questions[k]) > 2 else ""))
+        count = questions.pop(victim)[0]
+    questions[qk] = [count + 1, text, seen]
+
+
+def _engagement(a: dict) -> int:
+    return (a.get("likes", 0) or 0) + 2 * (a.get("comments", 0) or 0) + 3 * (a.get("shares", 0) or 0)
+
+
+def update(niche: str, platform: str, analyses: List[dict], updated_at: Optional[str] = None):
+    """
+    Fold new analyses into the niche's aggregate. Mock fallbacks and posts
+    this niche has already counted (see niche_aggregate_posts) are skipped;
+    an analysis reused from another niche's run still counts here once. The
+    row is touched with a write first, so concurrent updates serialize on
+    SQLite's write lock instead of losing each other's increments.
+    """
+    candidates = [a for a in analyses if a and not a.get("fallback")]
+    if not candidates:
+        return
+    key = _niche_key(niche)
+    now = updated_at or datetime.datetime.utcnow().isoformat()
+
+    with storage.transaction() as conn:
+        conn.execute(
+            "INSERT INTO niche_aggregates (niche_key, platform, niche, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(niche_key, platform) DO NOTHING",
+            (key, platform, niche, now)
+        )
+        fresh = [
+            a for a in candidates
+            if conn.execute(
+                "INSERT OR IGNORE INTO niche_aggregate_posts (niche_key, platform, post_key, added_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, platform, post_store.post_key(a), now)
+            ).rowcount
+        ]
+        if not fresh:
+            return
+        row = conn.execute(
+            "SELECT top_posts, questions FROM niche_aggregates WHERE niche_key = ? AND platform = ?",
+            (key, platform)
+        ).fetchone()
+
+        top_posts = {p["url"] or p["text"]: p for p in json.loads(row["top_posts"])}
+        questions = json.loads(row["questions"])
+        for a in fresh:
+            entry = {
+                "url": a.get("url", ""),
+                "text": (a.get("text") or "")[:400],
+                "likes": a.get("likes", 0),
+                "comments": a.get("comments", 0),
+                "shares": a.get("shares", 0),
+                "engagement": _engagement(a),
+                # Local-tier insights only restate metrics; keep the model's
+                "key_insights": a.get("key_insights", "") if a.get("analysis_tier") != "local" else "",
+            }
+            ident = entry["url"] or entry["text"]
+            previous = top_posts.get(ident)
+            if previous and not entry["key_insights"]:
+                entry["key_insights"] = previous.get("key_insights", "")
+            top_posts[ident] = entry
+
+            for q in a.get("common_questions") or []:
+                qk = _question_key(str(q))
+                if not qk:
+                    continue
+                _count_question(questions, qk, str(q).strip(), now)
+
+        ranked_posts = sorted(top_posts.values(), key=lambda p: p["engagement"], reverse=True)
+        ranked_questions = dict(
+            sorted(questions.items(), key=lambda kv: kv[1][0], reverse=True)[:AGGREGATE_MAX_QUESTIONS]
+        )
+        conn.execute("""
+            UPDATE niche_aggregates SET
+                niche = ?,
+                analyses_count = analyses_count + ?,
+                sentiment_sum = sentiment_sum + ?,
+                usefulness_sum = usefulness_sum + ?,
+                top_posts = ?,
+                questions = ?,
+                updated_at = ?
+            WHERE niche_key = ? AND platform = ?
+        """, (
+            niche,
+            len(fresh),
+            sum(a.get("overall_sentiment", 3) for a in fresh),
+            sum(a.get("tool_usefulness", 3) for a in fresh),
+            json.dumps(ranked_posts[:AGGREGATE_TOP_POSTS]),
+            json.dumps(ranked_questions),
+            now,
+            key, platform
+        ))
+
+
+def get_summary(niche: str, platform: str, max_questions: int = 10) -> Optional[dict]:
+    """Precomputed summary for a niche/platform, or None if nothing is stored yet."""
+    with storage.connection() as conn:
+        row = conn.execute(
+            "SELECT * FROM niche_aggregates WHERE niche_key = ? AND platform = ?",
+            (_niche_key(niche), platform)
+        ).fetchone()
+    if row is None or not row["analyses_count"]:
+        return None
+    count = row["analyses_count"]
+    # Stored most frequent first (see update)
+    questions = list(json.loads(row["questions"]).values())
+    return {
+        "niche": row["niche"],
+        "platform": row["platform"],
+        "analyses_count": count,
+        "avg_sentiment": round(row["sentiment_sum"] / count, 2),
+        "avg_usefulness": round(row["usefulness_sum"] / count, 2),
+        "top_posts": json.loads(row["top_posts"]),
+        "top_questions": [{"question": q[1], "count": q[0]} for q in questions[:max_questions]],
+        "updated_at": row["updated_at"],
+    }
+
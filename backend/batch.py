@@ -0,0 +1,214 @@
+"""
+Batch pipeline runs for many niches
+- BatchRunRequest: niche specs plus the options every run in the batch shares
+- execute_batch: one combined scrape, each distinct post analyzed once across
+  niches, then generation and persistence per niche under one concurrency
+  limit. A niche that fails is reported in its result; the others still finish
+"""
+
+import os
+import asyncio
+import datetime
+from typing import Dict, List, Literal, Optional, Set, Tuple
+from pydantic import BaseModel, Field
+from scraper import get_linkedin_posts_for_niches
+from gemini_agent import analyze_sentiment_batch, generate_viral_content
+import aggregates
+import metrics
+import post_store
+import prescore
+import semantic_cache
+import storage
+
+# Niche runs generating at once within a batch (Gemini quota is shared anyway, see gemini_scheduler)
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+BATCH_MAX_NICHES = int(os.getenv("BATCH_MAX_NICHES", "50"))
+
+
+class NicheSpec(BaseModel):
+    niche: str
+    keywords: Optional[List[str]] = []
+
+
+class BatchRunRequest(BaseModel):
+    niches: List[NicheSpec] = Field(min_length=1, max_length=BATCH_MAX_NICHES)
+    platform: str = "LinkedIn"
+    use_mock: bool = True
+    apify_token: Optional[str] = None
+    num_posts: int = 5
+    max_concurrency: Optional[int] = None
+    use_cache: bool = True
+    reuse_analyses: bool = True
+    include_timings: bool = False
+    prescore: bool = True
+    escalate_top_k: Optional[int] = None
+    use_history: bool = True
+    generation_mode: Optional[Literal["single", "per_tone"]] = None
+    local_corpus: Optional[bool] = None
+
+
+def _dedupe(niche_posts: List[List[dict]]) -> Tuple[List[dict], List[List[int]]]:
+    """(distinct posts across all niches, each niche's posts as indices into them)."""
+    unique: List[dict] = []
+    position: Dict[str, int] = {}
+    indices = []
+    for posts in niche_posts:
+        own = []
+        for post in posts:
+            key = post_store.post_key(post)
+            if key not in position:
+                position[key] = len(unique)
+                unique.append(post)
+            if position[key] not in own:
+                own.append(position[key])
+        indices.append(own)
+    return unique, indices
+
+
+def _analyze(
+    posts: List[dict],
+    niche_indices: List[List[int]],
+    req: BatchRunRequest
+) -> Tuple[List[dict], Dict[int, dict], Set[int]]:
+    """
+    Analyze every distinct post once: reuse stored analyses, score the rest
+    locally per niche, and send the posts any niche escalates to Gemini in one
+    batched call. Returns (analyses, reused, indices analyzed by the model).
+    """
+    analyses: List[Optional[dict]] = [None] * len(posts)
+    reused = post_store.find_reusable_analyses(posts, req.platform) if req.reuse_analyses else {}
+    for i, analysis in reused.items():
+        analyses[i] = {**posts[i], **analysis, "analysis_reused": True}
+
+    escalate: Set[int] = set()
+    for own in niche_indices:
+        pending = [i for i in own if i not in reused]
+        if not req.prescore:
+            escalate.update(pending)
+            continue
+        chosen, local = prescore.triage([posts[i] for i in pending], req.escalate_top_k)
+        escalate.update(pending[j] for j in chosen)
+        for j, analysis in local.items():
+            if analyses[pending[j]] is None:
+                analyses[pending[j]] = {**posts[pending[j]], **analysis}
+
+    escalated = sorted(escalate)
+    results = analyze_sentiment_batch([posts[i] for i in escalated], req.platform, use_cache=req.use_cache)
+    for i, analysis in zip(escalated, results):
+        analyses[i] = {**posts[i], **analysis}
+    return analyses, reused, set(escalated)
+
+
+async def execute_batch(req: BatchRunRequest, trace: Optional[metrics.Trace] = None) -> dict:
+    """Run the pipeline for every niche in req and return per-niche results."""
+    trace = trace or metrics.Trace()
+    now = datetime.datetime.utcnow().isoformat()
+
+    with metrics.timed("scrape", trace):
+        niche_posts = await asyncio.to_thread(
+            get_linkedin_posts_for_niches,
+            [(spec.niche, spec.keywords) for spec in req.niches],
+            num_posts=req.num_posts,
+            use_mock=req.use_mock,
+            apify_token=req.apify_token,
+            use_cache=req.use_cache,
+            local_corpus=req.local_corpus
+        )
+    posts, niche_indices = _dedupe(niche_posts)
+
+    with metrics.timed("analyze", trace):
+        analyses, reused, escalated = await asyncio.to_thread(_analyze, posts, niche_indices, req)
+    if posts:
+        with metrics.timed("persist", trace):
+            await asyncio.to_thread(post_store.record_posts, posts, analyses, req.platform, now, escalated)
+
+    limit = asyncio.Semaphore(max(1, req.max_concurrency or BATCH_MAX_CONCURRENCY))
+
+    async def _run_niche(spec: NicheSpec, own: List[int]) -> dict:
+        async with limit:
+            niche_analyses = [analyses[i] for i in own]
+            if not niche_analyses:
+                raise ValueError("No posts found for the given inputs.")
+            similar = None
+            if req.use_cache:
+                similar = semantic_cache.lookup(spec.niche, spec.keywords, req.platform)
+            if similar:
+                generated_posts = similar["posts"]
+            else:
+                history = None
+                if req.use_history:
+                    history = await asyncio.to_thread(aggregates.get_summary, spec.niche, req.platform)
+                generated_posts = await asyncio.to_thread(
+                    generate_viral_content,
+                    niche=spec.niche,
+                    platform=req.platform,
+                    analyses=niche_analyses,
+                    use_cache=req.use_cache,
+                    history=history,
+                    mode=req.generation_mode
+                )
+                if req.use_cache:
+                    semantic_cache.store(spec.niche, spec.keywords, req.platform, generated_posts)
+
+            def _persist() -> int:
+                aggregates.update(spec.niche, req.platform, niche_analyses, now)
+                return storage.save_run(now, spec.niche, req.platform, niche_analyses, generated_posts)
+
+            run_id = await asyncio.to_thread(_persist)
+        return {
+            "niche": spec.niche,
+            "success": True,
+            "message": (
+                f"Analysed {len(niche_analyses)} posts, reused {len(generated_posts)} viral posts "
+                f"generated for similar niche '{similar['niche']}'." if similar else
+                f"Analysed {len(niche_analyses)} posts, generated {len(generated_posts)} viral posts."
+            ),
+            "analyses": niche_analyses,
+            "generated_posts": generated_posts,
+            "run_id": run_id,
+        }
+
+    with metrics.timed("generate", trace):
+        outcomes = await asyncio.gather(
+            *(_run_niche(spec, own) for spec, own in zip(req.niches, niche_indices)),
+            return_exceptions=True
+        )
+
+    results = []
+    for spec, outcome in zip(req.niches, outcomes):
+        if isinstance(outcome, Exception):
+            print(f"[Batch] Niche {spec.niche!r} failed: {outcome}")
+            metrics.RUNS.inc(status="error")
+            results.append({"niche": spec.niche, "success": False, "error": str(outcome)})
+        else:
+            metrics.RUNS.inc(status="ok")
+            results.append(outcome)
+
+    succeeded = sum(1 for r in results if r["success"])
+    scraped = sum(len(p) for p in niche_posts)
+    # Escalated posts whose Gemini call fell back to a mock analysis were not analysed by the model
+    modelled = sum(
+        1 for i in escalated
+        if not analyses[i].get("fallback") and analyses[i].get("analysis_tier") != "local"
+    )
+    return {
+        "success": succeeded == len(results),
+        "message": (
+            f"Batch completed: {succeeded}/{len(results)} niches succeeded. "
+            f"{scraped} posts scraped, {len(posts)} distinct, {modelled} analysed by Gemini."
+        ),
+        "results": results,
+        "stats": {
+            "niches": len(results),
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+            "posts_scraped": scraped,
+            "distinct_posts": len(posts),
+            "reused": len(reused),
+            "scored_locally": len(posts) - len(reused) - len(escalated),
+            "analysed_by_model": modelled,
+            "model_fallbacks": len(escalated) - modelled,
+        },
+        "trace_id": trace.trace_id,
+        "timings": trace.breakdown() if req.include_timings else None,
+    }
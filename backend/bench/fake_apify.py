@@ -0,0 +1,186 @@
+"""
+Local stand-in for the Apify API used by scraper.py.
+
+Implements the endpoints the backend calls:
+  POST /v2/acts/{actor}/runs                     start a run
+  GET  /v2/actor-runs/{id}?waitForFinish=N       run status (long-polls)
+  GET  /v2/datasets/{id}/items?offset=&limit=    dataset pages
+  POST /v2/acts/{actor}/run-sync-get-dataset-items
+Each run produces deterministic LinkedIn-like posts for its queries, with
+realistic repetitive comment threads. Point the backend at it with:
+
+    APIFY_API_BASE=http://127.0.0.1:<port>
+
+Run standalone: python -m bench.fake_apify --port 8102 --run-ms 3000
+"""
+
+import json
+import time
+import hashlib
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+from bench.faults import FaultProfile
+
+OPENERS = [
+    "I analyzed 200 {kw} posts and found one pattern.",
+    "Most {kw} advice is wrong. Here's what worked for me.",
+    "I failed at {kw} for 2 years before this clicked.",
+    "The {kw} playbook changed in 2024.",
+    "Nobody talks about the hard part of {kw}.",
+]
+
+COMMENTS = [
+    "Great post!",
+    "Saving this.",
+    "Saving this for later!",
+    "This is so true.",
+    "What tools do you use for {kw}?",
+    "How long did it take to see results?",
+    "Can you share the template?",
+    "I tried this and my engagement doubled in a month.",
+    "Disagree — this only works if you already have an audience.",
+    "Great post!!",
+]
+
+
+def make_posts(queries: list, count: int) -> list:
+    """Deterministic Apify-shaped items for a query set."""
+    seed = "|".join(sorted(q.lower() for q in queries))
+    rng = random.Random(seed)
+    tag = hashlib.md5(seed.encode("utf-8")).hexdigest()[:8]
+    items = []
+    for i in range(count):
+        kw = queries[i % len(queries)] if queries else "growth"
+        likes = int(rng.paretovariate(1.2) * 150)
+        n_comments = rng.randint(3, 12)
+        items.append({
+            "url": f"https://linkedin.com/posts/fake-{tag}-{i}",
+            "authorName": f"Author {rng.randint(1, 500)}",
+            "authorTitle": "Founder",
+            "text": rng.choice(OPENERS).format(kw=kw) + "\n\n→ Be specific\n→ Show your work\n→ Ask one question",
+            "likesCount": likes,
+            "commentsCount": max(n_comments, likes // 20),
+            "sharesCount": likes // 10,
+            "topComments": [rng.choice(COMMENTS).format(kw=kw) for _ in range(n_comments)],
+        })
+    return items
+
+
+def make_handler(faults: FaultProfile, run_ms: float, stats: dict):
+    runs = {}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status: int, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _inject(self) -> bool:
+            """Apply latency; send an error response and return True if this request should fail."""
+            with lock:
+                stats["requests"] += 1
+            faults.delay()
+            if faults.should_fail():
+                with lock:
+                    stats["errors"] += 1
+                self._send_json(503, {"error": {"type": "injected", "message": "Injected failure"}})
+                return True
+            return False
+
+        def _run_json(self, run: dict) -> dict:
+            status = "SUCCEEDED" if time.monotonic() >= run["finishes_at"] else "RUNNING"
+            return {"data": {"id": run["id"], "status": status, "defaultDatasetId": run["id"]}}
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            if self._inject():
+                return
+            queries = payload.get("queries") or ["growth"]
+            count = int(payload.get("maxResults", 10))
+
+            if self.path.rstrip("/").endswith("/run-sync-get-dataset-items"):
+                time.sleep(run_ms / 1000)
+                return self._send_json(201, make_posts(queries, count))
+
+            run = {
+                "id": uuid.uuid4().hex[:12],
+                "items": make_posts(queries, count),
+                "finishes_at": time.monotonic() + run_ms / 1000,
+            }
+            with lock:
+                runs[run["id"]] = run
+            self._send_json(201, self._run_json(run))
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            parts = url.path.strip("/").split("/")
+            if self._inject():
+                return
+
+            if len(parts) == 3 and parts[1] == "actor-runs":
+                run = runs.get(parts[2])
+                if run is None:
+                    return self._send_json(404, {"error": {"type": "record-not-found"}})
+                wait = float(query.get("waitForFinish", ["0"])[0])
+                remaining = run["finishes_at"] - time.monotonic()
+                if remaining > 0 and wait > 0:
+                    time.sleep(min(remaining, wait))
+                return self._send_json(200, self._run_json(run))
+
+            if len(parts) == 4 and parts[1] == "datasets" and parts[3] == "items":
+                run = runs.get(parts[2])
+                if run is None:
+                    return self._send_json(404, {"error": {"type": "record-not-found"}})
+                offset = int(query.get("offset", ["0"])[0])
+                limit = int(query.get("limit", ["100"])[0])
+                return self._send_json(200, run["items"][offset:offset + limit])
+
+            self._send_json(404, {"error": {"type": "page-not-found"}})
+
+    return Handler
+
+
+def serve(
+    port: int = 0,
+    faults: Optional[FaultProfile] = None,
+    run_ms: float = 0,
+    host: str = "127.0.0.1"
+) -> ThreadingHTTPServer:
+    """Start the fake server on a daemon thread. server.stats counts requests and errors."""
+    stats = {"requests": 0, "errors": 0}
+    server = ThreadingHTTPServer((host, port), make_handler(faults or FaultProfile(), run_ms, stats))
+    server.daemon_threads = True
+    server.stats = stats
+    threading.Thread(target=server.serve_forever, name="fake-apify", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8102)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--run-ms", type=float, default=3000, help="how long each actor run takes")
+    args = parser.parse_args()
+    server = serve(args.port, FaultProfile(args.latency_ms, args.jitter_ms, args.error_rate), args.run_ms)
+    print(f"Fake Apify listening on http://127.0.0.1:{server.server_port}")
+    threading.Event().wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Local stand-in for the Gemini (Generative Language REST) API.
+
+Answers generateContent and streamGenerateContent with well-formed JSON for
+the prompts gemini_agent builds (single analysis, batched analysis, generated
+posts), after an injected delay. A configurable share of requests fails with
+429 / 500. Point the backend at it with:
+
+    GEMINI_API_KEY=anything GEMINI_API_ENDPOINT=http://127.0.0.1:<port>
+
+Run standalone: python -m bench.fake_gemini --port 8101 --latency-ms 800
+"""
+
+import re
+import json
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from bench.faults import FaultProfile
+
+TONES = ["Bold", "Vulnerable", "Data-Driven", "Contrarian", "Storytelling"]
+
+
+def _analysis(seed: int) -> dict:
+    return {
+        "overall_sentiment": 3 + seed % 3,
+        "tool_usefulness": 2 + seed % 4,
+        "common_questions": [
+            "What tools do you use for this?",
+            "How long did it take to see results?",
+            "Can you share a template?"
+        ],
+        "key_insights": (
+            "Readers responded to the concrete numbers and the honest account of what failed. "
+            "The skimmable list format made the advice easy to save and share."
+        )
+    }
+
+
+def _generated_post(i: int, tone: str) -> dict:
+    return {
+        "hook": f"Post {i + 1}: the one habit that changed how I work.",
+        "body": "Most advice is noise.\n\n→ Pick one metric\n→ Ship weekly\n→ Cut what doesn't move it",
+        "cta": "Which metric would you pick?",
+        "hashtags": ["growth", "careers", "productivity"],
+        "viral_score": 7 + i % 4,
+        "tone": tone
+    }
+
+
+def answer_for(prompt: str) -> str:
+    """Model text for a prompt built by gemini_agent."""
+    batch_ids = re.findall(r"=== POST (p\d+) ===", prompt)
+    if batch_ids:
+        return json.dumps([{"post_id": pid, **_analysis(int(pid[1:]))} for pid in batch_ids])
+
+    if '"hook"' in prompt:
+        match = re.search(r"Generate exactly (\d+)", prompt)
+        count = int(match.group(1)) if match else 3
+        return json.dumps([_generated_post(i, TONES[i % len(TONES)]) for i in range(count)])
+
+    return "```json\n" + json.dumps(_analysis(len(prompt))) + "\n```"
+
+
+def _response_json(text: str, prompt: str) -> dict:
+    return {
+        "candidates": [{
+            "content": {"parts": [{"text": text}], "role": "model"},
+            "finishReason": 1,
+            "index": 0
+        }],
+        "usageMetadata": {
+            "promptTokenCount": len(prompt) // 4,
+            "candidatesTokenCount": len(text) // 4,
+            "totalTokenCount": (len(prompt) + len(text)) // 4
+        }
+    }
+
+
+def make_handler(faults: FaultProfile, stats: dict):
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status: int, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            parts = request.get("contents", [{}])[0].get("parts", [{}])
+            prompt = "".join(p.get("text", "") for p in parts)
+            streaming = ":streamGenerateContent" in self.path
+            with lock:
+                stats["requests"] += 1
+
+            faults.delay()
+            if faults.should_fail():
+                with lock:
+                    stats["errors"] += 1
+                status = 429 if stats["errors"] % 2 else 500
+                return self._send_json(status, {"error": {
+                    "code": status,
+                    "message": "Injected failure",
+                    "status": "RESOURCE_EXHAUSTED" if status == 429 else "INTERNAL"
+                }})
+
+            text = answer_for(prompt)
+            if request.get("generationConfig", {}).get("responseMimeType") == "application/json":
+                text = text.strip("`").removeprefix("json").strip()
+            if not streaming:
+                return self._send_json(200, _response_json(text, prompt))
+
+            # REST streaming: a JSON array whose elements arrive as separate chunks
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            pieces = [text[i:i + 40] for i in range(0, len(text), 40)] or [""]
+            self.wfile.write(b"[")
+            for n, piece in enumerate(pieces):
+                if n:
+                    self.wfile.write(b",\r\n")
+                self.wfile.write(json.dumps(_response_json(piece, prompt)).encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"]")
+
+    return Handler
+
+
+def serve(
+    port: int = 0,
+    faults: Optional[FaultProfile] = None,
+    host: str = "127.0.0.1"
+) -> ThreadingHTTPServer:
+    """Start the fake server on a daemon thread. server.stats counts requests and errors."""
+    stats = {"requests": 0, "errors": 0}
+    server = ThreadingHTTPServer((host, port), make_handler(faults or FaultProfile(), stats))
+    server.daemon_threads = True
+    server.stats = stats
+    threading.Thread(target=server.serve_forever, name="fake-gemini", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8101)
+    parser.add_argument("--latency-ms", type=float, default=800)
+    parser.add_argument("--jitter-ms", type=float, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server = serve(args.port, FaultProfile(args.latency_ms, args.jitter_ms, args.error_rate))
+    print(f"Fake Gemini listening on http://127.0.0.1:{server.server_port}")
+    threading.Event().wait()
+
+
+if __name__ == "__main__":
+    main()
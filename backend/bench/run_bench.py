@@ -0,0 +1,330 @@
+"""
+Offline end-to-end benchmark for the pipeline API.
+
+Starts the fake Gemini and Apify servers, runs the FastAPI app under uvicorn
+on a local port with a throwaway database, replays a request mix against it
+and reports throughput plus p50/p95/p99 latency per stage. Stage times come
+from the arrival of /api/run/stream events:
+
+  scrape   request sent → "posts"
+  analyze  "posts" → last "analysis"
+  generate last "analysis" → "generated"
+  persist  "generated" → "done"
+
+Results are saved as JSON so two versions can be compared. No network needed.
+
+Usage (from backend/):
+  python -m bench.run_bench --requests 40 --concurrency 8 --label before
+  python -m bench.run_bench --requests 40 --concurrency 8 --label after
+  python -m bench.run_bench --compare bench/results/before-*.json bench/results/after-*.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import datetime
+from typing import Dict, List, Optional
+
+from bench import fake_apify, fake_gemini
+from bench.faults import FaultProfile
+
+STAGES = ["ttfb", "scrape", "analyze", "generate", "persist", "total"]
+
+POPULAR_NICHES = [
+    ("growth and mindset", ["growth mindset", "personal growth"]),
+    ("b2b marketing", ["b2b marketing", "demand generation"]),
+    ("ai tools", ["ai tools", "productivity"]),
+    ("career change", ["career change", "job search"]),
+]
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+# ─── REQUEST MIXES ────────────────────────────────────────────────────────────
+
+def build_requests(mix: str, count: int, num_posts: int, cold: bool, seed: int) -> List[dict]:
+    """
+    Deterministic request bodies for a named mix:
+      default  60% popular niches, 30% one-off niches, 10% popular with per-post analysis
+      popular  only the popular niches (cache-friendly)
+      unique   every request a new niche (cache-hostile)
+      mock     built-in mock data, no fake services involved
+    """
+    rng = random.Random(seed)
+    requests_ = []
+    for i in range(count):
+        niche, keywords = rng.choice(POPULAR_NICHES)
+        body = {
+            "niche": niche,
+            "keywords": keywords,
+            "num_posts": num_posts,
+            "use_mock": False,
+            "apify_token": "bench-token",
+            "use_cache": not cold,
+        }
+        roll = rng.random()
+        if mix == "mock":
+            body.update(use_mock=True, apify_token=None)
+        elif mix == "unique" or (mix == "default" and 0.6 <= roll < 0.9):
+            body.update(niche=f"niche {seed}-{i}", keywords=[f"niche {seed}-{i}"])
+        elif mix == "default" and roll >= 0.9:
+            body.update(batch_analysis=False)
+        elif mix not in ("default", "popular"):
+            raise ValueError(f"Unknown mix: {mix}")
+        requests_.append(body)
+    return requests_
+
+
+# ─── STATS ────────────────────────────────────────────────────────────────────
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Linear-interpolated percentile of an unsorted list."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(samples: List[dict], wall_seconds: float) -> dict:
+    ok = [s for s in samples if s["ok"]]
+    stages = {}
+    for stage in STAGES:
+        values = [s[stage] for s in ok if s.get(stage) is not None]
+        if not values:
+            continue
+        stages[stage] = {
+            "count": len(values),
+            "mean_ms": round(sum(values) / len(values), 2),
+            "p50_ms": round(percentile(values, 50), 2),
+            "p95_ms": round(percentile(values, 95), 2),
+            "p99_ms": round(percentile(values, 99), 2),
+            "max_ms": round(max(values), 2),
+        }
+    return {
+        "requests": len(samples),
+        "succeeded": len(ok),
+        "failed": len(samples) - len(ok),
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_rps": round(len(ok) / wall_seconds, 3) if wall_seconds else None,
+        "stages": stages,
+    }
+
+
+# ─── DRIVER ───────────────────────────────────────────────────────────────────
+
+async def _timed_stream(client, body: dict) -> dict:
+    t0 = time.perf_counter()
+    marks: Dict[str, float] = {}
+    sample = {"niche": body["niche"], "ok": False}
+    try:
+        async with client.stream("POST", "/api/run/stream", json=body) as response:
+            async for line in response.aiter_lines():
+                now = time.perf_counter()
+                marks.setdefault("first_byte", now)
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                marks[event["event"]] = now
+                if event["event"] == "error":
+                    sample["error"] = event["data"].get("detail")
+    except Exception as e:
+        sample["error"] = str(e)
+
+    def span(start: Optional[float], end: Optional[float]) -> Optional[float]:
+        return (end - start) * 1000 if start is not None and end is not None else None
+
+    analyzed = marks.get("analysis", marks.get("posts"))
+    sample.update(
+        ok="done" in marks,
+        ttfb=span(t0, marks.get("first_byte")),
+        scrape=span(t0, marks.get("posts")),
+        analyze=span(marks.get("posts"), analyzed),
+        generate=span(analyzed, marks.get("generated")),
+        persist=span(marks.get("generated"), marks.get("done")),
+        total=span(t0, marks.get("done")),
+    )
+    return sample
+
+
+async def _timed_run(client, body: dict) -> dict:
+    t0 = time.perf_counter()
+    sample = {"niche": body["niche"], "ok": False}
+    try:
+        response = await client.post("/api/run", json=body)
+        sample["ok"] = response.status_code == 200
+        if not sample["ok"]:
+            sample["error"] = response.text[:200]
+    except Exception as e:
+        sample["error"] = str(e)
+    sample["total"] = (time.perf_counter() - t0) * 1000
+    return sample
+
+
+async def drive(base_url: str, bodies: List[dict], concurrency: int, endpoint: str) -> List[dict]:
+    import httpx
+
+    semaphore = asyncio.Semaphore(concurrency)
+    timed = _timed_stream if endpoint == "stream" else _timed_run
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=None) as client:
+        async def _one(body: dict) -> dict:
+            async with semaphore:
+                return await timed(client, body)
+        return await asyncio.gather(*(_one(b) for b in bodies))
+
+
+def start_app(env: Dict[str, str]):
+    """Import the app with the bench environment and serve it on a free local port."""
+    os.environ.update(env)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import uvicorn
+    import main
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    config = uvicorn.Config(main.app, log_level="warning", lifespan="on")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, thread, f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+def run(args) -> dict:
+    gemini = fake_gemini.serve(
+        faults=FaultProfile(args.gemini_latency_ms, args.gemini_jitter_ms, args.gemini_error_rate, seed=args.seed)
+    )
+    apify = fake_apify.serve(
+        faults=FaultProfile(args.apify_latency_ms, args.apify_jitter_ms, args.apify_error_rate, seed=args.seed),
+        run_ms=args.apify_run_ms
+    )
+    workdir = tempfile.mkdtemp(prefix="viral-bench-")
+    env = {
+        "GEMINI_API_KEY": "bench-key",
+        "GEMINI_API_ENDPOINT": f"http://127.0.0.1:{gemini.server_port}",
+        "APIFY_API_BASE": f"http://127.0.0.1:{apify.server_port}",
+        "VIRAL_DB_PATH": os.path.join(workdir, "bench.db"),
+    }
+    server, thread, base_url = start_app(env)
+
+    bodies = build_requests(args.mix, args.warmup + args.requests, args.num_posts, args.cold, args.seed)
+    try:
+        if args.warmup:
+            asyncio.run(drive(base_url, bodies[:args.warmup], args.concurrency, args.endpoint))
+        gemini_before, apify_before = dict(gemini.stats), dict(apify.stats)
+        started = time.perf_counter()
+        samples = asyncio.run(drive(base_url, bodies[args.warmup:], args.concurrency, args.endpoint))
+        wall = time.perf_counter() - started
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+        gemini.shutdown()
+        apify.shutdown()
+
+    return {
+        "label": args.label,
+        "created_at": datetime.datetime.utcnow().isoformat(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("compare", "out")},
+        "summary": summarize(samples, wall),
+        "upstream": {
+            "gemini_requests": gemini.stats["requests"] - gemini_before["requests"],
+            "gemini_errors": gemini.stats["errors"] - gemini_before["errors"],
+            "apify_requests": apify.stats["requests"] - apify_before["requests"],
+            "apify_errors": apify.stats["errors"] - apify_before["errors"],
+        },
+        "samples": samples,
+    }
+
+
+# ─── REPORTING ────────────────────────────────────────────────────────────────
+
+def print_report(result: dict):
+    summary = result["summary"]
+    print(f"\n{result['label']}  ({result['created_at']})")
+    print(
+        f"  {summary['succeeded']}/{summary['requests']} ok in {summary['wall_seconds']}s "
+        f"→ {summary['throughput_rps']} req/s   upstream: {result['upstream']}"
+    )
+    print(f"  {'stage':<10}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}   (ms)")
+    for stage in STAGES:
+        s = summary["stages"].get(stage)
+        if s:
+            print(
+                f"  {stage:<10}{s['mean_ms']:>10.1f}{s['p50_ms']:>10.1f}"
+                f"{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}{s['max_ms']:>10.1f}"
+            )
+
+
+def compare(path_a: str, path_b: str):
+    with open(path_a) as f:
+        a = json.load(f)
+    with open(path_b) as f:
+        b = json.load(f)
+
+    def delta(old: Optional[float], new: Optional[float]) -> str:
+        if not old or new is None:
+            return "n/a"
+        return f"{(new - old) / old * 100:+.1f}%"
+
+    print(f"A = {a['label']} ({path_a})\nB = {b['label']} ({path_b})")
+    ta, tb = a["summary"]["throughput_rps"], b["summary"]["throughput_rps"]
+    print(f"throughput  A {ta} req/s   B {tb} req/s   {delta(ta, tb)}")
+    print(f"{'stage':<10}{'metric':<8}{'A (ms)':>12}{'B (ms)':>12}{'change':>10}")
+    for stage in STAGES:
+        sa, sb = a["summary"]["stages"].get(stage), b["summary"]["stages"].get(stage)
+        if not sa or not sb:
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            print(f"{stage:<10}{metric[:-3]:<8}{sa[metric]:>12.1f}{sb[metric]:>12.1f}{delta(sa[metric], sb[metric]):>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--label", default="run")
+    parser.add_argument("--mix", default="default", choices=["default", "popular", "unique", "mock"])
+    parser.add_argument("--endpoint", default="stream", choices=["stream", "run"],
+                        help="stream gives per-stage timings; run measures /api/run end to end")
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--warmup", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--num-posts", type=int, default=10)
+    parser.add_argument("--cold", action="store_true", help="send use_cache=false on every request")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--gemini-latency-ms", type=float, default=800)
+    parser.add_argument("--gemini-jitter-ms", type=float, default=300)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.02)
+    parser.add_argument("--apify-latency-ms", type=float, default=60)
+    parser.add_argument("--apify-jitter-ms", type=float, default=20)
+    parser.add_argument("--apify-error-rate", type=float, default=0.0)
+    parser.add_argument("--apify-run-ms", type=float, default=2000)
+    parser.add_argument("--out", default=RESULTS_DIR, help="directory for the JSON result")
+    parser.add_argument("--compare", nargs=2, metavar=("A.json", "B.json"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    result = run(args)
+    print_report(result)
+    os.makedirs(args.out, exist_ok=True)
+    stamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+    path = os.path.join(args.out, f"{args.label}-{stamp}.json")
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nSaved {path}")
+
+
+if __name__ == "__main__":
+    main()
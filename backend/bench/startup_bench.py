@@ -0,0 +1,181 @@
+"""
+Cold-start benchmark for the backend.
+
+Each round starts fresh Python processes, so nothing is warm from a previous
+round:
+
+  import   time to `import main` in a new interpreter, and which heavy
+           optional dependencies that import pulled in
+  ready    uvicorn process spawned → GET / answers
+  first    GET / answered → first mock-mode POST /api/run answered
+  total    spawn → first run answered (ready + first)
+
+The app runs in mock mode (no GEMINI_API_KEY, use_mock) against a throwaway
+database. Results are saved as JSON so two versions can be compared.
+
+Usage (from backend/):
+  python -m bench.startup_bench --rounds 5 --label before
+  python -m bench.startup_bench --compare bench/results/startup-before-*.json bench/results/startup-after-*.json
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import datetime
+import subprocess
+import urllib.error
+import urllib.request
+from typing import Dict, Optional
+
+from bench.run_bench import RESULTS_DIR, percentile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+METRICS = ["import", "ready", "first", "total"]
+# Modules a mock-mode worker should not need to load
+HEAVY_MODULES = ["google.generativeai", "google.api_core", "grpc", "requests", "urllib3"]
+
+_IMPORT_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import main
+elapsed = time.perf_counter() - started
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def _env(workdir: str) -> Dict[str, str]:
+    # An empty key (rather than none) also keeps a .env file from switching the worker to live mode
+    return {**os.environ, "VIRAL_DB_PATH": os.path.join(workdir, "startup.db"), "GEMINI_API_KEY": ""}
+
+
+def measure_import(workdir: str) -> dict:
+    out = subprocess.run(
+        [sys.executable, "-c", _IMPORT_PROBE],
+        cwd=BACKEND_DIR, env=_env(workdir), capture_output=True, text=True, check=True
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _request(url: str, body: Optional[dict] = None, timeout: float = 30) -> int:
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=timeout) as response:
+        response.read()
+        return response.status
+
+
+def measure_first_request(workdir: str, timeout: float = 60) -> dict:
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=_env(workdir), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while True:
+            if proc.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {proc.returncode}")
+            if time.perf_counter() - started > timeout:
+                raise TimeoutError("Server did not come up in time")
+            try:
+                _request(f"{base}/", timeout=1)
+                break
+            except (urllib.error.URLError, ConnectionError, OSError):
+                time.sleep(0.005)
+        ready = time.perf_counter()
+        _request(f"{base}/api/run", {"niche": "startup bench", "num_posts": 3, "use_mock": True}, timeout=timeout)
+        done = time.perf_counter()
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    return {"ready": ready - started, "first": done - ready, "total": done - started}
+
+
+def run(args) -> dict:
+    samples = []
+    for i in range(args.rounds):
+        workdir = tempfile.mkdtemp(prefix="viral-startup-")
+        probe = measure_import(workdir)
+        sample = {"import": probe["seconds"], "loaded": probe["loaded"]}
+        sample.update(measure_first_request(workdir))
+        samples.append(sample)
+        print(f"  round {i + 1}: " + "  ".join(f"{m} {sample[m] * 1000:.0f}ms" for m in METRICS))
+
+    summary = {}
+    for metric in METRICS:
+        values = [s[metric] * 1000 for s in samples]
+        summary[metric] = {
+            "mean_ms": round(sum(values) / len(values), 1),
+            "p50_ms": round(percentile(values, 50), 1),
+            "max_ms": round(max(values), 1),
+        }
+    return {
+        "label": args.label,
+        "created_at": datetime.datetime.utcnow().isoformat(),
+        "config": {"rounds": args.rounds, "python": sys.version.split()[0]},
+        "summary": summary,
+        "heavy_modules_loaded": sorted({m for s in samples for m in s["loaded"]}),
+        "samples": samples,
+    }
+
+
+def print_report(result: dict):
+    print(f"\nstartup {result['label']}  ({result['created_at']})")
+    print(f"  {'metric':<10}{'mean':>10}{'p50':>10}{'max':>10}   (ms)")
+    for metric in METRICS:
+        s = result["summary"][metric]
+        print(f"  {metric:<10}{s['mean_ms']:>10.1f}{s['p50_ms']:>10.1f}{s['max_ms']:>10.1f}")
+    print(f"  heavy modules loaded by import: {', '.join(result['heavy_modules_loaded']) or 'none'}")
+
+
+def compare(path_a: str, path_b: str):
+    with open(path_a) as f:
+        a = json.load(f)
+    with open(path_b) as f:
+        b = json.load(f)
+    print(f"A = {a['label']} ({path_a})\nB = {b['label']} ({path_b})")
+    print(f"{'metric':<10}{'A p50':>12}{'B p50':>12}{'change':>10}")
+    for metric in METRICS:
+        pa, pb = a["summary"][metric]["p50_ms"], b["summary"][metric]["p50_ms"]
+        change = f"{(pb - pa) / pa * 100:+.1f}%" if pa else "n/a"
+        print(f"{metric:<10}{pa:>12.1f}{pb:>12.1f}{change:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--label", default="run")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--out", default=RESULTS_DIR, help="directory for the JSON result")
+    parser.add_argument("--compare", nargs=2, metavar=("A.json", "B.json"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    result = run(args)
+    print_report(result)
+    os.makedirs(args.out, exist_ok=True)
+    stamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+    path = os.path.join(args.out, f"startup-{args.label}-{stamp}.json")
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nSaved {path}")
+
+
+if __name__ == "__main__":
+    main()
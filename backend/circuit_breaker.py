@@ -0,0 +1,225 @@
+"""
+Circuit breakers for external dependencies (Gemini, Apify)
+- closed: calls go through; consecutive failures are counted
+- open: after *_CIRCUIT_FAILURES consecutive failures, calls fail fast with
+  CircuitOpenError (callers fall back to mock data) for *_CIRCUIT_OPEN_SECONDS
+- half_open: then one caller is let through as a probe; success closes the
+  circuit, failure opens it again
+- State lives in the app's SQLite database (via storage), so every worker
+  process sees the same circuit; claiming the probe is a compare-and-set, so
+  only one worker sends it
+"""
+
+import os
+import time
+import sqlite3
+import datetime
+import threading
+from typing import Dict, Optional
+import storage
+import metrics
+
+# How long a worker trusts its last read of a closed circuit before checking the database again
+CIRCUIT_SYNC_SECONDS = float(os.getenv("CIRCUIT_SYNC_SECONDS", "1"))
+
+STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a dependency whose circuit is open."""
+
+
+def init_circuit_table():
+    with storage.transaction() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS circuit_breakers (
+                name TEXT PRIMARY KEY,
+                state TEXT,
+                failures INTEGER,
+                opened_at REAL,
+                probe_at REAL,
+                updated_at REAL
+            )
+        """)
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int, open_seconds: float):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        # Last row read from or written to the database, and when (time.monotonic())
+        self._cached: Optional[dict] = None
+        self._cached_at = 0.0
+
+    def _read(self, conn: sqlite3.Connection) -> dict:
+        row = conn.execute("SELECT * FROM circuit_breakers WHERE name = ?", (self.name,)).fetchone()
+        if row is None:
+            with conn:
+                conn.execute(
+                    "INSERT OR IGNORE INTO circuit_breakers (name, state, failures, opened_at, probe_at, updated_at) "
+                    "VALUES (?, 'closed', 0, NULL, NULL, ?)",
+                    (self.name, time.time())
+                )
+            row = conn.execute("SELECT * FROM circuit_breakers WHERE name = ?", (self.name,)).fetchone()
+        return dict(row)
+
+    def _remember(self, row: dict):
+        with self._lock:
+            self._cached = row
+            self._cached_at = time.monotonic()
+        metrics.CIRCUIT_STATE.set(STATES[row["state"]], dependency=self.name)
+
+    def _current(self) -> Optional[dict]:
+        with self._lock:
+            if self._cached and time.monotonic() - self._cached_at < CIRCUIT_SYNC_SECONDS:
+                return self._cached
+        return None
+
+    def allow(self) -> bool:
+        """
+        Whether a call may go to the dependency now. An open circuit whose
+        open period has passed lets exactly one caller (across workers) through
+        as the half-open probe; a probe that never reports back is replaced
+        after another open period.
+        """
+        now = time.time()
+        cached = self._current()
+        if cached and cached["state"] == "closed":
+            return True
+        if cached and cached["state"] == "open" and now - cached["opened_at"] < self.open_seconds:
+            metrics.CIRCUIT_REJECTED.inc(dependency=self.name)
+            return False
+
+        with storage.connection() as conn:
+            row = self._read(conn)
+            if row["state"] != "closed":
+                since = row["probe_at"] if row["state"] == "half_open" else row["opened_at"]
+                if now - (since or 0) < self.open_seconds:
+                    self._remember(row)
+                    metrics.CIRCUIT_REJECTED.inc(dependency=self.name)
+                    return False
+                with conn:
+                    claimed = conn.execute(
+                        "UPDATE circuit_breakers SET state = 'half_open', probe_at = ?, updated_at = ? "
+                        "WHERE name = ? AND state = ? AND updated_at = ?",
+                        (now, now, self.name, row["state"], row["updated_at"])
+                    ).rowcount
+                if not claimed:
+                    # Another worker took the probe first
+                    metrics.CIRCUIT_REJECTED.inc(dependency=self.name)
+                    return False
+                print(f"[Circuit] {self.name}: half-open, sending a probe")
+                row = self._read(conn)
+        self._remember(row)
+        return True
+
+    def record_success(self):
+        cached = self._current()
+        if cached and cached["state"] == "closed" and not cached["failures"]:
+            return
+        now = time.time()
+        with storage.connection() as conn:
+            with conn:
+                conn.execute(
+                    "UPDATE circuit_breakers SET state = 'closed', failures = 0, opened_at = NULL, "
+                    "probe_at = NULL, updated_at = ? WHERE name = ?",
+                    (now, self.name)
+                )
+            row = self._read(conn)
+        if cached and cached["state"] != "closed":
+            print(f"[Circuit] {self.name}: closed")
+        self._remember(row)
+
+    def record_failure(self):
+        """Count a failed call; opens the circuit at the threshold or when a probe fails."""
+        now = time.time()
+        with storage.connection() as conn:
+            self._read(conn)
+            with conn:
+                # The increment takes the write lock, so the check below sees no concurrent change
+                conn.execute(
+                    "UPDATE circuit_breakers SET failures = failures + 1, updated_at = ? WHERE name = ?",
+                    (now, self.name)
+                )
+                row = dict(conn.execute("SELECT * FROM circuit_breakers WHERE name = ?", (self.name,)).fetchone())
+                if row["state"] == "half_open" or (
+                    row["state"] == "closed" and row["failures"] >= self.failure_threshold
+                ):
+                    conn.execute(
+                        "UPDATE circuit_breakers SET state = 'open', opened_at = ?, probe_at = NULL WHERE name = ?",
+                        (now, self.name)
+                    )
+                    print(f"[Circuit] {self.name}: open after {row['failures']} consecutive failure(s)")
+                    metrics.CIRCUIT_OPENED.inc(dependency=self.name)
+            row = self._read(conn)
+        self._remember(row)
+
+    def release_probe(self):
+        """
+        Give up a half-open probe that ended without reaching the dependency
+        (queue timeout, cancellation), so the next caller may probe right away
+        instead of waiting out another open period.
+        """
+        cached = self._current()
+        if cached and cached["state"] == "closed":
+            return
+        now = time.time()
+        with storage.connection() as conn:
+            with conn:
+                conn.execute(
+                    "UPDATE circuit_breakers SET state = 'open', opened_at = ?, probe_at = NULL, updated_at = ? "
+                    "WHERE name = ? AND state = 'half_open'",
+                    (now - self.open_seconds, now, self.name)
+                )
+            row = self._read(conn)
+        self._remember(row)
+
+    def reset(self):
+        """Force the circuit closed."""
+        with storage.connection() as conn:
+            with conn:
+                conn.execute(
+                    "UPDATE circuit_breakers SET state = 'closed', failures = 0, opened_at = NULL, "
+                    "probe_at = NULL, updated_at = ? WHERE name = ?",
+                    (time.time(), self.name)
+                )
+            row = self._read(conn)
+        self._remember(row)
+
+    def state(self) -> dict:
+        with storage.connection() as conn:
+            row = self._read(conn)
+        self._remember(row)
+
+        def _iso(ts: Optional[float]) -> Optional[str]:
+            return datetime.datetime.utcfromtimestamp(ts).isoformat() if ts else None
+
+        retry_at = row["opened_at"] + self.open_seconds if row["state"] == "open" else None
+        return {
+            "state": row["state"],
+            "consecutive_failures": row["failures"],
+            "opened_at": _iso(row["opened_at"]),
+            "probe_at": _iso(row["probe_at"]),
+            "retry_at": _iso(retry_at),
+            "failure_threshold": self.failure_threshold,
+            "open_seconds": self.open_seconds,
+        }
+
+
+gemini = CircuitBreaker(
+    "gemini",
+    int(os.getenv("GEMINI_CIRCUIT_FAILURES", "5")),
+    float(os.getenv("GEMINI_CIRCUIT_OPEN_SECONDS", "30"))
+)
+apify = CircuitBreaker(
+    "apify",
+    int(os.getenv("APIFY_CIRCUIT_FAILURES", "3")),
+    float(os.getenv("APIFY_CIRCUIT_OPEN_SECONDS", "60"))
+)
+BREAKERS: Dict[str, CircuitBreaker] = {b.name: b for b in (gemini, apify)}
+
+
+def states() -> Dict[str, dict]:
+    return {name: breaker.state() for name, breaker in BREAKERS.items()}
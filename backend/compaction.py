@@ -0,0 +1,181 @@
+"""
+Prompt compaction for Viral Content System
+- compact_comments: drops low-information comments, merges near-duplicates
+  (character-shingle MinHash + LSH, confirmed by exact Jaccard) and keeps the
+  most representative comments within a token budget
+- compact_post: compacts a post's comments_text before it is put in a prompt,
+  recording the tokens saved in metrics
+"""
+
+import os
+import re
+import zlib
+import random
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+import metrics
+
+PROMPT_COMPACTION = os.getenv("PROMPT_COMPACTION", "1") == "1"
+# Estimated token budget for the comments of one post
+COMMENT_TOKEN_BUDGET = int(os.getenv("COMMENT_TOKEN_BUDGET", "300"))
+# Shingle Jaccard similarity at or above which two comments count as duplicates
+COMMENT_DUP_THRESHOLD = float(os.getenv("COMMENT_DUP_THRESHOLD", "0.6"))
+
+_SHINGLE_SIZE = 4
+# 8 bands × 4 rows puts the LSH candidate threshold near 0.6 similarity
+_LSH_BANDS = 8
+_LSH_ROWS = 4
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601)
+_HASH_PARAMS = [
+    (_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(_LSH_BANDS * _LSH_ROWS)
+]
+
+_WORD = re.compile(r"[a-z0-9']+")
+
+# Words that carry no insight on their own ("Great post!", "Saving this", "Thanks for sharing")
+_FILLER = {
+    "a", "an", "the", "this", "that", "it", "is", "so", "very", "really", "just", "and", "to",
+    "for", "of", "my", "me", "i", "you", "your", "post", "great", "good", "nice", "awesome",
+    "amazing", "love", "loved", "thanks", "thank", "sharing", "share", "saving", "saved", "save",
+    "later", "bookmarked", "bookmarking", "agree", "agreed", "true", "yes", "wow", "cool",
+    "insightful", "helpful", "useful", "well", "said", "100", "exactly", "same", "here", "much",
+    "interesting", "brilliant", "excellent", "congrats", "congratulations", "spot", "on", "point",
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token), matching gemini_agent."""
+    return len(text) // 4 + 1
+
+
+def _normalize(comment: str) -> str:
+    return " ".join(_WORD.findall(comment.lower()))
+
+
+def is_low_information(comment: str) -> bool:
+    """Reactions with fewer than two informative words; questions are always kept."""
+    words = _WORD.findall(comment.lower())
+    if "?" in comment and words:
+        return False
+    return sum(1 for w in words if w not in _FILLER) < 2
+
+
+def _shingles(text: str) -> set:
+    if len(text) <= _SHINGLE_SIZE:
+        return {text}
+    return {text[i:i + _SHINGLE_SIZE] for i in range(len(text) - _SHINGLE_SIZE + 1)}
+
+
+def _minhash(shingles: set) -> List[int]:
+    hashes = [zlib.crc32(s.encode("utf-8")) for s in shingles]
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _HASH_PARAMS]
+
+
+def _jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def _duplicate_groups(texts: List[str]) -> List[List[int]]:
+    """
+    Group indices of near-duplicate texts. Exact repeats are merged up front;
+    LSH over MinHash signatures finds candidate pairs and exact shingle
+    Jaccard confirms them.
+    """
+    parent = list(range(len(texts)))
+    first_seen: Dict[str, int] = {}
+    for i, text in enumerate(texts):
+        parent[i] = first_seen.setdefault(text, i)
+    unique = sorted(set(first_seen.values()))
+    shingles = {i: _shingles(texts[i]) for i in unique}
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    buckets: Dict[Tuple[int, tuple], List[int]] = {}
+    for i in unique:
+        sh = shingles[i]
+        signature = _minhash(sh)
+        for band in range(_LSH_BANDS):
+            rows = tuple(signature[band * _LSH_ROWS:(band + 1) * _LSH_ROWS])
+            for j in buckets.setdefault((band, rows), []):
+                if find(i) != find(j) and _jaccard(sh, shingles[j]) >= COMMENT_DUP_THRESHOLD:
+                    parent[find(i)] = find(j)
+            buckets[(band, rows)].append(i)
+
+    groups: Dict[int, List[int]] = {}
+    for i in range(len(texts)):
+        groups.setdefault(find(i), []).append(i)
+    return list(groups.values())
+
+
+def compact_comments(comments: List[str], token_budget: Optional[int] = None) -> Tuple[List[str], dict]:
+    """
+    Return (compacted comment lines, report). Near-duplicates collapse into
+    their most informative member, annotated with the group size ("(×3)").
+    Groups are kept largest first, questions before statements, until the
+    token budget is used; the kept lines stay in their original order.
+    Dropped short reactions are summarized in one trailing line so their
+    sentiment still reaches the model.
+    """
+    budget = COMMENT_TOKEN_BUDGET if token_budget is None else token_budget
+    originals = [str(c).strip() for c in comments or [] if str(c).strip()]
+    tokens_before = sum(estimate_tokens(f"- {c}") for c in originals)
+
+    informative = [c for c in originals if not is_low_information(c)]
+    reactions = [c for c in originals if is_low_information(c)]
+
+    normalized = [_normalize(c) for c in informative]
+    groups = _duplicate_groups(normalized)
+
+    def _info(i: int) -> int:
+        return sum(1 for w in normalized[i].split() if w not in _FILLER)
+
+    ranked = sorted(
+        groups,
+        key=lambda g: (-len(g), not any("?" in informative[i] for i in g), min(g))
+    )
+    kept, used, dropped_budget = [], 0, 0
+    for group in ranked:
+        rep = max(group, key=lambda i: (_info(i), -i))
+        line = informative[rep] + (f" (×{len(group)})" if len(group) > 1 else "")
+        cost = estimate_tokens(f"- {line}")
+        if kept and used + cost > budget:
+            dropped_budget += len(group)
+            continue
+        kept.append((min(group), line))
+        used += cost
+
+    lines = [line for _, line in sorted(kept)]
+    if reactions:
+        counts = Counter(_normalize(c) for c in reactions)
+        sample = next(c for c in reactions if _normalize(c) == counts.most_common(1)[0][0])
+        lines.append(f"(+{len(reactions)} short reactions such as \"{sample}\")")
+
+    tokens_after = sum(estimate_tokens(f"- {line}") for line in lines)
+    report = {
+        "comments_in": len(originals),
+        "comments_out": len(lines),
+        "dropped_low_info": len(reactions),
+        "merged_duplicates": len(informative) - len(groups),
+        "dropped_budget": dropped_budget,
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "tokens_saved": max(0, tokens_before - tokens_after),
+    }
+    return lines, report
+
+
+def compact_post(post: dict) -> dict:
+    """Copy of post with compacted comments_text (the post itself when compaction is off)."""
+    if not PROMPT_COMPACTION or not post.get("comments_text"):
+        return post
+    lines, report = compact_comments(post["comments_text"])
+    metrics.PROMPT_TOKENS_SAVED.inc(report["tokens_saved"])
+    metrics.COMMENTS_COMPACTED.inc(report["dropped_low_info"], reason="low_info")
+    metrics.COMMENTS_COMPACTED.inc(report["merged_duplicates"], reason="duplicate")
+    metrics.COMMENTS_COMPACTED.inc(report["dropped_budget"], reason="budget")
+    return {**post, "comments_text": lines}
@@ -0,0 +1,76 @@
+"""
+Bulk export of history tables
+- iter_export: encodes a table ("analyses" or "generated") as NDJSON or CSV,
+  optionally gzipped, as a stream of byte chunks
+- Rows are read in keyset chunks (storage.iter_history), so memory use does
+  not grow with the table and no connection or read snapshot is held between
+  chunks; pipeline writes carry on while an export runs
+"""
+
+import io
+import os
+import csv
+import json
+import zlib
+from typing import Iterator, Optional
+import storage
+import metrics
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "1000"))
+
+CONTENT_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+
+def _encode_ndjson(table: str, chunks: Iterator[list]) -> Iterator[str]:
+    for rows in chunks:
+        yield "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+
+
+def _encode_csv(table: str, chunks: Iterator[list]) -> Iterator[str]:
+    columns = storage.history_columns(table)
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore")
+    writer.writeheader()
+    yield buffer.getvalue()
+    for rows in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+
+def iter_export(
+    table: str,
+    fmt: str = "ndjson",
+    compress: bool = False,
+    niche: Optional[str] = None,
+    platform: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None
+) -> Iterator[bytes]:
+    """Encoded rows of a history table, oldest first, one chunk of rows per item."""
+    exported = 0
+
+    def _counted(chunks: Iterator[list]) -> Iterator[list]:
+        nonlocal exported
+        for rows in chunks:
+            exported += len(rows)
+            yield rows
+
+    chunks = _counted(storage.iter_history(
+        table, EXPORT_CHUNK_ROWS, niche=niche, platform=platform, since=since, until=until
+    ))
+    encode = _encode_csv if fmt == "csv" else _encode_ndjson
+    # wbits=31: gzip container, so the output is a regular .gz file
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    try:
+        for text in encode(table, chunks):
+            data = text.encode("utf-8")
+            if compressor:
+                data = compressor.compress(data)
+            if data:
+                yield data
+        if compressor:
+            yield compressor.flush()
+    finally:
+        metrics.EXPORTED_ROWS.inc(exported, table=table, format=fmt)
@@ -1,17 +1,57 @@
 """
 Gemini AI Agent for Viral Content System
 - analyze_sentiment: scores a post's comments for sentiment & insights
+- analyze_sentiment_batch: analyzes many posts in as few Gemini calls as possible
+- analyze_sentiment_many: runs analyze_sentiment for many posts concurrently
 - generate_viral_content: creates new viral LinkedIn posts based on analysis
+- generate_viral_content_stream: same, yielding text chunks as Gemini writes them
+- iter_viral_content_per_tone: one smaller request per tone in parallel, with
+  hedged duplicates for slow ones, keeping the first good results ranked locally
+
+The Gemini SDK (and its gRPC / protobuf tree) is imported on first use, so
+mock-mode workers never load it.
 """
 
 import os
-import json
-import re
-from typing import List, Optional
-import google.generativeai as genai
+import time
+import asyncio
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, AsyncIterator, Callable, Iterator, List, Optional, Tuple
+import response_cache
+import structured_output
+from structured_output import Analysis, BatchAnalysis, GeneratedPost, PartialOutput
+from circuit_breaker import CircuitOpenError
+import compaction
+import metrics
+import gemini_scheduler
+import prescore
 
 _gemini_configured = False
 
+MODEL_NAME = "gemini-1.5-flash"
+
+# Upper bound on Gemini calls in flight for one analyze_sentiment_many() call
+ANALYSIS_MAX_CONCURRENCY = int(os.getenv("ANALYSIS_MAX_CONCURRENCY", "8"))
+
+# Estimated prompt-token budget for one analyze_sentiment_batch() request
+ANALYSIS_BATCH_MAX_TOKENS = int(os.getenv("ANALYSIS_BATCH_MAX_TOKENS", "6000"))
+
+# Tokens reserved per post for the model's JSON answer when packing batches
+_BATCH_OUTPUT_TOKENS_PER_POST = 200
+
+# "single": all posts from one request; "per_tone": one request per tone in parallel
+GENERATION_MODE = os.getenv("GENERATION_MODE", "single")
+GENERATION_TONES = ["Bold", "Vulnerable", "Data-Driven", "Contrarian", "Storytelling"]
+# Posts kept in per_tone mode (the first good ones to arrive, ranked locally)
+GENERATION_KEEP = int(os.getenv("GENERATION_KEEP", "3"))
+# A tone request still unanswered after this long gets a duplicate (0 disables hedging)
+GENERATION_HEDGE_MS = int(os.getenv("GENERATION_HEDGE_MS", "4000"))
+
+# Request JSON matching a response schema (Gemini's JSON response mode). Switched
+# off for the process if the API rejects it, e.g. for a model without schema support
+GEMINI_STRUCTURED_OUTPUT = os.getenv("GEMINI_STRUCTURED_OUTPUT", "1") == "1"
+_structured_output_supported = True
+
 
 def _configure_gemini():
     global _gemini_configured
@@ -23,44 +63,120 @@ def _configure_gemini():
             "GEMINI_API_KEY not set. Add it to your .env file.\n"
             "Get a free key at: https://aistudio.google.com/app/apikey"
         )
-    genai.configure(api_key=api_key)
+    options = {"api_key": api_key}
+    # Point the SDK at another Generative Language endpoint, e.g. a local stand-in
+    endpoint = os.getenv("GEMINI_API_ENDPOINT")
+    if endpoint:
+        options["client_options"] = {"api_endpoint": endpoint}
+        options["transport"] = "rest"
+    if os.getenv("GEMINI_TRANSPORT"):
+        options["transport"] = os.getenv("GEMINI_TRANSPORT")
+    import google.generativeai as genai
+    genai.configure(**options)
     _gemini_configured = True
 
 
-def _parse_json_from_response(text: str) -> dict:
-    """Robustly extract JSON from Gemini response text."""
-    # Strip markdown code fences if present
-    text = re.sub(r"```(?:json)?", "", text).strip().rstrip("`").strip()
+def _generation_config(schema: Optional[dict]) -> Optional[dict]:
+    if schema is None or not (GEMINI_STRUCTURED_OUTPUT and _structured_output_supported):
+        return None
+    return {"response_mime_type": "application/json", "response_schema": schema}
 
-    # Find the first { ... } block
-    match = re.search(r"\{.*\}", text, re.DOTALL)
-    if match:
-        try:
-            return json.loads(match.group())
-        except json.JSONDecodeError:
-            pass
 
-    # Try parsing the whole thing
+def _call_model(prompt: str, config: Optional[dict], stream: bool = False):
+    """
+    generate_content through the quota-aware scheduler (see gemini_scheduler),
+    retrying once without JSON mode if the API rejects the schema.
+    """
+    global _structured_output_supported
+    from google.api_core import exceptions as google_exceptions
+    scheduler = gemini_scheduler.scheduler
+    model = scheduler.model(MODEL_NAME)
+    tokens = _estimate_tokens(prompt)
+
+    def _send(**kwargs):
+        # Under a deadline, the HTTP request itself may not outlive it either
+        left = gemini_scheduler.remaining()
+        if left is not None:
+            kwargs["request_options"] = {"timeout": max(left, 0.001)}
+        return model.generate_content(prompt, stream=stream, **kwargs)
+
+    if config is None:
+        return scheduler.call(_send, tokens)
     try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        return {}
-
-
-def analyze_sentiment(post: dict, platform: str = "LinkedIn") -> dict:
+        return scheduler.call(lambda: _send(generation_config=config), tokens)
+    except google_exceptions.BadRequest as e:
+        if "response_" not in str(e).lower():
+            raise
+        print(f"[Gemini] JSON response mode rejected, using plain prompts: {e}")
+        _structured_output_supported = False
+        return scheduler.call(_send, tokens)
+
+
+def _generate(
+    prompt: str,
+    parse: Callable[[str], Any],
+    use_cache: bool = True,
+    kind: str = "analysis",
+    schema: Optional[dict] = None
+) -> Any:
+    """
+    Call Gemini and return parse(response text), in JSON response mode with
+    schema when given and supported.
+    Responses are served from / stored in the persistent response cache;
+    only text that parses completely is cached. When parse salvages part of
+    the output (PartialOutput) that part is returned but not cached.
+    use_cache=False skips the lookup but still refreshes the stored entry.
+    kind labels the metrics.
+    """
+    config = _generation_config(schema)
+    key = response_cache.make_key(MODEL_NAME, prompt, config)
+    if use_cache:
+        cached = response_cache.get(key)
+        if cached is not None:
+            try:
+                with metrics.timed("json_parse"):
+                    result = parse(cached)
+                metrics.MODEL_CALLS.inc(kind=kind, outcome="cached")
+                return result
+            except Exception:
+                response_cache.discard(key)
+
+    metrics.PROMPT_CHARS.observe(len(prompt), kind=kind)
+    try:
+        with metrics.MODEL_CALL_SECONDS.time(kind=kind):
+            text = _call_model(prompt, config).text
+        metrics.RESPONSE_CHARS.observe(len(text), kind=kind)
+        with metrics.timed("json_parse"):
+            result = parse(text)
+    except PartialOutput as e:
+        print(f"[Gemini] Salvaged {len(e.result)} element(s) from incomplete {kind} output")
+        metrics.MODEL_CALLS.inc(kind=kind, outcome="salvaged")
+        return e.result
+    except Exception:
+        metrics.MODEL_CALLS.inc(kind=kind, outcome="error")
+        raise
+    metrics.MODEL_CALLS.inc(kind=kind, outcome="ok")
+    response_cache.put(key, MODEL_NAME, text)
+    return result
+
+
+def analyze_sentiment(post: dict, platform: str = "LinkedIn", use_cache: bool = True) -> dict:
     """
     Use Gemini to analyze the sentiment and extract insights from a post.
+    Comments are compacted (see compaction) before they go into the prompt.
     Returns a dict with: overall_sentiment, tool_usefulness, common_questions, key_insights
     """
     try:
         _configure_gemini()
     except EnvironmentError:
+        metrics.FALLBACKS.inc(component="analysis", reason="no_api_key")
         return _mock_sentiment_analysis(post)
 
-    post_text = post.get("text", "")
-    comments = post.get("comments_text", [])
-    comments_block = "\n".join(f"- {c}" for c in comments) if comments else "No comments available."
+    return _analyze_compacted(compaction.compact_post(post), platform, use_cache)
+
 
+def _analyze_compacted(post: dict, platform: str, use_cache: bool) -> dict:
+    """Single-post analysis of an already compacted post."""
     prompt = f"""You are a viral content analyst specializing in {platform} growth strategy.
 
 Analyze this {platform} post and its comments, then return a JSON object with exactly these fields:
@@ -72,16 +188,7 @@ Analyze this {platform} post and its comments, then return a JSON object with ex
   "key_insights": "<2-3 sentence summary of what resonates with the audience and why this post performed>"
 }}
 
-POST CONTENT:
-{post_text}
-
-COMMENTS FROM AUDIENCE:
-{comments_block}
-
-POST METRICS:
-- Likes: {post.get('likes', 0)}
-- Comments: {post.get('comments', 0)}
-- Shares: {post.get('shares', 0)}
+{_format_post_block(post)}
 
 Rules:
 - Scores must be integers (not decimals)
@@ -91,57 +198,515 @@ Rules:
 """
 
     try:
-        model = genai.GenerativeModel("gemini-1.5-flash")
-        response = model.generate_content(prompt)
-        result = _parse_json_from_response(response.text)
-
-        # Validate and sanitize
-        result["overall_sentiment"] = int(result.get("overall_sentiment", 3))
-        result["tool_usefulness"] = int(result.get("tool_usefulness", 3))
-        result["common_questions"] = result.get("common_questions", [])
-        result["key_insights"] = result.get("key_insights", "")
-
-        return result
+        return _generate(
+            prompt,
+            lambda text: structured_output.parse_object(text, Analysis),
+            use_cache=use_cache,
+            schema=structured_output.ANALYSIS_SCHEMA
+        )
 
     except Exception as e:
         print(f"[Gemini] Sentiment analysis error: {e}")
+        metrics.FALLBACKS.inc(component="analysis", reason=_fallback_reason(e))
         return _mock_sentiment_analysis(post)
 
 
-def generate_viral_content(niche: str, platform: str, analyses: List[dict]) -> List[dict]:
+def analyze_sentiment_batch(
+    posts: List[dict],
+    platform: str = "LinkedIn",
+    max_tokens_per_batch: Optional[int] = None,
+    use_cache: bool = True
+) -> List[dict]:
+    """
+    Analyze many posts with as few Gemini calls as possible.
+    Posts are packed into prompts of at most max_tokens_per_batch (estimated)
+    tokens, each returning a JSON array keyed by post_id. Posts the model
+    drops or mangles from an answered batch are retried individually with
+    analyze_sentiment; a batch whose call fails (the scheduler has already
+    retried it) falls back to mock analyses as a whole, so an outage or
+    throttling does not fan out into one request per post. Past the
+    caller's deadline (gemini_scheduler.deadline), dropped posts are scored
+    locally (tagged "degraded") instead of retried.
+    Returns one analysis dict per post, in input order.
+    """
+    if not posts:
+        return []
+
+    try:
+        _configure_gemini()
+    except EnvironmentError:
+        metrics.FALLBACKS.inc(len(posts), component="analysis", reason="no_api_key")
+        return [_mock_sentiment_analysis(p) for p in posts]
+
+    posts = [compaction.compact_post(p) for p in posts]
+    budget = max_tokens_per_batch or ANALYSIS_BATCH_MAX_TOKENS
+    batches = _pack_batches(posts, platform, budget)
+
+    def _run_batch(indices: List[int]):
+        try:
+            return _analyze_batch(indices, posts, platform, use_cache)
+        except Exception as e:
+            return e
+
+    results: List[Optional[dict]] = [None] * len(posts)
+    circuit_open = False
+    workers = max(1, min(len(batches), ANALYSIS_MAX_CONCURRENCY))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for indices, batch_results in zip(batches, pool.map(gemini_scheduler.bind(_run_batch), batches)):
+            if isinstance(batch_results, Exception):
+                if isinstance(batch_results, CircuitOpenError):
+                    circuit_open = True
+                else:
+                    print(f"[Gemini] Batch sentiment analysis error: {batch_results}")
+                metrics.FALLBACKS.inc(len(indices), component="analysis", reason=_fallback_reason(batch_results))
+                for i in indices:
+                    results[i] = _mock_sentiment_analysis(posts[i])
+                continue
+            for i in indices:
+                results[i] = batch_results.get(i)
+
+        missing = [i for i, r in enumerate(results) if r is None]
+        if missing and circuit_open:
+            # Retries would only be rejected by the open circuit one by one
+            metrics.FALLBACKS.inc(len(missing), component="analysis", reason="circuit_open")
+            for i in missing:
+                results[i] = _mock_sentiment_analysis(posts[i])
+        elif missing and gemini_scheduler.remaining() == 0:
+            # Past the caller's deadline: no time for retries, score the rest locally
+            metrics.FALLBACKS.inc(len(missing), component="analysis", reason="deadline")
+            for i, analysis in zip(missing, prescore.analyze_locally([posts[i] for i in missing])):
+                results[i] = {**analysis, "degraded": True}
+        elif missing:
+            print(f"[Gemini] Batch analysis dropped {len(missing)} post(s); retrying individually")
+            metrics.MODEL_RETRIES.inc(len(missing), kind="batch_analysis")
+            retry = gemini_scheduler.bind(lambda i: _analyze_compacted(posts[i], platform, use_cache))
+            for i, analysis in zip(missing, pool.map(retry, missing)):
+                results[i] = analysis
+
+    return results
+
+
+def _pack_batches(posts: List[dict], platform: str, budget: int) -> List[List[int]]:
+    """Greedily group post indices so each batch prompt fits the token budget."""
+    overhead = _estimate_tokens(_batch_prompt(platform, ""))
+    batches, current, used = [], [], overhead
+    for i, post in enumerate(posts):
+        cost = _estimate_tokens(_format_post_block(post, post_id=_batch_post_id(i)))
+        cost += _BATCH_OUTPUT_TOKENS_PER_POST
+        if current and used + cost > budget:
+            batches.append(current)
+            current, used = [], overhead
+        current.append(i)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _analyze_batch(indices: List[int], posts: List[dict], platform: str, use_cache: bool) -> dict:
+    """
+    Run one batch prompt. Returns {post index: analysis} for entries the model
+    returned; errors from the call propagate.
     """
-    Use Gemini to generate 3 viral LinkedIn posts based on the analyzed data.
+    blocks = "\n\n".join(
+        _format_post_block(posts[i], post_id=_batch_post_id(i)) for i in indices
+    )
+    entries = _generate(
+        _batch_prompt(platform, blocks),
+        lambda text: structured_output.parse_array(text, BatchAnalysis),
+        use_cache=use_cache,
+        kind="batch_analysis",
+        schema=structured_output.BATCH_ANALYSIS_SCHEMA
+    )
+
+    wanted = {_batch_post_id(i): i for i in indices}
+    found = {}
+    for entry in entries:
+        i = wanted.get(entry.pop("post_id"))
+        if i is not None:
+            found[i] = entry
+    return found
+
+
+def _batch_prompt(platform: str, post_blocks: str) -> str:
+    return f"""You are a viral content analyst specializing in {platform} growth strategy.
+
+Analyze each {platform} post below together with its comments, then return a JSON array with one object per post, each with exactly these fields:
+
+[
+  {{
+    "post_id": "<the id from the post's header, e.g. p0>",
+    "overall_sentiment": <integer 1-5, where 1=very negative, 5=very positive>,
+    "tool_usefulness": <integer 1-5, how useful/actionable the content is perceived>,
+    "common_questions": ["question 1", "question 2", "question 3"],
+    "key_insights": "<2-3 sentence summary of what resonates with the audience and why this post performed>"
+  }},
+  ...
+]
+
+{post_blocks}
+
+Rules:
+- Return exactly one object for every post_id, analyzing each post independently
+- Scores must be integers (not decimals)
+- common_questions must be real questions the audience is asking or would ask
+- key_insights must explain WHY this content resonated
+- Return ONLY a valid JSON array, no preamble or explanation
+"""
+
+
+def _batch_post_id(index: int) -> str:
+    return f"p{index}"
+
+
+def _format_post_block(post: dict, post_id: Optional[str] = None) -> str:
+    """Render a post, its comments and metrics as a prompt section."""
+    comments = post.get("comments_text", [])
+    comments_block = "\n".join(f"- {c}" for c in comments) if comments else "No comments available."
+    header = f"=== POST {post_id} ===\n" if post_id else ""
+    return f"""{header}POST CONTENT:
+{post.get("text", "")}
+
+COMMENTS FROM AUDIENCE:
+{comments_block}
+
+POST METRICS:
+- Likes: {post.get('likes', 0)}
+- Comments: {post.get('comments', 0)}
+- Shares: {post.get('shares', 0)}"""
+
+
+def _estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)."""
+    return len(text) // 4 + 1
+
+
+async def analyze_sentiment_many(
+    posts: List[dict],
+    platform: str = "LinkedIn",
+    max_concurrency: Optional[int] = None,
+    use_cache: bool = True
+) -> List[dict]:
+    """
+    Analyze many posts concurrently without blocking the event loop.
+    Each blocking analyze_sentiment call runs in a worker thread, with at most
+    max_concurrency calls in flight. Results keep the input order, and a post
+    that fails falls back to mock analysis without affecting the others.
+    """
+    results: List[Optional[dict]] = [None] * len(posts)
+    async for i, analysis in iter_sentiment_as_completed(posts, platform, max_concurrency, use_cache):
+        results[i] = analysis
+    return results
+
+
+async def iter_sentiment_as_completed(
+    posts: List[dict],
+    platform: str = "LinkedIn",
+    max_concurrency: Optional[int] = None,
+    use_cache: bool = True,
+    deadline: Optional[float] = None
+) -> AsyncIterator[Tuple[int, dict]]:
+    """
+    Like analyze_sentiment_many, but yields (post index, analysis) as each call
+    finishes. With a time.monotonic() deadline, iteration stops when it passes;
+    posts not yielded by then have no analysis.
+    """
+    limit = max(1, max_concurrency or ANALYSIS_MAX_CONCURRENCY)
+    semaphore = asyncio.Semaphore(limit)
+
+    def _analyze(post: dict) -> dict:
+        with gemini_scheduler.deadline(deadline):
+            return analyze_sentiment(post, platform, use_cache)
+
+    async def _analyze_one(i: int, post: dict) -> Tuple[int, Optional[dict]]:
+        async with semaphore:
+            try:
+                return i, await asyncio.to_thread(_analyze, post)
+            except Exception as e:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return i, None
+                print(f"[Gemini] Concurrent analysis error: {e}")
+                metrics.FALLBACKS.inc(component="analysis", reason=_fallback_reason(e))
+                return i, _mock_sentiment_analysis(post)
+
+    tasks = [asyncio.ensure_future(_analyze_one(i, p)) for i, p in enumerate(posts)]
+    timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+    try:
+        for next_done in asyncio.as_completed(tasks, timeout=timeout):
+            try:
+                i, analysis = await next_done
+            except asyncio.TimeoutError:
+                return
+            if analysis is not None:
+                yield i, analysis
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def generate_viral_content(
+    niche: str,
+    platform: str,
+    analyses: List[dict],
+    use_cache: bool = True,
+    history: Optional[dict] = None,
+    mode: Optional[str] = None
+) -> List[dict]:
+    """
+    Use Gemini to generate 3 viral LinkedIn posts based on the analyzed data,
+    plus the niche's stored aggregate (history) when given.
+    mode "per_tone" (default GENERATION_MODE) uses iter_viral_content_per_tone.
     Returns a list of post dicts with: hook, body, cta, hashtags, viral_score, tone
     """
+    if (mode or GENERATION_MODE) == "per_tone":
+        posts: List[dict] = []
+        for kind, payload in iter_viral_content_per_tone(niche, platform, analyses, use_cache, history):
+            if kind == "posts":
+                posts = payload
+        return posts
+
     try:
         _configure_gemini()
     except EnvironmentError:
+        metrics.FALLBACKS.inc(component="generation", reason="no_api_key")
+        return _mock_generated_content(niche, platform)
+
+    try:
+        posts = _generate(
+            _generation_prompt(niche, platform, analyses, history),
+            lambda text: structured_output.parse_array(text, GeneratedPost),
+            use_cache=use_cache,
+            kind="generation",
+            schema=structured_output.GENERATED_POSTS_SCHEMA
+        )
+        return _tag_generated_posts(posts, niche, platform)
+
+    except Exception as e:
+        print(f"[Gemini] Content generation error: {e}")
+        metrics.FALLBACKS.inc(component="generation", reason=_fallback_reason(e))
         return _mock_generated_content(niche, platform)
 
+
+def generate_viral_content_stream(
+    niche: str,
+    platform: str,
+    analyses: List[dict],
+    use_cache: bool = True,
+    history: Optional[dict] = None,
+    mode: Optional[str] = None
+) -> Iterator[Tuple[str, Any]]:
+    """
+    Streaming variant of generate_viral_content.
+    Yields ("token", text chunk) while Gemini is writing and ("post", post) as
+    soon as each generated post is complete and valid, then exactly one
+    ("posts", validated post list). If the stream breaks off, the posts that
+    did complete are kept. Cached responses arrive as a single chunk; mock
+    fallbacks produce no chunks. In "per_tone" mode there are no token chunks.
+    """
+    if (mode or GENERATION_MODE) == "per_tone":
+        yield from iter_viral_content_per_tone(niche, platform, analyses, use_cache, history)
+        return
+
+    try:
+        _configure_gemini()
+    except EnvironmentError:
+        metrics.FALLBACKS.inc(component="generation", reason="no_api_key")
+        yield "posts", _mock_generated_content(niche, platform)
+        return
+
+    prompt = _generation_prompt(niche, platform, analyses, history)
+    config = _generation_config(structured_output.GENERATED_POSTS_SCHEMA)
+    key = response_cache.make_key(MODEL_NAME, prompt, config)
+    parser = structured_output.ArrayStreamParser()
+    posts: List[dict] = []
+
+    def _completed(text: str) -> Iterator[Tuple[str, Any]]:
+        for item in parser.feed(text):
+            post = structured_output.validate_item(item, GeneratedPost)
+            if post is not None:
+                post = _tag_generated_posts([post], niche, platform)[0]
+                posts.append(post)
+                yield "post", post
+
+    try:
+        cached = response_cache.get(key) if use_cache else None
+        if cached is not None:
+            metrics.MODEL_CALLS.inc(kind="generation_stream", outcome="cached")
+            yield "token", cached
+            yield from _completed(cached)
+            if posts:
+                yield "posts", posts
+                return
+            response_cache.discard(key)
+
+        metrics.PROMPT_CHARS.observe(len(prompt), kind="generation_stream")
+        chunks = []
+        started = time.perf_counter()
+        try:
+            for chunk in _call_model(prompt, config, stream=True):
+                text = chunk.text
+                if text:
+                    chunks.append(text)
+                    yield "token", text
+                    yield from _completed(text)
+        except Exception as e:
+            if not posts:
+                raise
+            print(f"[Gemini] Generation stream broke off after {len(posts)} post(s): {e}")
+        metrics.MODEL_CALL_SECONDS.observe(time.perf_counter() - started, kind="generation_stream")
+
+        text = "".join(chunks)
+        metrics.RESPONSE_CHARS.observe(len(text), kind="generation_stream")
+        if not posts:
+            raise ValueError("No valid posts in model output")
+        if parser.closed and not parser.errors:
+            metrics.MODEL_CALLS.inc(kind="generation_stream", outcome="ok")
+            response_cache.put(key, MODEL_NAME, text)
+        else:
+            metrics.MODEL_CALLS.inc(kind="generation_stream", outcome="salvaged")
+        yield "posts", posts
+
+    except Exception as e:
+        print(f"[Gemini] Streaming content generation error: {e}")
+        metrics.MODEL_CALLS.inc(kind="generation_stream", outcome="error")
+        metrics.FALLBACKS.inc(component="generation", reason=_fallback_reason(e))
+        yield "posts", _mock_generated_content(niche, platform)
+
+
+def iter_viral_content_per_tone(
+    niche: str,
+    platform: str,
+    analyses: List[dict],
+    use_cache: bool = True,
+    history: Optional[dict] = None,
+    keep: Optional[int] = None
+) -> Iterator[Tuple[str, Any]]:
+    """
+    Generate one post per tone in GENERATION_TONES with parallel requests.
+    Requests still running after GENERATION_HEDGE_MS get a duplicate, and the
+    first copy to answer wins. Yields ("post", post) as each tone's post
+    arrives, then ("posts", ranked) once `keep` good posts are in (or every
+    request has finished): the candidates ordered by prescore.rank_generated.
+    A tone whose requests fail is skipped; mock content is returned only if
+    all of them fail.
+    """
+    try:
+        _configure_gemini()
+    except EnvironmentError:
+        metrics.FALLBACKS.inc(component="generation", reason="no_api_key")
+        yield "posts", _mock_generated_content(niche, platform)
+        return
+
+    keep = keep or GENERATION_KEEP
+
+    def _one(tone: str) -> dict:
+        posts = _generate(
+            _generation_prompt(niche, platform, analyses, history, tone=tone),
+            lambda text: structured_output.parse_array(text, GeneratedPost),
+            use_cache=use_cache,
+            kind="generation_tone",
+            schema=structured_output.GENERATED_POSTS_SCHEMA
+        )
+        return {**posts[0], "tone": tone}
+
+    one = gemini_scheduler.bind(_one)
+    pool = ThreadPoolExecutor(max_workers=2 * len(GENERATION_TONES))
+    in_flight = {pool.submit(one, tone): (tone, False) for tone in GENERATION_TONES}
+    hedge_at = time.monotonic() + GENERATION_HEDGE_MS / 1000 if GENERATION_HEDGE_MS > 0 else None
+    hedged, answered, candidates = set(), set(), []
+    try:
+        while in_flight and len(candidates) < keep:
+            timeout = max(0.0, hedge_at - time.monotonic()) if hedge_at is not None else None
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                for tone in {t for t, _ in in_flight.values()} - answered:
+                    in_flight[pool.submit(one, tone)] = (tone, True)
+                    hedged.add(tone)
+                hedge_at = None
+                continue
+            for future in done:
+                tone, is_hedge = in_flight.pop(future)
+                if tone in answered:
+                    continue
+                try:
+                    post = future.result()
+                except Exception as e:
+                    print(f"[Gemini] {tone} generation failed: {e}")
+                    continue
+                answered.add(tone)
+                if tone in hedged:
+                    metrics.MODEL_HEDGES.inc(winner="hedge" if is_hedge else "primary")
+                post = _tag_generated_posts([post], niche, platform)[0]
+                candidates.append(post)
+                yield "post", post
+    finally:
+        # Losing and surplus requests finish in the background (their answers still reach the cache)
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    if not candidates:
+        metrics.FALLBACKS.inc(component="generation", reason="error")
+        yield "posts", _mock_generated_content(niche, platform)
+        return
+    yield "posts", prescore.rank_generated(candidates, analyses)[:keep]
+
+
+def _generation_prompt(
+    niche: str,
+    platform: str,
+    analyses: List[dict],
+    history: Optional[dict] = None,
+    tone: Optional[str] = None
+) -> str:
     # Build a summary of what worked
     insights_summary = []
     for a in analyses:
-        if a.get("key_insights"):
+        # Locally scored posts only restate their metrics, which TOP PERFORMING POSTS already shows
+        if a.get("key_insights") and a.get("analysis_tier") != "local":
             insights_summary.append(f"- {a['key_insights']}")
 
-    top_posts = sorted(analyses, key=lambda x: x.get("likes", 0), reverse=True)[:3]
+    # Blend in the niche's stored aggregate (see aggregates.get_summary)
+    candidates = list(analyses)
+    history_block = ""
+    if history:
+        seen = {a.get("url") or a.get("text") for a in analyses}
+        past = [p for p in history["top_posts"] if (p.get("url") or p.get("text")) not in seen]
+        candidates += past
+        insights_summary += [f"- {p['key_insights']}" for p in past[:3] if p.get("key_insights")]
+        questions = "\n".join(f"- {q['question']} (asked {q['count']}×)" for q in history["top_questions"][:5])
+        history_block = f"""
+ACROSS {history['analyses_count']} PREVIOUSLY ANALYZED POSTS IN THIS NICHE:
+- Average sentiment: {history['avg_sentiment']}/5, average usefulness: {history['avg_usefulness']}/5
+QUESTIONS THIS AUDIENCE KEEPS ASKING:
+{questions or "- (none recorded yet)"}
+"""
+
+    top_posts = sorted(candidates, key=lambda x: x.get("likes", 0), reverse=True)[:3]
     top_posts_text = "\n\n".join([
         f"POST (Likes: {p.get('likes', 0)}, Shares: {p.get('shares', 0)}):\n{p.get('text', '')[:400]}"
         for p in top_posts
     ])
 
-    prompt = f"""You are a world-class {platform} content strategist. Your job is to create viral {platform} posts.
+    if tone:
+        task = f"Generate exactly 1 viral {platform} post in the {tone} tone"
+        tone_field = tone
+        tone_rule = f"Write the post in the {tone} tone"
+    else:
+        task = f"Generate exactly 3 viral {platform} posts in different tones"
+        tone_field = "<one of: Bold, Vulnerable, Data-Driven, Contrarian, Storytelling>"
+        tone_rule = "Vary the tone across the 3 posts"
+
+    return f"""You are a world-class {platform} content strategist. Your job is to create viral {platform} posts.
 
 NICHE: {niche}
 PLATFORM: {platform}
 
 WHAT RESONATED WITH THIS AUDIENCE (from analysis of top posts):
 {chr(10).join(insights_summary) if insights_summary else "Focus on practical, data-driven, authentic content."}
-
+{history_block}
 TOP PERFORMING POSTS FOR REFERENCE:
 {top_posts_text}
 
-Generate exactly 3 viral {platform} posts in different tones. Return a JSON array with exactly this structure:
+{task}. Return a JSON array with exactly this structure:
 
 [
   {{
@@ -150,7 +715,7 @@ Generate exactly 3 viral {platform} posts in different tones. Return a JSON arra
     "cta": "<a compelling call to action or closing question>",
     "hashtags": ["hashtag1", "hashtag2", "hashtag3"],
     "viral_score": <integer 7-10 predicting virality>,
-    "tone": "<one of: Bold, Vulnerable, Data-Driven, Contrarian, Storytelling>"
+    "tone": "{tone_field}"
   }},
   ...
 ]
@@ -159,49 +724,23 @@ Rules:
 - Each post must be complete and ready to publish
 - Hooks must be direct and provocative (no fluff intros)
 - Body should feel like a real expert sharing hard-won knowledge
-- Vary the tone across the 3 posts
+- {tone_rule}
 - viral_score must be an integer
 - hashtags should be 3-5 relevant tags without # symbol
 - Return ONLY valid JSON array, no preamble
 """
 
-    try:
-        model = genai.GenerativeModel("gemini-1.5-flash")
-        response = model.generate_content(prompt)
-        text = response.text
 
-        # Strip markdown fences
-        text = re.sub(r"```(?:json)?", "", text).strip().rstrip("`").strip()
+def _tag_generated_posts(posts: List[dict], niche: str, platform: str) -> List[dict]:
+    """Validated GeneratedPost dicts, tagged with the run's platform and niche."""
+    return [{**p, "platform": platform, "niche": niche} for p in posts]
 
-        # Find JSON array
-        match = re.search(r"\[.*\]", text, re.DOTALL)
-        if match:
-            posts = json.loads(match.group())
-        else:
-            posts = json.loads(text)
-
-        # Validate each post
-        validated = []
-        for p in posts:
-            validated.append({
-                "hook": p.get("hook", ""),
-                "body": p.get("body", ""),
-                "cta": p.get("cta", ""),
-                "hashtags": p.get("hashtags", []),
-                "viral_score": int(p.get("viral_score", 7)),
-                "tone": p.get("tone", "Bold"),
-                "platform": platform,
-                "niche": niche
-            })
-
-        return validated
 
-    except Exception as e:
-        print(f"[Gemini] Content generation error: {e}")
-        return _mock_generated_content(niche, platform)
+# ─── MOCK FALLBACKS (when no API key is present) ──────────────────────────────
 
+def _fallback_reason(error: Exception) -> str:
+    return "circuit_open" if isinstance(error, CircuitOpenError) else "error"
 
-# ─── MOCK FALLBACKS (when no API key is present) ──────────────────────────────
 
 def _mock_sentiment_analysis(post: dict) -> dict:
     """Return plausible mock sentiment when Gemini isn't available."""
@@ -218,10 +757,16 @@ def _mock_sentiment_analysis(post: dict) -> dict:
         "key_insights": (
             "This post resonated because it combined personal experience with actionable takeaways. "
             "The specific numbers and honest tone built credibility, while the format made it easy to skim and share."
-        )
+        ),
+        "fallback": True
     }
 
 
+def fallback_generated_content(niche: str, platform: str) -> List[dict]:
+    """Template posts served when generation is unavailable (tagged "fallback")."""
+    return _mock_generated_content(niche, platform)
+
+
 def _mock_generated_content(niche: str, platform: str) -> List[dict]:
     """Return mock generated posts when Gemini isn't available."""
     return [
@@ -242,7 +787,8 @@ def _mock_generated_content(niche: str, platform: str) -> List[dict]:
             "viral_score": 8,
             "tone": "Data-Driven",
             "platform": platform,
-            "niche": niche
+            "niche": niche,
+            "fallback": True
         },
         {
             "hook": f"I was completely wrong about {niche}.\n\nIt took a failure to see it.",
@@ -264,7 +810,8 @@ def _mock_generated_content(niche: str, platform: str) -> List[dict]:
             "viral_score": 9,
             "tone": "Vulnerable",
             "platform": platform,
-            "niche": niche
+            "niche": niche,
+            "fallback": True
         },
         {
             "hook": f"The {niche} playbook is broken.\n\nHere's what replaced it in 2024:",
@@ -288,6 +835,7 @@ def _mock_generated_content(niche: str, platform: str) -> List[dict]:
             "viral_score": 8,
             "tone": "Contrarian",
             "platform": platform,
-            "niche": niche
+            "niche": niche,
+            "fallback": True
         }
     ]
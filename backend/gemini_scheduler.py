@@ -0,0 +1,280 @@
+"""
+Quota-aware scheduler for Gemini requests
+- One shared GenerativeModel per model name instead of one per call
+- RPM / TPM token buckets, so requests wait for quota instead of drawing 429s
+- Priority: interactive runs (API requests) go ahead of background work (jobs)
+- Retries of 429 / 5xx responses with full-jitter exponential backoff
+- AIMD concurrency: the in-flight limit grows by ~1 per window of successes and
+  halves when the API throttles
+- Deadlines: a request whose caller's deadline (see deadline()) passes while it
+  waits for quota or backs off fails with TimeoutError instead of being sent
+- Circuit breaker: while the Gemini circuit is open, requests fail fast with
+  CircuitOpenError instead of queueing, retrying and timing out
+"""
+
+import os
+import time
+import heapq
+import random
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+from circuit_breaker import CircuitOpenError
+import circuit_breaker
+import metrics
+
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "2000"))
+GEMINI_TPM = float(os.getenv("GEMINI_TPM", "4000000"))
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "16"))
+GEMINI_MIN_CONCURRENCY = int(os.getenv("GEMINI_MIN_CONCURRENCY", "1"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "4"))
+GEMINI_BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", "0.5"))
+GEMINI_BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", "20"))
+# Longest a request waits for quota / a concurrency slot before giving up
+GEMINI_QUEUE_TIMEOUT = float(os.getenv("GEMINI_QUEUE_TIMEOUT", "120"))
+
+# Tokens reserved for the response when charging the TPM bucket up front
+_OUTPUT_TOKEN_RESERVE = 512
+# Buckets hold at most this many seconds of quota, so bursts stay well inside a minute's limit
+_BURST_SECONDS = 10
+# Several 429s from one burst only halve the limit once
+_DECREASE_COOLDOWN = 1.0
+
+PRIORITIES = {"interactive": 0, "background": 1}
+
+_priority: contextvars.ContextVar = contextvars.ContextVar("gemini_priority", default="interactive")
+# time.monotonic() by which the caller needs an answer, or None
+_deadline: contextvars.ContextVar = contextvars.ContextVar("gemini_deadline", default=None)
+
+
+@contextmanager
+def priority(level: str) -> Iterator[None]:
+    """Run the block's Gemini calls at the given priority ("interactive" or "background")."""
+    if level not in PRIORITIES:
+        raise ValueError(f"Unknown priority: {level}")
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+@contextmanager
+def deadline(at: Optional[float]) -> Iterator[None]:
+    """Give the block's Gemini calls a time.monotonic() deadline (None: no deadline)."""
+    token = _deadline.set(at)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current deadline, or None without one."""
+    at = _deadline.get()
+    return None if at is None else max(0.0, at - time.monotonic())
+
+
+def bind(fn: Callable) -> Callable:
+    """Wrap fn to run at the caller's priority and deadline, e.g. when handing it to a thread pool."""
+    level = _priority.get()
+    at = _deadline.get()
+
+    def _bound(*args, **kwargs):
+        with priority(level), deadline(at):
+            return fn(*args, **kwargs)
+    return _bound
+
+
+class TokenBucket:
+    """Refills at per_minute / 60 per second; not thread-safe on its own (the scheduler locks)."""
+
+    def __init__(self, per_minute: float, burst_seconds: float = _BURST_SECONDS):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until amount tokens are available (0 if they are now)."""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        if self.rate > 0:
+            self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, delta: float):
+        """Charge (positive) or refund (negative) the difference from an estimate."""
+        if self.rate > 0:
+            self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class GeminiScheduler:
+    def __init__(
+        self,
+        rpm: float = GEMINI_RPM,
+        tpm: float = GEMINI_TPM,
+        max_concurrency: int = GEMINI_MAX_CONCURRENCY,
+        min_concurrency: int = GEMINI_MIN_CONCURRENCY
+    ):
+        self._rpm = TokenBucket(rpm)
+        self._tpm = TokenBucket(tpm)
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.limit = float(self.max_concurrency)
+        self._in_flight = 0
+        self._waiters: list = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._last_decrease = 0.0
+        self._models: Dict[str, Any] = {}
+        metrics.MODEL_CONCURRENCY_LIMIT.set(self.limit)
+
+    def model(self, name: str):
+        """Shared GenerativeModel for name (genai must already be configured)."""
+        import google.generativeai as genai
+        with self._cond:
+            if name not in self._models:
+                self._models[name] = genai.GenerativeModel(name)
+            return self._models[name]
+
+    def call(self, fn: Callable[[], Any], prompt_tokens: int) -> Any:
+        """
+        Run fn() once quota and a concurrency slot are available, at the
+        current priority. 429 and 5xx errors are retried with jittered
+        backoff; other errors propagate. For streaming calls the slot covers
+        the request up to the first chunk.
+        Requests that still fail after the retries, and connection errors,
+        count against the circuit breaker; while it is open, calls raise
+        CircuitOpenError right away. The breaker is consulted once per call,
+        not per attempt, so a half-open probe keeps its retries and always
+        reports its final outcome.
+        """
+        from google.api_core import exceptions as google_exceptions
+        breaker = circuit_breaker.gemini
+        level = _priority.get()
+        estimate = prompt_tokens + _OUTPUT_TOKEN_RESERVE
+        if not breaker.allow():
+            raise CircuitOpenError("Gemini circuit is open")
+        # True / False once the API's health is known; None if the call ended before that
+        healthy = None
+        try:
+            for attempt in range(GEMINI_MAX_RETRIES + 1):
+                self._acquire(estimate, level)
+                try:
+                    result = fn()
+                except google_exceptions.TooManyRequests:
+                    self._release(throttled=True)
+                    reason = "rate_limited"
+                    healthy = False
+                    if attempt == GEMINI_MAX_RETRIES:
+                        raise
+                except google_exceptions.ServerError:
+                    self._release()
+                    reason = "server_error"
+                    healthy = False
+                    if attempt == GEMINI_MAX_RETRIES:
+                        raise
+                except google_exceptions.ClientError:
+                    # The API answered (the request was at fault), so it is up
+                    self._release()
+                    healthy = True
+                    raise
+                except OSError:
+                    # Connection errors and timeouts; one cut short by the caller's own deadline is not the API's fault
+                    self._release()
+                    left = remaining()
+                    if left is None or left > 0:
+                        healthy = False
+                    raise
+                except BaseException:
+                    self._release()
+                    raise
+                else:
+                    self._release(succeeded=True)
+                    healthy = True
+                    usage = getattr(getattr(result, "usage_metadata", None), "total_token_count", 0)
+                    if usage:
+                        with self._cond:
+                            self._tpm.adjust(usage - estimate)
+                    return result
+
+                metrics.MODEL_REQUEST_RETRIES.inc(reason=reason)
+                delay = random.uniform(0, min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_BASE * 2 ** attempt))
+                left = remaining()
+                if left is not None and delay >= left:
+                    raise TimeoutError("Deadline reached before the Gemini request could be retried")
+                time.sleep(delay)
+        finally:
+            if healthy:
+                breaker.record_success()
+            elif healthy is False:
+                breaker.record_failure()
+            else:
+                breaker.release_probe()
+
+    def _acquire(self, tokens: float, level: str):
+        ticket = (PRIORITIES[level], next(self._seq))
+        give_up = time.monotonic() + GEMINI_QUEUE_TIMEOUT
+        caller_deadline = _deadline.get()
+        if caller_deadline is not None:
+            give_up = min(give_up, caller_deadline)
+        with self._cond:
+            heapq.heappush(self._waiters, ticket)
+            metrics.MODEL_QUEUE_DEPTH.set(len(self._waiters))
+            try:
+                while True:
+                    now = time.monotonic()
+                    # Checked before taking quota: a request whose deadline has passed is never sent
+                    left = give_up - now
+                    if left <= 0:
+                        raise TimeoutError("Timed out waiting for Gemini quota")
+                    wait = None
+                    if self._waiters[0] == ticket and self._in_flight < int(self.limit):
+                        wait = max(self._rpm.wait_time(1, now), self._tpm.wait_time(tokens, now))
+                        if wait <= 0:
+                            self._rpm.take(1)
+                            self._tpm.take(tokens)
+                            self._in_flight += 1
+                            return
+                    self._cond.wait(min(wait, left) if wait else left)
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                metrics.MODEL_QUEUE_DEPTH.set(len(self._waiters))
+                self._cond.notify_all()
+
+    def _release(self, throttled: bool = False, succeeded: bool = False):
+        with self._cond:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if throttled and now - self._last_decrease >= _DECREASE_COOLDOWN:
+                self.limit = max(self.min_concurrency, self.limit / 2)
+                self._last_decrease = now
+            elif succeeded:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            metrics.MODEL_CONCURRENCY_LIMIT.set(self.limit)
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "concurrency_limit": round(self.limit, 2),
+                "in_flight": self._in_flight,
+                "queued": len(self._waiters),
+                "rpm_available": round(self._rpm.tokens, 1) if self._rpm.rate > 0 else None,
+                "tpm_available": round(self._tpm.tokens) if self._tpm.rate > 0 else None,
+            }
+
+
+scheduler = GeminiScheduler()
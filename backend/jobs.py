@@ -0,0 +1,312 @@
+"""
+Background job queue for pipeline runs
+- submit: enqueues a run and returns its job id; identical in-flight requests
+  attach to the existing job instead of starting a new one
+- A pool of asyncio workers executes the scrape → analyze → generate stages,
+  at background priority for Gemini quota (see gemini_scheduler)
+- Job state and progress live in the jobs table. Each active job records the
+  worker process that owns it and a heartbeat; jobs whose owner has died (a
+  dead pid on this host, or a heartbeat older than JOB_STALE_SECONDS) are
+  re-queued at startup and by a periodic sweep
+- Apify tokens are never written to the table: they are held in memory for
+  the job's lifetime, so a job recovered after a restart runs without one
+"""
+
+import os
+import json
+import uuid
+import socket
+import asyncio
+import hashlib
+import datetime
+from typing import Dict, Optional, Tuple
+from pipeline import RunRequest, run_events
+import gemini_scheduler
+import storage
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# How often a process refreshes the heartbeat of the jobs it owns and sweeps for orphans
+JOB_HEARTBEAT_SECONDS = int(os.getenv("JOB_HEARTBEAT_SECONDS", "15"))
+# An active job whose heartbeat is older than this is treated as orphaned by a dead process
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "60"))
+
+ACTIVE_STATUSES = ("queued", "running")
+
+# host:pid:boot id of this process; the boot id tells a restarted process apart
+# from its predecessor when it gets the same pid (e.g. pid 1 in a container)
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:12]}"
+
+
+def init_jobs_table():
+    with storage.transaction() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                dedupe_key TEXT,
+                status TEXT,
+                stage TEXT,
+                progress REAL,
+                request TEXT,
+                result TEXT,
+                error TEXT,
+                owner TEXT,
+                heartbeat_at TEXT,
+                created_at TEXT,
+                updated_at TEXT
+            )
+        """)
+        # Tables created before jobs had owners
+        storage.add_column_if_missing(conn, "jobs", "owner", "TEXT")
+        storage.add_column_if_missing(conn, "jobs", "heartbeat_at", "TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_dedupe ON jobs(dedupe_key, status)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, updated_at)")
+        # Rows written before tokens were kept out of the table
+        conn.execute(
+            "UPDATE jobs SET request = json_remove(request, '$.apify_token') "
+            "WHERE json_extract(request, '$.apify_token') IS NOT NULL"
+        )
+
+
+def dedupe_key(req: RunRequest) -> str:
+    """
+    Requests that would produce the same work share a key. Every request field
+    counts except include_timings; the Apify token is represented by a
+    fingerprint so it never reaches the table.
+    """
+    payload = req.model_dump(exclude={"include_timings", "apify_token"})
+    payload["niche"] = " ".join(req.niche.lower().split())
+    payload["platform"] = req.platform.lower()
+    payload["keywords"] = sorted({" ".join(k.lower().split()) for k in (req.keywords or []) if k.strip()})
+    payload["apify_token"] = (
+        hashlib.sha256(req.apify_token.encode("utf-8")).hexdigest()[:16] if req.apify_token else None
+    )
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _now() -> str:
+    return datetime.datetime.utcnow().isoformat()
+
+
+def _stale_cutoff() -> str:
+    return (datetime.datetime.utcnow() - datetime.timedelta(seconds=JOB_STALE_SECONDS)).isoformat()
+
+
+def _owner_alive(owner: Optional[str], heartbeat_at: Optional[str]) -> bool:
+    """Whether the process that owns a job is still running it."""
+    if not owner or not heartbeat_at or heartbeat_at < _stale_cutoff():
+        return False
+    if owner == WORKER_ID:
+        return True
+    host, pid, boot_id = owner.rsplit(":", 2)
+    if host != socket.gethostname():
+        # Another machine: only its heartbeat can tell
+        return True
+    if int(pid) == os.getpid():
+        # Our pid, earlier boot: the previous process is gone
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobQueue:
+    """Persistent run queue drained by a fixed pool of asyncio workers."""
+
+    def __init__(self, workers: int = JOB_WORKERS):
+        self.workers = max(1, workers)
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self._submit_lock: Optional[asyncio.Lock] = None
+        # job id → Apify token, for jobs submitted to this process
+        self._tokens: Dict[str, str] = {}
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._submit_lock = asyncio.Lock()
+        await asyncio.to_thread(init_jobs_table)
+        for job_id in await asyncio.to_thread(self._recover):
+            self._queue.put_nowait(job_id)
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"job-worker-{i}")
+            for i in range(self.workers)
+        ]
+        self._tasks.append(asyncio.create_task(self._heartbeat(), name="job-heartbeat"))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, req: RunRequest) -> Tuple[str, bool]:
+        """Enqueue a run. Returns (job id, True if attached to an existing job)."""
+        key = dedupe_key(req)
+        async with self._submit_lock:
+            existing = await asyncio.to_thread(self._find_active, key)
+            if existing:
+                return existing, True
+
+            job_id = uuid.uuid4().hex
+            await asyncio.to_thread(self._insert, job_id, key, req)
+        if req.apify_token:
+            self._tokens[job_id] = req.apify_token
+        self._queue.put_nowait(job_id)
+        return job_id, False
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with storage.connection() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job.pop("request", None)
+        job.pop("dedupe_key", None)
+        job.pop("owner", None)
+        job.pop("heartbeat_at", None)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    # ─── persistence ──────────────────────────────────────────────────────────
+
+    def _find_active(self, key: str) -> Optional[str]:
+        """Newest queued or running job for key whose owner is still heartbeating."""
+        with storage.connection() as conn:
+            rows = conn.execute(
+                "SELECT id, owner, heartbeat_at FROM jobs WHERE dedupe_key = ? AND status IN (?, ?) "
+                "AND heartbeat_at >= ? ORDER BY created_at DESC",
+                (key, *ACTIVE_STATUSES, _stale_cutoff())
+            ).fetchall()
+        for row in rows:
+            if _owner_alive(row["owner"], row["heartbeat_at"]):
+                return row["id"]
+        return None
+
+    def _insert(self, job_id: str, key: str, req: RunRequest):
+        now = _now()
+        with storage.transaction() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, dedupe_key, status, stage, progress, request, owner, heartbeat_at, "
+                "created_at, updated_at) VALUES (?, ?, 'queued', 'queued', 0, ?, ?, ?, ?, ?)",
+                (job_id, key, req.model_dump_json(exclude={"apify_token"}), WORKER_ID, now, now, now)
+            )
+
+    def _recover(self) -> list:
+        """
+        Take over active jobs whose owner is gone, re-queueing the running ones.
+        Returns the ids taken over, oldest first.
+        """
+        with storage.connection() as conn:
+            rows = conn.execute(
+                "SELECT id, owner, heartbeat_at FROM jobs WHERE status IN (?, ?) ORDER BY created_at",
+                ACTIVE_STATUSES
+            ).fetchall()
+        orphans = [r for r in rows if not _owner_alive(r["owner"], r["heartbeat_at"])]
+        recovered = []
+        now = _now()
+        with storage.transaction() as conn:
+            for row in orphans:
+                # Compare-and-set on the owner, so two processes never both take a job
+                taken = conn.execute(
+                    "UPDATE jobs SET status = 'queued', stage = 'queued', progress = 0, owner = ?, "
+                    "heartbeat_at = ?, updated_at = ? WHERE id = ? AND status IN (?, ?) AND owner IS ?",
+                    (WORKER_ID, now, now, row["id"], *ACTIVE_STATUSES, row["owner"])
+                ).rowcount
+                if taken:
+                    recovered.append(row["id"])
+        if recovered:
+            print(f"[Jobs] Re-queued {len(recovered)} orphaned job(s)")
+        return recovered
+
+    def _beat(self):
+        with storage.transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status IN (?, ?)",
+                (_now(), WORKER_ID, *ACTIVE_STATUSES)
+            )
+
+    def _claim(self, job_id: str) -> Optional[RunRequest]:
+        """Atomically move a queued job we own to running; None if it is no longer ours to run."""
+        with storage.transaction() as conn:
+            claimed = conn.execute(
+                "UPDATE jobs SET status = 'running', stage = 'scraping', heartbeat_at = ?, updated_at = ? "
+                "WHERE id = ? AND status = 'queued' AND owner = ?",
+                (_now(), _now(), job_id, WORKER_ID)
+            ).rowcount
+            if not claimed:
+                return None
+            row = conn.execute("SELECT request FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        req = RunRequest.model_validate_json(row["request"])
+        token = self._tokens.pop(job_id, None)
+        if token:
+            req = req.model_copy(update={"apify_token": token})
+        return req
+
+    def _update(self, job_id: str, **fields):
+        fields["updated_at"] = _now()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with storage.transaction() as conn:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    # ─── execution ────────────────────────────────────────────────────────────
+
+    async def _heartbeat(self):
+        """Keep our jobs' heartbeats fresh and take over jobs orphaned since startup."""
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            try:
+                await asyncio.to_thread(self._beat)
+                for job_id in await asyncio.to_thread(self._recover):
+                    self._queue.put_nowait(job_id)
+            except Exception as e:
+                print(f"[Jobs] Heartbeat error: {e}")
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                print(f"[Jobs] Worker error on {job_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        req = await asyncio.to_thread(self._claim, job_id)
+        if req is None:
+            self._tokens.pop(job_id, None)
+            return
+
+        total = 0
+        analysed = 0
+        try:
+            # Interactive API runs get Gemini quota ahead of queued jobs
+            with gemini_scheduler.priority("background"):
+                async for event in run_events(req):
+                    name, data = event["event"], event["data"]
+                    if name == "posts":
+                        total = len(data)
+                        await asyncio.to_thread(self._update, job_id, stage="analyzing", progress=0.2)
+                    elif name == "analysis":
+                        analysed += 1
+                        progress = 0.2 + 0.6 * analysed / max(total, 1)
+                        stage = "analyzing" if analysed < total else "generating"
+                        await asyncio.to_thread(self._update, job_id, stage=stage, progress=round(progress, 3))
+                    elif name == "generated":
+                        await asyncio.to_thread(self._update, job_id, stage="saving", progress=0.9)
+                    elif name == "done":
+                        await asyncio.to_thread(
+                            self._update, job_id,
+                            status="succeeded", stage="done", progress=1.0, result=json.dumps(data)
+                        )
+        except Exception as e:
+            print(f"[Jobs] Job {job_id} failed: {e}")
+            await asyncio.to_thread(self._update, job_id, status="failed", stage="failed", error=str(e))
+
+
+job_queue = JobQueue()
@@ -1,15 +1,51 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, List
-import sqlite3
-import os
+from typing import List, Literal, Optional
+from contextlib import asynccontextmanager
+import asyncio
 import json
-import datetime
-from scraper import get_linkedin_posts
-from gemini_agent import analyze_sentiment, generate_viral_content
+import time
+from pipeline import RunRequest, execute_run, run_events
+from batch import BatchRunRequest, execute_batch
+from jobs import ACTIVE_STATUSES, job_queue
+import response_cache
+import scrape_cache
+import semantic_cache
+import post_store
+import storage
+import metrics
+import aggregates
+import circuit_breaker
+import export
 
-app = FastAPI(title="Viral Content System", version="1.0.0")
+# Request / response header carrying a run's trace id
+TRACE_HEADER = "X-Trace-Id"
+
+
+def _init_tables():
+    storage.init_db()
+    post_store.init_post_tables()
+    aggregates.init_aggregate_table()
+    response_cache.init_cache_table()
+    scrape_cache.init_cache_table()
+    circuit_breaker.init_circuit_table()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create tables and start the job workers on startup; drain them and close the DB on shutdown."""
+    await asyncio.to_thread(_init_tables)
+    await job_queue.start()
+    try:
+        yield
+    finally:
+        await job_queue.stop()
+        storage.close()
+
+
+app = FastAPI(title="Viral Content System", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -17,58 +53,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[TRACE_HEADER],
 )
 
-DB_PATH = "viral_content.db"
-
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS analyses (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            created_at TEXT,
-            niche TEXT,
-            platform TEXT,
-            post_url TEXT,
-            post_text TEXT,
-            author TEXT,
-            likes INTEGER,
-            comments INTEGER,
-            shares INTEGER,
-            overall_sentiment INTEGER,
-            tool_usefulness INTEGER,
-            common_questions TEXT,
-            key_insights TEXT
-        )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS generated_content (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            created_at TEXT,
-            niche TEXT,
-            platform TEXT,
-            hook TEXT,
-            body TEXT,
-            cta TEXT,
-            hashtags TEXT,
-            viral_score INTEGER,
-            tone TEXT
-        )
-    """)
-    conn.commit()
-    conn.close()
-
-init_db()
-
-
-class RunRequest(BaseModel):
-    niche: str
-    platform: str = "LinkedIn"
-    keywords: Optional[List[str]] = []
-    use_mock: bool = True
-    apify_token: Optional[str] = None
-    num_posts: int = 5
+MAX_HISTORY_PAGE = 200
 
 
 class RunResponse(BaseModel):
@@ -77,6 +65,30 @@ class RunResponse(BaseModel):
     analyses: list
     generated_posts: list
     run_id: int
+    trace_id: Optional[str] = None
+    timings: Optional[dict] = None
+    degraded: Optional[dict] = None
+
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    metrics.HTTP_REQUEST_SECONDS.observe(
+        time.perf_counter() - started,
+        method=request.method,
+        route=getattr(route, "path", "unmatched"),
+        status=response.status_code
+    )
+    return response
+
+
+def _trace_for(request: Request, response: Response) -> metrics.Trace:
+    """Trace for a run, reusing the caller's X-Trace-Id when one is sent."""
+    trace = metrics.Trace(request.headers.get(TRACE_HEADER))
+    response.headers[TRACE_HEADER] = trace.trace_id
+    return trace
 
 
 @app.get("/")
@@ -85,113 +97,187 @@ def root():
 
 
 @app.post("/api/run", response_model=RunResponse)
-async def run_pipeline(req: RunRequest):
+async def run_pipeline(req: RunRequest, request: Request, response: Response):
+    trace = _trace_for(request, response)
     try:
-        # Step 1: Scrape posts
-        posts = get_linkedin_posts(
-            niche=req.niche,
-            keywords=req.keywords,
-            num_posts=req.num_posts,
-            use_mock=req.use_mock,
-            apify_token=req.apify_token
-        )
+        return RunResponse(**await execute_run(req, trace=trace))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e), headers={TRACE_HEADER: trace.trace_id})
 
-        if not posts:
-            raise HTTPException(status_code=400, detail="No posts found for the given inputs.")
-
-        analyses = []
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        now = datetime.datetime.utcnow().isoformat()
-
-        # Step 2: Sentiment analysis per post
-        for post in posts:
-            analysis = analyze_sentiment(post, req.platform)
-
-            c.execute("""
-                INSERT INTO analyses
-                (created_at, niche, platform, post_url, post_text, author, likes, comments, shares,
-                 overall_sentiment, tool_usefulness, common_questions, key_insights)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                now, req.niche, req.platform,
-                post.get("url", ""),
-                post.get("text", ""),
-                post.get("author", ""),
-                post.get("likes", 0),
-                post.get("comments", 0),
-                post.get("shares", 0),
-                analysis.get("overall_sentiment", 3),
-                analysis.get("tool_usefulness", 3),
-                json.dumps(analysis.get("common_questions", [])),
-                analysis.get("key_insights", "")
-            ))
-            conn.commit()
-            analyses.append({**post, **analysis})
-
-        # Step 3: Generate viral content
-        generated_posts = generate_viral_content(
-            niche=req.niche,
-            platform=req.platform,
-            analyses=analyses
-        )
 
-        run_id = 0
-        for gp in generated_posts:
-            c.execute("""
-                INSERT INTO generated_content
-                (created_at, niche, platform, hook, body, cta, hashtags, viral_score, tone)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                now, req.niche, req.platform,
-                gp.get("hook", ""),
-                gp.get("body", ""),
-                gp.get("cta", ""),
-                json.dumps(gp.get("hashtags", [])),
-                gp.get("viral_score", 7),
-                gp.get("tone", "")
-            ))
-            conn.commit()
-            run_id = c.lastrowid
-
-        conn.close()
-
-        return RunResponse(
-            success=True,
-            message=f"Pipeline completed. Analysed {len(analyses)} posts, generated {len(generated_posts)} viral posts.",
-            analyses=analyses,
-            generated_posts=generated_posts,
-            run_id=run_id
-        )
+@app.post("/api/run/stream")
+async def run_pipeline_stream(req: RunRequest, request: Request):
+    """
+    Same pipeline as /api/run, streamed as NDJSON: one {"event", "data"} object
+    per line for scraped posts, each analysis, generation tokens and the final
+    result ("done"). Failures arrive as an "error" event.
+    """
+    trace = metrics.Trace(request.headers.get(TRACE_HEADER))
+
+    async def _ndjson():
+        try:
+            async for event in run_events(req, stream_tokens=True, trace=trace):
+                yield json.dumps(event) + "\n"
+        except Exception as e:
+            yield json.dumps({"event": "error", "data": {"detail": str(e), "trace_id": trace.trace_id}}) + "\n"
+
+    return StreamingResponse(
+        _ndjson(), media_type="application/x-ndjson", headers={TRACE_HEADER: trace.trace_id}
+    )
 
+
+@app.post("/api/run/batch")
+async def run_pipeline_batch(req: BatchRunRequest, request: Request, response: Response):
+    """
+    Run the pipeline for many niches at once: one combined scrape, each
+    distinct post analysed once, generation fanned out under one concurrency
+    limit. Per-niche failures are reported in results without failing the batch.
+    """
+    trace = _trace_for(request, response)
+    try:
+        return await execute_batch(req, trace=trace)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=500, detail=str(e), headers={TRACE_HEADER: trace.trace_id})
+
+
+@app.post("/api/jobs", status_code=202)
+async def submit_job(req: RunRequest):
+    """Queue a pipeline run. Identical in-flight requests share one job."""
+    job_id, deduplicated = await job_queue.submit(req)
+    return {"job_id": job_id, "deduplicated": deduplicated}
+
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 
 @app.get("/api/history")
-def get_history():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
+def get_history(
+    niche: Optional[str] = None,
+    platform: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    analyses_limit: int = Query(50, ge=1, le=MAX_HISTORY_PAGE),
+    generated_limit: int = Query(20, ge=1, le=MAX_HISTORY_PAGE),
+    analyses_cursor: Optional[str] = None,
+    generated_cursor: Optional[str] = None
+):
+    """
+    Newest-first history, optionally filtered by niche, platform and an ISO
+    date range [since, until). Pass a next_cursors value back as
+    analyses_cursor / generated_cursor to fetch the following page.
+    """
+    filters = {"niche": niche, "platform": platform, "since": since, "until": until}
+    try:
+        analyses, next_analyses = storage.query_history(
+            "analyses", analyses_limit, cursor=analyses_cursor, **filters
+        )
+        generated, next_generated = storage.query_history(
+            "generated", generated_limit, cursor=generated_cursor, **filters
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "analyses": analyses,
+        "generated": generated,
+        "next_cursors": {"analyses": next_analyses, "generated": next_generated}
+    }
+
+
+@app.get("/api/history/export")
+def export_history(
+    table: Literal["analyses", "generated"] = "analyses",
+    format: Literal["ndjson", "csv"] = "ndjson",
+    gzip: bool = False,
+    niche: Optional[str] = None,
+    platform: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None
+):
+    """
+    Stream a whole history table, oldest first, as NDJSON or CSV (optionally
+    gzipped), with the same filters as /api/history. Rows are read in chunks,
+    so exports of any size use constant memory and do not block pipeline writes.
+    """
+    filename = f"{table}.{format}" + (".gz" if gzip else "")
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    body = export.iter_export(table, format, gzip, niche=niche, platform=platform, since=since, until=until)
+    media_type = "application/gzip" if gzip else export.CONTENT_TYPES[format]
+    return StreamingResponse(body, media_type=media_type, headers=headers)
+
+
+@app.get("/api/runs/{run_id}")
+def get_run(run_id: int):
+    run = storage.get_run(run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="Run not found")
+    return run
+
+
+@app.get("/api/insights")
+def get_insights(niche: str, platform: str = "LinkedIn"):
+    """Precomputed aggregate for a niche: averages, top posts and frequent questions."""
+    summary = aggregates.get_summary(niche, platform)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="No insights stored for this niche yet")
+    return summary
+
+
+@app.get("/api/posts/search")
+def search_posts(q: List[str] = Query(..., min_length=1), limit: int = Query(10, ge=1, le=100)):
+    """
+    Stored posts containing every word of at least one q (repeat q for
+    alternatives), ranked by BM25 relevance blended with engagement.
+    """
+    return {"posts": post_store.search_posts(q, limit)}
+
+
+@app.get("/api/cache/stats")
+def get_cache_stats():
+    return {"gemini": response_cache.stats(), "scrape": scrape_cache.stats(), "semantic": semantic_cache.stats()}
+
+
+@app.get("/api/circuits")
+def get_circuits():
+    """Circuit breaker state per dependency (closed, open or half_open), shared by all workers."""
+    return circuit_breaker.states()
+
 
-    c.execute("SELECT * FROM analyses ORDER BY created_at DESC LIMIT 50")
-    analyses = [dict(row) for row in c.fetchall()]
+@app.post("/api/circuits/{name}/reset")
+def reset_circuit(name: str):
+    breaker = circuit_breaker.BREAKERS.get(name)
+    if breaker is None:
+        raise HTTPException(status_code=404, detail="Unknown circuit")
+    breaker.reset()
+    return breaker.state()
 
-    c.execute("SELECT * FROM generated_content ORDER BY created_at DESC LIMIT 20")
-    generated = [dict(row) for row in c.fetchall()]
 
-    conn.close()
-    return {"analyses": analyses, "generated": generated}
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Prometheus scrape endpoint: stage latencies, model calls, fallbacks, DB writes."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.delete("/api/history")
 def clear_history():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("DELETE FROM analyses")
-    c.execute("DELETE FROM generated_content")
-    conn.commit()
-    conn.close()
+    with storage.transaction() as conn:
+        conn.execute("DELETE FROM analyses")
+        conn.execute("DELETE FROM generated_content")
+        conn.execute("DELETE FROM runs")
+        conn.execute("DELETE FROM niche_aggregates")
+        conn.execute("DELETE FROM niche_aggregate_posts")
+        # The post store feeds local-corpus scrapes and /api/posts/search
+        conn.execute("DELETE FROM post_snapshots")
+        conn.execute("DELETE FROM posts")
+        if post_store.fts_available:
+            conn.execute("DELETE FROM posts_fts")
+        # Finished jobs hold full run results; queued and running ones are left to complete
+        conn.execute("DELETE FROM jobs WHERE status NOT IN (?, ?)", ACTIVE_STATUSES)
+    semantic_cache.clear()
     return {"success": True, "message": "History cleared"}
 
 
@@ -0,0 +1,246 @@
+"""
+In-process metrics and request tracing for Viral Content System
+- Counter / Gauge / Histogram: thread-safe labelled metrics, rendered in the
+  Prometheus text exposition format by render() (served on /metrics)
+- timed: context manager recording a stage latency, optionally also into a Trace
+- Trace: trace id and per-stage timing breakdown of one pipeline run
+"""
+
+import time
+import uuid
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+_INF_LABEL = 'le="+Inf"'
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+_registry: List["_Metric"] = []
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _label_text(self, key: Tuple[str, ...], extra: str = "") -> str:
+        pairs = [f'{n}="{_escape(v)}"' for n, v in zip(self.labelnames, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        """Sample lines for render(); called with the lock held."""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{self._label_text(k)} {_number(v)}" for k, v in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [per-bucket counts..., sum, count]
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, state in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                le = 'le="%s"' % _number(bound)
+                lines.append(f"{self.name}_bucket{self._label_text(key, le)} {cumulative}")
+            lines.append(f"{self.name}_bucket{self._label_text(key, _INF_LABEL)} {state[-1]}")
+            lines.append(f"{self.name}_sum{self._label_text(key)} {_number(state[-2])}")
+            lines.append(f"{self.name}_count{self._label_text(key)} {state[-1]}")
+        return lines
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{self._label_text(k)} {_number(v)}" for k, v in sorted(self._values.items())]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text format."""
+    return "\n".join(m.render() for m in _registry) + "\n"
+
+
+# ─── METRICS ──────────────────────────────────────────────────────────────────
+
+STAGE_SECONDS = Histogram(
+    "viral_stage_duration_seconds", "Latency of pipeline stages and hot-path steps", ["stage"]
+)
+RUNS = Counter("viral_runs_total", "Pipeline runs by outcome", ["status"])
+MODEL_CALLS = Counter(
+    "viral_model_calls_total", "Gemini requests by kind and outcome (ok, cached, salvaged, error)", ["kind", "outcome"]
+)
+MODEL_CALL_SECONDS = Histogram(
+    "viral_model_call_duration_seconds", "Latency of Gemini requests that reached the API", ["kind"]
+)
+MODEL_RETRIES = Counter(
+    "viral_model_retries_total", "Posts re-sent individually after a batch analysis dropped them", ["kind"]
+)
+FALLBACKS = Counter(
+    "viral_fallbacks_total", "Results replaced by mock data", ["component", "reason"]
+)
+PROMPT_CHARS = Histogram(
+    "viral_prompt_chars", "Size of prompts sent to Gemini, in characters", ["kind"], SIZE_BUCKETS
+)
+RESPONSE_CHARS = Histogram(
+    "viral_response_chars", "Size of Gemini response text, in characters", ["kind"], SIZE_BUCKETS
+)
+DB_WRITE_SECONDS = Histogram(
+    "viral_db_write_duration_seconds", "Latency of SQLite write transactions", ["op"]
+)
+PROMPT_TOKENS_SAVED = Counter(
+    "viral_prompt_tokens_saved_total", "Estimated prompt tokens removed by comment compaction"
+)
+COMMENTS_COMPACTED = Counter(
+    "viral_comments_compacted_total", "Comments removed from prompts by compaction", ["reason"]
+)
+MODEL_REQUEST_RETRIES = Counter(
+    "viral_model_request_retries_total", "Gemini requests retried after a 429 or 5xx response", ["reason"]
+)
+MODEL_CONCURRENCY_LIMIT = Gauge(
+    "viral_model_concurrency_limit", "Current adaptive limit on Gemini requests in flight"
+)
+MODEL_QUEUE_DEPTH = Gauge("viral_model_queue_depth", "Gemini requests waiting for quota or a slot")
+MODEL_HEDGES = Counter(
+    "viral_model_hedges_total", "Slow generation requests that were duplicated, by which copy answered first", ["winner"]
+)
+SEMANTIC_CACHE_LOOKUPS = Counter(
+    "viral_semantic_cache_lookups_total", "Generation lookups in the similarity cache by outcome", ["outcome"]
+)
+LOCAL_CORPUS_LOOKUPS = Counter(
+    "viral_local_corpus_lookups_total", "Scrapes answered from the stored-post index (served) or not", ["outcome"]
+)
+EXPORTED_ROWS = Counter("viral_exported_rows_total", "History rows streamed by /api/history/export", ["table", "format"])
+DEADLINE_DEGRADED = Counter(
+    "viral_deadline_degraded_total", "Items replaced by local results when a run's deadline ran out", ["stage"]
+)
+CIRCUIT_STATE = Gauge(
+    "viral_circuit_state", "Circuit breaker state per dependency (0 closed, 1 half-open, 2 open)", ["dependency"]
+)
+CIRCUIT_OPENED = Counter("viral_circuit_opened_total", "Times a dependency's circuit opened", ["dependency"])
+CIRCUIT_REJECTED = Counter(
+    "viral_circuit_rejected_total", "Calls failed fast because the dependency's circuit was open", ["dependency"]
+)
+APIFY_RETRIES = Counter("viral_apify_retries_total", "Apify HTTP requests retried after an error")
+HTTP_REQUEST_SECONDS = Histogram(
+    "viral_http_request_duration_seconds",
+    "Time until the response headers are sent, by route",
+    ["method", "route", "status"]
+)
+
+
+# ─── TRACING ──────────────────────────────────────────────────────────────────
+
+class Trace:
+    """Trace id and accumulated per-stage milliseconds for one pipeline run."""
+
+    def __init__(self, trace_id: Optional[str] = None):
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.started = time.perf_counter()
+        self.timings: Dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float):
+        self.timings[stage] = round(self.timings.get(stage, 0) + seconds * 1000, 2)
+
+    def breakdown(self) -> Dict[str, float]:
+        """Stage timings in milliseconds plus the total so far."""
+        return {**self.timings, "total": round((time.perf_counter() - self.started) * 1000, 2)}
+
+
+@contextmanager
+def timed(stage: str, trace: Optional[Trace] = None) -> Iterator[None]:
+    """Record the block's duration in viral_stage_duration_seconds (and the trace, if given)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        if trace is not None:
+            trace.add(stage, elapsed)
@@ -0,0 +1,347 @@
+"""
+Pipeline orchestration for Viral Content System
+- RunRequest: inputs for one scrape → analyze → generate run
+- run_events: runs the pipeline, yielding progress events as each stage produces results
+- execute_run: runs the pipeline to completion and returns the final result
+- Budget: a run's deadline_ms, split across the scrape, analysis and generation
+  stages; work that misses its share is replaced by local results marked "degraded"
+"""
+
+import os
+import time
+import asyncio
+import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Literal, Optional
+from pydantic import BaseModel, Field
+from scraper import get_linkedin_posts
+from gemini_agent import (
+    analyze_sentiment_batch,
+    iter_sentiment_as_completed,
+    generate_viral_content,
+    generate_viral_content_stream,
+    fallback_generated_content,
+)
+import aggregates
+import gemini_scheduler
+import metrics
+import post_store
+import prescore
+import semantic_cache
+import storage
+
+
+class RunRequest(BaseModel):
+    niche: str
+    platform: str = "LinkedIn"
+    keywords: Optional[List[str]] = []
+    use_mock: bool = True
+    apify_token: Optional[str] = None
+    num_posts: int = 5
+    max_concurrency: Optional[int] = None
+    batch_analysis: bool = True
+    use_cache: bool = True
+    reuse_analyses: bool = True
+    include_timings: bool = False
+    prescore: bool = True
+    escalate_top_k: Optional[int] = None
+    use_history: bool = True
+    generation_mode: Optional[Literal["single", "per_tone"]] = None
+    local_corpus: Optional[bool] = None
+    deadline_ms: Optional[int] = Field(None, gt=0)
+
+
+# Deadline for runs that do not set deadline_ms (0: none)
+RUN_DEADLINE_MS = int(os.getenv("RUN_DEADLINE_MS", "0"))
+# Share of the remaining budget each stage may spend; what generation leaves is for persisting
+STAGE_BUDGET_SHARES = {"scrape": 0.3, "analyze": 0.6, "generate": 0.9}
+
+
+class Budget:
+    """A run's deadline, handed to each stage as a share of the time then remaining."""
+
+    def __init__(self, deadline_ms: Optional[int]):
+        self.deadline = time.monotonic() + deadline_ms / 1000 if deadline_ms else None
+
+    def stage_deadline(self, stage: str) -> Optional[float]:
+        """time.monotonic() by which stage should finish, or None without a deadline."""
+        if self.deadline is None:
+            return None
+        now = time.monotonic()
+        return now + max(0.0, self.deadline - now) * STAGE_BUDGET_SHARES[stage]
+
+
+async def _until(at: Optional[float], awaitable: Awaitable) -> Any:
+    """awaitable's result; raises asyncio.TimeoutError once time.monotonic() passes at."""
+    return await asyncio.wait_for(awaitable, None if at is None else max(0.0, at - time.monotonic()))
+
+
+def _with_deadline(at: Optional[float], fn: Callable) -> Callable:
+    """fn with at as the deadline of its Gemini calls (see gemini_scheduler.deadline)."""
+    def _run(*args, **kwargs):
+        with gemini_scheduler.deadline(at):
+            return fn(*args, **kwargs)
+    return _run
+
+
+def _event(name: str, data: Any) -> dict:
+    return {"event": name, "data": data}
+
+
+async def run_events(
+    req: RunRequest,
+    stream_tokens: bool = False,
+    trace: Optional[metrics.Trace] = None
+) -> AsyncIterator[dict]:
+    """
+    Run the pipeline and yield events as results become available:
+      started → posts → analysis (one per post, in completion order)
+      → generation_token / generated_post (only with stream_tokens) → generated → done
+    The "done" event carries the same fields as RunResponse.
+    With batch_analysis, analyses arrive together once their batch returns.
+    Under a deadline (deadline_ms or RUN_DEADLINE_MS), a stage that runs out of
+    its share stops waiting: scraping falls back to stored or mock posts,
+    unanswered analyses to the local heuristic and generation to what has been
+    streamed so far or template posts. Those items carry "degraded": true and
+    "done" lists them under "degraded".
+    Stage latencies are recorded in metrics and in trace (a new one if not given).
+    """
+    trace = trace or metrics.Trace()
+    try:
+        async for event in _pipeline_events(req, stream_tokens, trace):
+            yield event
+    except Exception:
+        metrics.RUNS.inc(status="error")
+        raise
+    metrics.RUNS.inc(status="ok")
+    metrics.STAGE_SECONDS.observe(time.perf_counter() - trace.started, stage="total")
+
+
+async def _pipeline_events(req: RunRequest, stream_tokens: bool, trace: metrics.Trace) -> AsyncIterator[dict]:
+    yield _event("started", {"niche": req.niche, "platform": req.platform, "trace_id": trace.trace_id})
+    budget = Budget(req.deadline_ms or RUN_DEADLINE_MS)
+    degraded = {"scrape": False, "analyses": [], "generation": False}
+
+    # Step 1: Scrape posts (blocking I/O, kept off the event loop)
+    with metrics.timed("scrape", trace):
+        try:
+            posts = await _until(budget.stage_deadline("scrape"), asyncio.to_thread(
+                get_linkedin_posts,
+                niche=req.niche,
+                keywords=req.keywords,
+                num_posts=req.num_posts,
+                use_mock=req.use_mock,
+                apify_token=req.apify_token,
+                use_cache=req.use_cache,
+                local_corpus=req.local_corpus
+            ))
+        except asyncio.TimeoutError:
+            # The scrape finishes in its thread and still fills the scrape cache for later runs
+            metrics.DEADLINE_DEGRADED.inc(stage="scrape")
+            degraded["scrape"] = True
+            posts = await asyncio.to_thread(
+                get_linkedin_posts, req.niche, req.keywords, req.num_posts, use_mock=True, local_corpus=True
+            )
+
+    if not posts:
+        raise ValueError("No posts found for the given inputs.")
+
+    yield _event("posts", posts)
+    now = datetime.datetime.utcnow().isoformat()
+
+    # Step 2: Sentiment analysis — reuse stored analyses of unchanged posts, score
+    # the rest locally, and send only the top-K to Gemini (batched or one call per post)
+    analyses: List[Optional[dict]] = [None] * len(posts)
+    analyze_by = budget.stage_deadline("analyze")
+    with metrics.timed("analyze", trace):
+        reused = {}
+        if req.reuse_analyses:
+            reused = await asyncio.to_thread(post_store.find_reusable_analyses, posts, req.platform)
+        for i, analysis in sorted(reused.items()):
+            analyses[i] = {**posts[i], **analysis, "analysis_reused": True}
+            yield _event("analysis", {"index": i, "analysis": analyses[i]})
+
+        pending = [i for i in range(len(posts)) if i not in reused]
+        if req.prescore:
+            escalate, local = prescore.triage([posts[i] for i in pending], req.escalate_top_k)
+            for j, analysis in sorted(local.items()):
+                i = pending[j]
+                analyses[i] = {**posts[i], **analysis}
+                yield _event("analysis", {"index": i, "analysis": analyses[i]})
+            pending = [pending[j] for j in escalate]
+        pending_posts = [posts[i] for i in pending]
+        if req.batch_analysis:
+            try:
+                batch_results = await _until(analyze_by, asyncio.to_thread(
+                    _with_deadline(analyze_by, analyze_sentiment_batch),
+                    pending_posts, req.platform, use_cache=req.use_cache
+                ))
+            except asyncio.TimeoutError:
+                batch_results = []
+            out_of_time = analyze_by is not None and time.monotonic() >= analyze_by
+            for j, analysis in enumerate(batch_results):
+                if out_of_time and (analysis.get("fallback") or analysis.get("degraded")):
+                    continue  # placeholder for a call the deadline cut off
+                i = pending[j]
+                analyses[i] = {**posts[i], **analysis}
+                yield _event("analysis", {"index": i, "analysis": analyses[i]})
+        else:
+            async for j, analysis in iter_sentiment_as_completed(
+                pending_posts, req.platform, max_concurrency=req.max_concurrency, use_cache=req.use_cache,
+                deadline=analyze_by
+            ):
+                i = pending[j]
+                analyses[i] = {**posts[i], **analysis}
+                yield _event("analysis", {"index": i, "analysis": analyses[i]})
+
+        # Posts Gemini did not answer within the budget get the local heuristic instead
+        late = [i for i in pending if analyses[i] is None]
+        if late:
+            metrics.DEADLINE_DEGRADED.inc(len(late), stage="analyze")
+            degraded["analyses"] = late
+            for i, analysis in zip(late, prescore.analyze_locally([posts[i] for i in late])):
+                analyses[i] = {**posts[i], **analysis, "degraded": True}
+                yield _event("analysis", {"index": i, "analysis": analyses[i]})
+
+    # Step 3: Generate viral content, drawing on the niche's stored aggregate too —
+    # unless a recent run for a near-identical niche already produced it
+    with metrics.timed("generate", trace):
+        generate_by = budget.stage_deadline("generate")
+        similar = None
+        if req.use_cache:
+            similar = semantic_cache.lookup(req.niche, req.keywords, req.platform)
+        history = None
+        if req.use_history and not similar:
+            history = await asyncio.to_thread(aggregates.get_summary, req.niche, req.platform)
+        if similar:
+            generated_posts = similar["posts"]
+            if stream_tokens:
+                for post in generated_posts:
+                    yield _event("generated_post", post)
+        elif stream_tokens:
+            generated_posts: List[dict] = []
+            streamed: List[dict] = []
+            try:
+                async for kind, payload in _iterate_in_thread(
+                    generate_viral_content_stream, req.niche, req.platform, analyses, req.use_cache, history,
+                    req.generation_mode, deadline=generate_by
+                ):
+                    if kind == "token":
+                        yield _event("generation_token", payload)
+                    elif kind == "post":
+                        streamed.append(payload)
+                        yield _event("generated_post", payload)
+                    else:
+                        generated_posts = payload
+            except asyncio.TimeoutError:
+                # Keep the posts that completed before the deadline
+                generated_posts = streamed
+                degraded["generation"] = True
+        else:
+            try:
+                generated_posts = await _until(generate_by, asyncio.to_thread(
+                    _with_deadline(generate_by, generate_viral_content),
+                    niche=req.niche,
+                    platform=req.platform,
+                    analyses=analyses,
+                    use_cache=req.use_cache,
+                    history=history,
+                    mode=req.generation_mode
+                ))
+            except asyncio.TimeoutError:
+                generated_posts = []
+                degraded["generation"] = True
+
+        if generate_by is not None and time.monotonic() >= generate_by:
+            # Template posts standing in for a call the deadline cut off
+            degraded["generation"] |= any(p.get("fallback") for p in generated_posts)
+        if degraded["generation"]:
+            metrics.DEADLINE_DEGRADED.inc(stage="generate")
+            generated_posts = [
+                {**p, "degraded": True}
+                for p in generated_posts or fallback_generated_content(req.niche, req.platform)
+            ]
+        elif req.use_cache and not similar:
+            semantic_cache.store(req.niche, req.keywords, req.platform, generated_posts)
+
+    yield _event("generated", generated_posts)
+
+    # Step 4: Persist the run, post snapshots, fresh analyses for reuse and the niche aggregate
+    def _persist() -> int:
+        post_store.record_posts(posts, analyses, req.platform, now, fresh=set(pending))
+        aggregates.update(req.niche, req.platform, analyses, now)
+        return storage.save_run(now, req.niche, req.platform, analyses, generated_posts)
+
+    with metrics.timed("persist", trace):
+        run_id = await asyncio.to_thread(_persist)
+
+    notes = [f"{len(reused)} reused from earlier runs"] if reused else []
+    scored_locally = len(posts) - len(reused) - len(pending)
+    if scored_locally:
+        notes.append(f"{scored_locally} scored locally")
+    note = f" ({', '.join(notes)})" if notes else ""
+    generated = f"generated {len(generated_posts)} viral posts"
+    if similar:
+        generated = f"reused {len(generated_posts)} viral posts generated for similar niche '{similar['niche']}'"
+    cut = []
+    if degraded["scrape"]:
+        cut.append("scrape replaced by stored / sample posts")
+    if degraded["analyses"]:
+        cut.append(f"{len(degraded['analyses'])} analyses scored locally")
+    if degraded["generation"]:
+        cut.append("generation incomplete")
+    deadline_note = f" Deadline reached: {'; '.join(cut)}." if cut else ""
+    yield _event("done", {
+        "success": True,
+        "message": f"Pipeline completed. Analysed {len(analyses)} posts{note}, {generated}.{deadline_note}",
+        "analyses": analyses,
+        "generated_posts": generated_posts,
+        "run_id": run_id,
+        "trace_id": trace.trace_id,
+        "timings": trace.breakdown() if req.include_timings else None,
+        "degraded": degraded if cut else None
+    })
+
+
+async def execute_run(req: RunRequest, trace: Optional[metrics.Trace] = None) -> dict:
+    """Run the pipeline without streaming and return the "done" payload."""
+    result = None
+    async for event in run_events(req, trace=trace):
+        if event["event"] == "done":
+            result = event["data"]
+    return result
+
+
+async def _iterate_in_thread(
+    gen_fn: Callable[..., Any],
+    *args,
+    deadline: Optional[float] = None
+) -> AsyncIterator[Any]:
+    """
+    Drive a blocking generator in a worker thread, yielding its items on the
+    event loop. With a time.monotonic() deadline (also applied to the
+    generator's Gemini calls), raises asyncio.TimeoutError once it passes.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    finished = object()
+
+    def _produce():
+        try:
+            with gemini_scheduler.deadline(deadline):
+                for item in gen_fn(*args):
+                    loop.call_soon_threadsafe(queue.put_nowait, item)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, finished)
+
+    producer = asyncio.ensure_future(asyncio.to_thread(_produce))
+    try:
+        while True:
+            item = await _until(deadline, queue.get())
+            if item is finished:
+                break
+            yield item
+        await producer
+    finally:
+        # Stopped early: the thread runs on, but nobody is waiting for its result
+        if not producer.done():
+            producer.cancel()
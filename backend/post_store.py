@@ -0,0 +1,307 @@
+"""
+Normalized post store for incremental analysis
+- posts: one row per LinkedIn post, keyed by URL (or a content hash when the
+  URL is missing), holding its latest comments and analysis
+- post_snapshots: engagement (likes / comments / shares) each time a post is seen
+- find_reusable_analyses: prior analyses for posts whose comments have not
+  changed materially, so the pipeline only sends new or changed posts to Gemini
+- posts_fts: FTS5 index over post text and latest comments; search_posts ranks
+  keyword matches by BM25 blended with engagement, so runs can be served from
+  posts seen before instead of a fresh scrape
+"""
+
+import os
+import re
+import json
+import math
+import hashlib
+import sqlite3
+from typing import Dict, List, Optional
+import storage
+import metrics
+
+# Comment-set Jaccard similarity at or above which a stored analysis is reused
+REANALYZE_SIMILARITY = float(os.getenv("POST_REANALYZE_SIMILARITY", "0.8"))
+# Share of a search result's score taken from engagement (the rest is text relevance)
+SEARCH_ENGAGEMENT_WEIGHT = float(os.getenv("SEARCH_ENGAGEMENT_WEIGHT", "0.3"))
+
+# BM25 weights for the text and comments columns of posts_fts
+_FTS_COLUMN_WEIGHTS = (1.0, 0.4)
+# Matches fetched by BM25 per requested result, before re-ranking with engagement
+_SEARCH_CANDIDATES_PER_RESULT = 5
+_FTS_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+# False when the SQLite build lacks FTS5; search_posts then finds nothing
+fts_available = True
+
+ANALYSIS_FIELDS = ("overall_sentiment", "tool_usefulness", "common_questions", "key_insights")
+
+
+def init_post_tables():
+    with storage.transaction() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS posts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                post_key TEXT UNIQUE,
+                url TEXT,
+                text TEXT,
+                author TEXT,
+                author_title TEXT,
+                comments_text TEXT,
+                comments_hash TEXT,
+                first_seen TEXT,
+                last_seen TEXT,
+                platform TEXT,
+                analysis TEXT,
+                analyzed_at TEXT
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS post_snapshots (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                post_id INTEGER,
+                captured_at TEXT,
+                likes INTEGER,
+                comments INTEGER,
+                shares INTEGER
+            )
+        """)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_post_snapshots_post ON post_snapshots(post_id, captured_at)"
+        )
+        _init_fts(conn)
+
+
+def _init_fts(conn: sqlite3.Connection):
+    """Create posts_fts; when it is new, index stored posts and posts only kept in run history."""
+    global fts_available
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'posts_fts'").fetchone()
+    try:
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(text, comments, tokenize='porter unicode61')"
+        )
+    except sqlite3.OperationalError as e:
+        print(f"[PostStore] Full-text search unavailable: {e}")
+        fts_available = False
+        return
+    if exists:
+        return
+
+    # Runs from before the post store only have analyses rows; give each such post a posts row
+    rows = conn.execute("""
+        SELECT post_url, post_text, author, likes, comments, shares, platform, created_at
+        FROM analyses ORDER BY created_at, id
+    """).fetchall()
+    for row in rows:
+        if not (row["post_url"] or row["post_text"]):
+            continue
+        post = {"url": row["post_url"], "text": row["post_text"]}
+        key = post_key(post)
+        conn.execute("""
+            INSERT INTO posts (post_key, url, text, author, author_title, first_seen, last_seen, platform)
+            VALUES (?, ?, ?, ?, '', ?, ?, ?)
+            ON CONFLICT(post_key) DO UPDATE SET last_seen = excluded.last_seen
+        """, (key, row["post_url"] or "", row["post_text"] or "", row["author"] or "",
+              row["created_at"], row["created_at"], row["platform"]))
+        post_id = conn.execute("SELECT id FROM posts WHERE post_key = ?", (key,)).fetchone()["id"]
+        has_snapshot = conn.execute(
+            "SELECT 1 FROM post_snapshots WHERE post_id = ? AND captured_at = ?", (post_id, row["created_at"])
+        ).fetchone()
+        if not has_snapshot:
+            conn.execute(
+                "INSERT INTO post_snapshots (post_id, captured_at, likes, comments, shares) VALUES (?, ?, ?, ?, ?)",
+                (post_id, row["created_at"], row["likes"] or 0, row["comments"] or 0, row["shares"] or 0)
+            )
+    conn.executemany(
+        "INSERT INTO posts_fts (rowid, text, comments) VALUES (?, ?, ?)",
+        [
+            (row["id"], row["text"] or "", _fts_comments({"comments_text": json.loads(row["comments_text"] or "[]")}))
+            for row in conn.execute("SELECT id, text, comments_text FROM posts")
+        ]
+    )
+
+
+def post_key(post: dict) -> str:
+    """Stable identity for a post: its URL, or a hash of its text."""
+    url = (post.get("url") or "").strip()
+    if url:
+        return f"url:{url.rstrip('/').lower()}"
+    text = " ".join((post.get("text") or "").split()).lower()
+    return "sha256:" + hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _normalized_comments(post: dict) -> set:
+    return {" ".join(str(c).lower().split()) for c in post.get("comments_text") or [] if str(c).strip()}
+
+
+def _comments_hash(comments: set) -> str:
+    return hashlib.sha256("\n".join(sorted(comments)).encode("utf-8")).hexdigest()
+
+
+def _jaccard(a: set, b: set) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def find_reusable_analyses(posts: List[dict], platform: str) -> Dict[int, dict]:
+    """
+    Return {index in posts: stored analysis} for posts analyzed before on the
+    same platform whose comments are unchanged or nearly so.
+    """
+    keys = [post_key(p) for p in posts]
+    if not keys:
+        return {}
+
+    placeholders = ", ".join("?" for _ in keys)
+    with storage.connection() as conn:
+        rows = {
+            row["post_key"]: row
+            for row in conn.execute(
+                f"SELECT post_key, comments_text, comments_hash, platform, analysis "
+                f"FROM posts WHERE post_key IN ({placeholders}) AND analysis IS NOT NULL",
+                keys
+            )
+        }
+
+    reusable = {}
+    for i, (key, post) in enumerate(zip(keys, posts)):
+        row = rows.get(key)
+        if row is None or row["platform"] != platform:
+            continue
+        comments = _normalized_comments(post)
+        if row["comments_hash"] != _comments_hash(comments):
+            previous = set(json.loads(row["comments_text"] or "[]"))
+            if _jaccard(comments, previous) < REANALYZE_SIMILARITY:
+                continue
+        reusable[i] = json.loads(row["analysis"])
+    return reusable
+
+
+def record_posts(
+    posts: List[dict],
+    analyses: List[Optional[dict]],
+    platform: str,
+    captured_at: str,
+    fresh: Optional[set] = None
+):
+    """
+    Upsert posts, append an engagement snapshot for each, and store the
+    analysis of posts whose index is in fresh (all posts when fresh is None).
+    Mock fallback and locally scored analyses are not stored.
+    """
+    with metrics.DB_WRITE_SECONDS.time(op="record_posts"), storage.transaction() as conn:
+        for i, post in enumerate(posts):
+            comments = _normalized_comments(post)
+            key = post_key(post)
+            conn.execute("""
+                INSERT INTO posts (post_key, url, text, author, author_title, first_seen, last_seen, platform)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(post_key) DO UPDATE SET
+                    text = excluded.text, last_seen = excluded.last_seen
+            """, (
+                key, post.get("url", ""), post.get("text", ""), post.get("author", ""),
+                post.get("author_title", ""), captured_at, captured_at, platform
+            ))
+            post_id = conn.execute("SELECT id FROM posts WHERE post_key = ?", (key,)).fetchone()["id"]
+            conn.execute(
+                "INSERT INTO post_snapshots (post_id, captured_at, likes, comments, shares) VALUES (?, ?, ?, ?, ?)",
+                (post_id, captured_at, post.get("likes", 0), post.get("comments", 0), post.get("shares", 0))
+            )
+            if fts_available:
+                conn.execute(
+                    "INSERT OR REPLACE INTO posts_fts (rowid, text, comments) VALUES (?, ?, ?)",
+                    (post_id, post.get("text", ""), _fts_comments(post))
+                )
+
+            analysis = analyses[i] if i < len(analyses) else None
+            # Placeholder (Gemini unavailable) and local-tier analyses are never kept for reuse
+            keep = analysis and not analysis.get("fallback") and analysis.get("analysis_tier") != "local"
+            if keep and (fresh is None or i in fresh):
+                conn.execute("""
+                    UPDATE posts SET comments_text = ?, comments_hash = ?, platform = ?,
+                        analysis = ?, analyzed_at = ?
+                    WHERE id = ?
+                """, (
+                    json.dumps(sorted(comments)), _comments_hash(comments), platform,
+                    json.dumps({f: analysis.get(f) for f in ANALYSIS_FIELDS}), captured_at, post_id
+                ))
+
+
+# ─── FULL-TEXT SEARCH ─────────────────────────────────────────────────────────
+
+def _fts_comments(post: dict) -> str:
+    """Latest comments, one per line (search_posts splits them back)."""
+    return "\n".join(" ".join(str(c).split()) for c in post.get("comments_text") or [] if str(c).strip())
+
+
+def _match_expression(queries: List[str]) -> str:
+    """FTS5 query matching posts that contain every word of at least one query."""
+    clauses = []
+    for query in queries:
+        words = _FTS_TOKEN.findall(query.lower())
+        if words:
+            clauses.append("(" + " ".join(f'"{w}"' for w in words) + ")")
+    return " OR ".join(clauses)
+
+
+def search_posts(queries: List[str], limit: int = 5) -> List[dict]:
+    """
+    Stored posts containing every word of at least one query, best first, in
+    the scraper's post format (source "local") with their latest engagement.
+    The score blends BM25 relevance and log engagement, each scaled to the
+    best candidate, weighted by SEARCH_ENGAGEMENT_WEIGHT.
+    """
+    expression = _match_expression(queries)
+    if not fts_available or not expression or limit <= 0:
+        return []
+
+    weights = ", ".join(str(w) for w in _FTS_COLUMN_WEIGHTS)
+    with metrics.timed("local_search"), storage.connection() as conn:
+        rows = conn.execute(f"""
+            SELECT p.id, p.url, p.text, p.author, p.author_title, p.last_seen,
+                   posts_fts.comments AS comments_text,
+                   -bm25(posts_fts, {weights}) AS relevance,
+                   s.likes, s.comments, s.shares
+            FROM posts_fts
+            JOIN posts p ON p.id = posts_fts.rowid
+            LEFT JOIN post_snapshots s ON s.id = (
+                SELECT id FROM post_snapshots WHERE post_id = p.id ORDER BY captured_at DESC, id DESC LIMIT 1
+            )
+            WHERE posts_fts MATCH ?
+            ORDER BY bm25(posts_fts, {weights})
+            LIMIT ?
+        """, (expression, limit * _SEARCH_CANDIDATES_PER_RESULT)).fetchall()
+    if not rows:
+        return []
+
+    def _engagement(row) -> float:
+        return math.log1p((row["likes"] or 0) + 2 * (row["comments"] or 0) + 3 * (row["shares"] or 0))
+
+    top_relevance = max(row["relevance"] for row in rows) or 1.0
+    top_engagement = max(_engagement(row) for row in rows) or 1.0
+    scored = []
+    for row in rows:
+        score = (
+            (1 - SEARCH_ENGAGEMENT_WEIGHT) * row["relevance"] / top_relevance
+            + SEARCH_ENGAGEMENT_WEIGHT * _engagement(row) / top_engagement
+        )
+        scored.append((score, row))
+    scored.sort(key=lambda item: item[0], reverse=True)
+
+    return [
+        {
+            "url": row["url"],
+            "author": row["author"],
+            "author_title": row["author_title"],
+            "text": row["text"],
+            "likes": row["likes"] or 0,
+            "comments": row["comments"] or 0,
+            "shares": row["shares"] or 0,
+            "comments_text": [c for c in (row["comments_text"] or "").split("\n") if c],
+            "source": "local",
+            "last_seen": row["last_seen"],
+            "search_score": round(score, 4),
+        }
+        for score, row in scored[:limit]
+    ]
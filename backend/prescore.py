@@ -0,0 +1,200 @@
+"""
+Local pre-scoring tier for Viral Content System
+- score_posts: vectorized engagement features and a lexicon sentiment score
+  over comments_text, for a whole batch of posts at once
+- local_analysis: an analysis dict built from those scores, in the same shape
+  Gemini returns (a data-driven take on _mock_sentiment_analysis)
+- triage: picks the top-K posts worth a Gemini call; the rest keep their
+  local analysis
+- rank_generated: orders generated posts by a cheap local quality score
+"""
+
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+# Posts per run escalated to Gemini; the others get a local analysis
+ANALYSIS_ESCALATE_TOP_K = int(os.getenv("ANALYSIS_ESCALATE_TOP_K", "5"))
+# Minimum engagement value (log1p of likes + 2×comments + 3×shares) for escalation
+PRESCORE_MIN_VALUE = float(os.getenv("PRESCORE_MIN_VALUE", "0"))
+
+_WORD = re.compile(r"[a-z']+")
+
+_POSITIVE = {
+    "great", "love", "loved", "amazing", "awesome", "excellent", "brilliant", "helpful", "useful",
+    "insightful", "valuable", "practical", "true", "agree", "gold", "thanks", "thank", "best",
+    "incredible", "inspiring", "powerful", "underrated", "saving", "bookmarked", "bookmarking",
+    "brave", "honest", "authentic", "clear", "smart", "game", "changer", "nailed", "works", "worked",
+}
+_NEGATIVE = {
+    "wrong", "disagree", "bad", "worst", "terrible", "useless", "fake", "overhyped", "hype",
+    "robotic", "boring", "misleading", "clickbait", "doubt", "failed", "fails", "lost", "dropped",
+    "burned", "burnout", "waste", "wasted", "spam", "cringe", "no", "not", "never", "risky",
+}
+_ACTIONABLE = {
+    "tool", "tools", "template", "workflow", "process", "steps", "framework", "playbook", "how",
+    "tried", "implement", "implemented", "use", "using", "spreadsheet", "checklist", "guide",
+}
+
+
+def _lexicon_counts(comments: List[str]) -> Tuple[int, int, int, int]:
+    """(positive, negative, actionable, question) hits across a post's comments."""
+    pos = neg = act = questions = 0
+    for comment in comments:
+        text = str(comment)
+        words = _WORD.findall(text.lower())
+        pos += sum(1 for w in words if w in _POSITIVE)
+        neg += sum(1 for w in words if w in _NEGATIVE)
+        act += sum(1 for w in words if w in _ACTIONABLE)
+        questions += "?" in text
+    return pos, neg, act, questions
+
+
+def score_posts(posts: List[dict]) -> Dict[str, np.ndarray]:
+    """
+    Feature arrays for a batch of posts (one entry per post):
+      value       log1p(likes + 2×comments + 3×shares), the escalation ranking key
+      discussion  comments per like;  virality  shares per like
+      sentiment   lexicon polarity of the comments in [-1, 1]
+      actionable  actionable-word and question hits per comment
+      priority    value boosted by discussion, virality and actionable comments
+    """
+    engagement = np.array(
+        [[p.get("likes", 0) or 0, p.get("comments", 0) or 0, p.get("shares", 0) or 0] for p in posts],
+        dtype=np.float64
+    ).reshape(-1, 3)
+    counts = np.array(
+        [_lexicon_counts(p.get("comments_text") or []) for p in posts], dtype=np.float64
+    ).reshape(-1, 4)
+    n_comments = np.array([len(p.get("comments_text") or []) for p in posts], dtype=np.float64)
+
+    likes, comments, shares = engagement.T
+    pos, neg, act, questions = counts.T
+    value = np.log1p(engagement @ np.array([1.0, 2.0, 3.0]))
+    discussion = comments / np.maximum(likes, 1.0)
+    virality = shares / np.maximum(likes, 1.0)
+    sentiment = (pos - neg) / (pos + neg + 1.0)
+    actionable = (act + questions) / np.maximum(n_comments, 1.0)
+    priority = value * (
+        1.0 + np.minimum(discussion, 1.0) + np.minimum(virality, 1.0) + 0.5 * np.minimum(actionable, 1.0)
+    )
+    return {
+        "value": value,
+        "discussion": discussion,
+        "virality": virality,
+        "sentiment": sentiment,
+        "actionable": actionable,
+        "priority": priority,
+    }
+
+
+def local_analysis(post: dict, features: Dict[str, np.ndarray], i: int) -> dict:
+    """Analysis of post i from its local features, tagged analysis_tier="local"."""
+    sentiment = float(features["sentiment"][i])
+    virality = float(features["virality"][i])
+    actionable = float(features["actionable"][i])
+    questions = [str(c).strip() for c in post.get("comments_text") or [] if "?" in str(c)][:3]
+
+    overall = int(np.clip(np.rint(3 + 2 * sentiment), 1, 5))
+    usefulness = int(np.clip(np.rint(2 + 2 * min(actionable, 1.0) + 4 * min(virality, 0.25)), 1, 5))
+    tone = "positive" if sentiment > 0.2 else ("critical" if sentiment < -0.2 else "mixed")
+    return {
+        "overall_sentiment": overall,
+        "tool_usefulness": usefulness,
+        "common_questions": questions,
+        "key_insights": (
+            f"Scored locally: {post.get('likes', 0)} likes, {post.get('shares', 0)} shares and a "
+            f"{tone} comment thread ({virality:.0%} share rate)."
+        ),
+        "analysis_tier": "local"
+    }
+
+
+def analyze_locally(posts: List[dict]) -> List[dict]:
+    """local_analysis of every post, in input order."""
+    if not posts:
+        return []
+    features = score_posts(posts)
+    return [local_analysis(post, features, i) for i, post in enumerate(posts)]
+
+
+def triage(posts: List[dict], top_k: Optional[int] = None) -> Tuple[List[int], Dict[int, dict]]:
+    """
+    Split posts into (indices to escalate to Gemini, {index: local analysis}).
+    The top_k posts by priority whose value reaches PRESCORE_MIN_VALUE are
+    escalated, in input order; everything else is analyzed locally.
+    """
+    if not posts:
+        return [], {}
+    k = ANALYSIS_ESCALATE_TOP_K if top_k is None else top_k
+    features = score_posts(posts)
+    eligible = np.flatnonzero(features["value"] >= PRESCORE_MIN_VALUE)
+    ranked = eligible[np.argsort(-features["priority"][eligible], kind="stable")]
+    escalate = sorted(int(i) for i in ranked[:max(0, k)])
+    chosen = set(escalate)
+    local = {i: local_analysis(post, features, i) for i, post in enumerate(posts) if i not in chosen}
+    return escalate, local
+
+
+# ─── GENERATED POST RANKING ───────────────────────────────────────────────────
+
+# Weights of: hook length, specific hook, skimmable body, body length, question CTA,
+# hashtag count, overlap with audience questions / insights, model's viral_score
+_RANK_WEIGHTS = np.array([0.15, 0.1, 0.15, 0.1, 0.1, 0.05, 0.2, 0.15])
+_STOPWORDS = {
+    "about", "after", "again", "because", "before", "being", "could", "does", "doing", "every",
+    "from", "have", "here", "into", "just", "more", "most", "much", "other", "over", "same",
+    "should", "some", "such", "than", "that", "their", "them", "then", "there", "these", "they",
+    "this", "those", "very", "what", "when", "where", "which", "while", "with", "would", "your",
+}
+
+
+def _within(value: float, low: float, high: float) -> float:
+    """1 inside [low, high], falling off linearly to 0 at half / double the bounds."""
+    if value < low:
+        return max(0.0, (value - low / 2) / (low / 2))
+    if value > high:
+        return max(0.0, 1 - (value - high) / high)
+    return 1.0
+
+
+def _audience_terms(analyses: Optional[List[dict]]) -> set:
+    text = " ".join(
+        " ".join(map(str, a.get("common_questions") or [])) + " " + (
+            a.get("key_insights", "") if a.get("analysis_tier") != "local" else ""
+        )
+        for a in analyses or [] if a and not a.get("fallback")
+    )
+    return {w for w in _WORD.findall(text.lower()) if len(w) > 3 and w not in _STOPWORDS}
+
+
+def rank_generated(posts: List[dict], analyses: Optional[List[dict]] = None) -> List[dict]:
+    """
+    Generated posts best first, each with a rank_score in [0, 1] from hook
+    shape, body structure and length, the CTA, hashtags, overlap with what
+    the audience asked about (from analyses) and the model's own viral_score.
+    """
+    if not posts:
+        return []
+    terms = _audience_terms(analyses)
+    rows = []
+    for p in posts:
+        hook = (p.get("hook") or "").strip()
+        body = p.get("body") or ""
+        first_line = hook.splitlines()[0] if hook else ""
+        lines = [line for line in body.splitlines() if line.strip()]
+        words = set(_WORD.findall(f"{hook} {body} {p.get('cta', '')}".lower()))
+        rows.append([
+            _within(len(first_line), 40, 150),
+            1.0 if any(c.isdigit() for c in hook) else 0.0,
+            min(len(lines) / 6, 1.0),
+            _within(len(body), 400, 1500),
+            1.0 if "?" in (p.get("cta") or "") else 0.0,
+            1.0 if 3 <= len(p.get("hashtags") or []) <= 5 else 0.5,
+            min(len(words & terms) / 5, 1.0) if terms else 0.5,
+            (float(p.get("viral_score", 7)) - 1) / 9,
+        ])
+    scores = np.array(rows, dtype=np.float64) @ _RANK_WEIGHTS
+    order = np.argsort(-scores, kind="stable")
+    return [{**posts[i], "rank_score": round(float(scores[i]), 3)} for i in order]
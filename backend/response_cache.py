@@ -0,0 +1,122 @@
+"""
+Persistent response cache for Gemini calls
+- Keyed by a SHA-256 of (model name, prompt, generation config)
+- Stored in the app's SQLite database (via storage), with TTL and size-bounded LRU eviction
+- Keeps hit/miss counters for the /api/cache/stats endpoint
+"""
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import Optional
+import storage
+
+CACHE_TTL_SECONDS = int(os.getenv("GEMINI_CACHE_TTL", "86400"))
+CACHE_MAX_ENTRIES = int(os.getenv("GEMINI_CACHE_MAX_ENTRIES", "5000"))
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "writes": 0, "expired": 0, "evictions": 0}
+
+
+def init_cache_table():
+    with storage.transaction() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS gemini_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT,
+                created_at REAL,
+                last_access REAL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_gemini_cache_last_access ON gemini_cache(last_access)")
+
+
+def _bump(counter: str, n: int = 1):
+    with _stats_lock:
+        _stats[counter] += n
+
+
+def make_key(model: str, prompt: str, generation_config: Optional[dict] = None) -> str:
+    """Content address for a model call."""
+    payload = json.dumps([model, prompt, generation_config or {}], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get(key: str) -> Optional[str]:
+    """Return the cached response text, or None on a miss or expired entry."""
+    try:
+        with storage.connection() as conn:
+            row = conn.execute(
+                "SELECT response, created_at FROM gemini_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                _bump("misses")
+                return None
+
+            now = time.time()
+            if now - row[1] > CACHE_TTL_SECONDS:
+                with conn:
+                    conn.execute("DELETE FROM gemini_cache WHERE key = ?", (key,))
+                _bump("expired")
+                _bump("misses")
+                return None
+
+            with conn:
+                conn.execute("UPDATE gemini_cache SET last_access = ? WHERE key = ?", (now, key))
+        _bump("hits")
+        return row[0]
+    except sqlite3.Error as e:
+        print(f"[Cache] Read failed: {e}")
+        _bump("misses")
+        return None
+
+
+def put(key: str, model: str, response: str):
+    """Store a response and evict least-recently-used entries beyond the size limit."""
+    try:
+        now = time.time()
+        with storage.connection() as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO gemini_cache (key, model, response, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, model, response, now, now)
+            )
+            evicted = conn.execute("""
+                DELETE FROM gemini_cache WHERE key IN (
+                    SELECT key FROM gemini_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )
+            """, (CACHE_MAX_ENTRIES,)).rowcount
+        _bump("writes")
+        if evicted > 0:
+            _bump("evictions", evicted)
+    except sqlite3.Error as e:
+        print(f"[Cache] Write failed: {e}")
+
+
+def discard(key: str):
+    """Drop a single entry, e.g. when its cached response no longer parses."""
+    try:
+        with storage.connection() as conn, conn:
+            conn.execute("DELETE FROM gemini_cache WHERE key = ?", (key,))
+    except sqlite3.Error as e:
+        print(f"[Cache] Delete failed: {e}")
+
+
+def stats() -> dict:
+    """Counters since process start plus the current number of stored entries."""
+    with _stats_lock:
+        snapshot = dict(_stats)
+    lookups = snapshot["hits"] + snapshot["misses"]
+    snapshot["hit_rate"] = round(snapshot["hits"] / lookups, 4) if lookups else 0.0
+    try:
+        with storage.connection() as conn:
+            snapshot["entries"] = conn.execute("SELECT COUNT(*) FROM gemini_cache").fetchone()[0]
+    except sqlite3.Error:
+        snapshot["entries"] = None
+    snapshot["ttl_seconds"] = CACHE_TTL_SECONDS
+    snapshot["max_entries"] = CACHE_MAX_ENTRIES
+    return snapshot
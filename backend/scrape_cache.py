@@ -0,0 +1,178 @@
+"""
+Scrape result cache for Viral Content System
+- Keyed by the normalized keyword set and num_posts
+- In-memory LRU in front of a SQLite table, so entries survive restarts
+- Fresh entries are served directly; stale entries are served immediately
+  while a background refresh runs (stale-while-revalidate)
+- Concurrent requests for the same key share one in-flight fetch
+"""
+
+import os
+import copy
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Tuple
+import storage
+
+SCRAPE_CACHE_TTL_SECONDS = int(os.getenv("SCRAPE_CACHE_TTL", "900"))
+SCRAPE_CACHE_STALE_SECONDS = int(os.getenv("SCRAPE_CACHE_STALE_TTL", "86400"))
+SCRAPE_CACHE_MEMORY_ENTRIES = int(os.getenv("SCRAPE_CACHE_MEMORY_ENTRIES", "256"))
+
+_lock = threading.Lock()
+_memory: "OrderedDict[str, Tuple[float, List[dict]]]" = OrderedDict()
+_inflight: dict = {}
+_stats = {"fresh_hits": 0, "stale_hits": 0, "misses": 0, "fetches": 0, "shared_fetches": 0, "refresh_errors": 0}
+
+
+def init_cache_table():
+    with storage.transaction() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS scrape_cache (
+                key TEXT PRIMARY KEY,
+                posts TEXT,
+                fetched_at REAL
+            )
+        """)
+
+
+def make_key(keywords: List[str], num_posts: int) -> str:
+    """Order- and case-insensitive key for a keyword set."""
+    normalized = sorted({" ".join(k.lower().split()) for k in keywords if k and k.strip()})
+    return json.dumps([normalized, int(num_posts)])
+
+
+def get_or_fetch(
+    keywords: List[str],
+    num_posts: int,
+    fetch: Callable[[], List[dict]],
+    use_cache: bool = True
+) -> List[dict]:
+    """
+    Return posts for the keyword set, calling fetch() only when needed.
+    use_cache=False always fetches (still sharing an in-flight fetch) and
+    refreshes the stored entry.
+    """
+    key = make_key(keywords, num_posts)
+
+    if use_cache:
+        entry = _lookup(key)
+        if entry is not None:
+            fetched_at, posts = entry
+            age = time.time() - fetched_at
+            if age < SCRAPE_CACHE_TTL_SECONDS:
+                _bump("fresh_hits")
+                return copy.deepcopy(posts)
+            if age < SCRAPE_CACHE_STALE_SECONDS:
+                _bump("stale_hits")
+                _refresh_in_background(key, fetch)
+                return copy.deepcopy(posts)
+        _bump("misses")
+
+    return copy.deepcopy(_fetch_shared(key, fetch))
+
+
+def stats() -> dict:
+    with _lock:
+        snapshot = dict(_stats)
+        snapshot["memory_entries"] = len(_memory)
+        snapshot["inflight"] = len(_inflight)
+    snapshot["ttl_seconds"] = SCRAPE_CACHE_TTL_SECONDS
+    snapshot["stale_ttl_seconds"] = SCRAPE_CACHE_STALE_SECONDS
+    return snapshot
+
+
+def _bump(counter: str):
+    with _lock:
+        _stats[counter] += 1
+
+
+def _lookup(key: str) -> Optional[Tuple[float, List[dict]]]:
+    with _lock:
+        entry = _memory.get(key)
+        if entry is not None:
+            _memory.move_to_end(key)
+            return entry
+
+    try:
+        with storage.connection() as conn:
+            row = conn.execute(
+                "SELECT fetched_at, posts FROM scrape_cache WHERE key = ?", (key,)
+            ).fetchone()
+    except sqlite3.Error as e:
+        print(f"[ScrapeCache] Read failed: {e}")
+        return None
+    if row is None:
+        return None
+
+    entry = (row[0], json.loads(row[1]))
+    _remember(key, entry)
+    return entry
+
+
+def _remember(key: str, entry: Tuple[float, List[dict]]):
+    with _lock:
+        _memory[key] = entry
+        _memory.move_to_end(key)
+        while len(_memory) > SCRAPE_CACHE_MEMORY_ENTRIES:
+            _memory.popitem(last=False)
+
+
+def _store(key: str, posts: List[dict]):
+    entry = (time.time(), posts)
+    _remember(key, entry)
+    try:
+        with storage.connection() as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO scrape_cache (key, posts, fetched_at) VALUES (?, ?, ?)",
+                (key, json.dumps(posts), entry[0])
+            )
+    except sqlite3.Error as e:
+        print(f"[ScrapeCache] Write failed: {e}")
+
+
+def _fetch_shared(key: str, fetch: Callable[[], List[dict]]) -> List[dict]:
+    """Single-flight: the first caller fetches, concurrent callers wait for its result."""
+    with _lock:
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = Future()
+            _inflight[key] = future
+            _stats["fetches"] += 1
+        else:
+            _stats["shared_fetches"] += 1
+
+    if not owner:
+        return future.result()
+
+    try:
+        posts = fetch()
+        if posts:
+            _store(key, posts)
+        future.set_result(posts)
+        return posts
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+
+
+def _refresh_in_background(key: str, fetch: Callable[[], List[dict]]):
+    with _lock:
+        if key in _inflight:
+            return
+
+    def _run():
+        try:
+            _fetch_shared(key, fetch)
+        except Exception as e:
+            _bump("refresh_errors")
+            print(f"[ScrapeCache] Background refresh failed: {e}")
+
+    threading.Thread(target=_run, name="scrape-cache-refresh", daemon=True).start()
@@ -1,12 +1,44 @@
 """
 Scraper module for Viral Content System
 - Mock mode: returns realistic sample LinkedIn posts (default, no API key needed)
-- Apify mode: calls real Apify LinkedIn scraper (requires token)
+- Apify mode: calls real Apify LinkedIn scraper (requires token), with results
+  cached per keyword set (see scrape_cache)
+- get_linkedin_posts_for_niches: one combined Apify run for several niches,
+  with the results attributed back to each niche
+- Local corpus mode: keyword queries are answered from the full-text index of
+  stored posts (see post_store.search_posts); the mock / Apify path only runs
+  when it has too few matches
+- Apify calls go through a circuit breaker: while Apify is failing, fetches
+  fail fast and runs fall back to cached or mock posts without waiting
 """
 
+import os
+import copy
+import time
 import random
-import requests
-from typing import List, Optional
+import threading
+from typing import TYPE_CHECKING, Iterator, List, Optional, Tuple
+from circuit_breaker import CircuitOpenError
+import circuit_breaker
+import scrape_cache
+import post_store
+import metrics
+
+if TYPE_CHECKING:
+    import requests
+
+APIFY_API_BASE = os.getenv("APIFY_API_BASE", "https://api.apify.com").rstrip("/")
+APIFY_ACTOR_ID = "apify~linkedin-post-search-scraper"
+# "async" starts the actor and pages through its dataset; "sync" uses run-sync-get-dataset-items
+APIFY_MODE = os.getenv("APIFY_MODE", "async")
+APIFY_PAGE_SIZE = int(os.getenv("APIFY_PAGE_SIZE", "100"))
+APIFY_RUN_TIMEOUT = int(os.getenv("APIFY_RUN_TIMEOUT", "600"))
+APIFY_WAIT_SECONDS = 60
+APIFY_REQUEST_TIMEOUT = 30
+APIFY_MAX_RETRIES = int(os.getenv("APIFY_MAX_RETRIES", "4"))
+APIFY_TERMINAL_STATUSES = {"SUCCEEDED", "FAILED", "ABORTED", "TIMED-OUT"}
+# Default for local_corpus: serve posts from the stored-post index when it has enough matches
+LOCAL_CORPUS = os.getenv("LOCAL_CORPUS", "0") == "1"
 
 
 # ─── MOCK DATA ────────────────────────────────────────────────────────────────
@@ -104,21 +136,116 @@ def get_linkedin_posts(
     keywords: Optional[List[str]] = None,
     num_posts: int = 5,
     use_mock: bool = True,
-    apify_token: Optional[str] = None
+    apify_token: Optional[str] = None,
+    use_cache: bool = True,
+    local_corpus: Optional[bool] = None
 ) -> List[dict]:
     """
     Fetch LinkedIn posts either from mock data or Apify.
+    With local_corpus (default LOCAL_CORPUS), stored posts matching the
+    keywords are returned instead when there are at least num_posts of them.
+    Apify results are served from the scrape cache when available.
     Falls back to mock if Apify fails.
     """
+    queries = keywords or [niche]
+    if local_corpus is None:
+        local_corpus = LOCAL_CORPUS
+    if local_corpus:
+        local = _search_local(niche, queries, num_posts)
+        if local is not None:
+            return local
+
     if not use_mock and apify_token:
         try:
-            return _fetch_apify_linkedin(keywords or [niche], num_posts, apify_token)
+            return scrape_cache.get_or_fetch(
+                queries,
+                num_posts,
+                lambda: _fetch_apify_linkedin(queries, num_posts, apify_token),
+                use_cache=use_cache
+            )
         except Exception as e:
             print(f"[Apify] Failed: {e}. Falling back to mock data.")
+            metrics.FALLBACKS.inc(component="scrape", reason=_fallback_reason(e))
 
     return _get_mock_posts(niche, num_posts)
 
 
+def get_linkedin_posts_for_niches(
+    niches: List[Tuple[str, Optional[List[str]]]],
+    num_posts: int = 5,
+    use_mock: bool = True,
+    apify_token: Optional[str] = None,
+    use_cache: bool = True,
+    local_corpus: Optional[bool] = None
+) -> List[List[dict]]:
+    """
+    Fetch posts for several (niche, keywords) specs; returns one post list per
+    spec. With local_corpus, niches the stored-post index has enough matches
+    for are served from it first. With Apify, the remaining queries go into a
+    single actor run and each post is attributed to the niches whose queries it
+    matches (every word of a query appears in the text). A niche the combined
+    run has no posts for falls back to its own get_linkedin_posts call, as does
+    every niche if the run fails.
+    """
+    specs = [(niche, keywords or [niche]) for niche, keywords in niches]
+    results: List[Optional[List[dict]]] = [None] * len(specs)
+    if local_corpus is None:
+        local_corpus = LOCAL_CORPUS
+    if local_corpus:
+        results = [_search_local(niche, qs, num_posts) for niche, qs in specs]
+    remaining = [i for i, posts in enumerate(results) if posts is None]
+    if not remaining:
+        return results
+
+    if use_mock or not apify_token:
+        # Copies, so niches sharing a mock post do not overwrite each other's tag
+        for i in remaining:
+            results[i] = copy.deepcopy(_get_mock_posts(specs[i][0], num_posts))
+        return results
+
+    specs = [specs[i] for i in remaining]
+    queries = list({" ".join(q.lower().split()): q for _, qs in specs for q in qs}.values())
+    total = num_posts * len(specs)
+    try:
+        combined = scrape_cache.get_or_fetch(
+            queries,
+            total,
+            lambda: _fetch_apify_linkedin(queries, total, apify_token),
+            use_cache=use_cache
+        )
+    except Exception as e:
+        print(f"[Apify] Combined run failed: {e}. Scraping niches one by one.")
+        metrics.FALLBACKS.inc(component="scrape", reason=_fallback_reason(e))
+        combined = []
+
+    for i, (niche, qs) in zip(remaining, specs):
+        terms = [q.lower().split() for q in qs]
+        matched = [
+            p for p in combined
+            if any(all(w in (p.get("text") or "").lower() for w in words) for words in terms)
+        ][:num_posts]
+        if not matched:
+            matched = get_linkedin_posts(niche, qs, num_posts, use_mock, apify_token, use_cache, local_corpus=False)
+        results[i] = matched
+    return results
+
+
+def _search_local(niche: str, queries: List[str], num_posts: int) -> Optional[List[dict]]:
+    """num_posts stored posts matching queries, tagged with niche, or None if there are fewer."""
+    try:
+        posts = post_store.search_posts(queries, num_posts)
+    except Exception as e:
+        print(f"[LocalCorpus] Search failed: {e}")
+        posts = []
+    if len(posts) < num_posts:
+        metrics.LOCAL_CORPUS_LOOKUPS.inc(outcome="insufficient")
+        return None
+    metrics.LOCAL_CORPUS_LOOKUPS.inc(outcome="served")
+    for post in posts:
+        post["niche"] = niche
+    return posts
+
+
 def _get_mock_posts(niche: str, num_posts: int) -> List[dict]:
     """Return shuffled mock posts, optionally filtered by niche keywords."""
     posts = MOCK_LINKEDIN_POSTS.copy()
@@ -141,43 +268,183 @@ def _fetch_apify_linkedin(
     """
     Call Apify's LinkedIn Posts Scraper actor.
     Actor ID: apify/linkedin-post-search-scraper
+    APIFY_MODE=async (default) starts the actor and streams its dataset page by
+    page; APIFY_MODE=sync uses the run-sync-get-dataset-items endpoint.
+    Raises CircuitOpenError without calling Apify while its circuit is open.
     """
-    actor_id = "apify~linkedin-post-search-scraper"
-    run_url = f"https://api.apify.com/v2/acts/{actor_id}/run-sync-get-dataset-items"
+    breaker = circuit_breaker.apify
+    if not breaker.allow():
+        raise CircuitOpenError("Apify circuit is open")
+    try:
+        with metrics.timed("apify_fetch"):
+            if APIFY_MODE == "sync":
+                posts = _fetch_apify_linkedin_sync(keywords, num_posts, apify_token)
+            else:
+                posts = list(iter_apify_linkedin(keywords, num_posts, apify_token))
+    except Exception as e:
+        # Client errors other than 429 (e.g. a bad token) mean Apify itself is up
+        status = getattr(getattr(e, "response", None), "status_code", None)
+        if status is None or status == 429 or status >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        raise
+    breaker.record_success()
+    return posts
+
+
+def _fallback_reason(error: Exception) -> str:
+    return "circuit_open" if isinstance(error, CircuitOpenError) else "error"
+
+
+def iter_apify_linkedin(
+    keywords: List[str],
+    num_posts: int,
+    apify_token: str
+) -> Iterator[dict]:
+    """
+    Start the actor asynchronously, wait for the run to finish, then yield
+    normalized posts while paging through its dataset. Only one page of raw
+    items is held in memory at a time.
+    """
+    session = _get_session()
+    headers = _apify_headers(apify_token)
+
+    response = session.post(
+        f"{APIFY_API_BASE}/v2/acts/{APIFY_ACTOR_ID}/runs",
+        json=_apify_payload(keywords, num_posts),
+        headers=headers,
+        timeout=APIFY_REQUEST_TIMEOUT
+    )
+    response.raise_for_status()
+    run = response.json()["data"]
+
+    deadline = time.monotonic() + APIFY_RUN_TIMEOUT
+    while run.get("status") not in APIFY_TERMINAL_STATUSES:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Apify run {run.get('id')} did not finish within {APIFY_RUN_TIMEOUT}s")
+        # Apify long-polls: the request returns as soon as the run finishes
+        response = session.get(
+            f"{APIFY_API_BASE}/v2/actor-runs/{run['id']}",
+            params={"waitForFinish": APIFY_WAIT_SECONDS},
+            headers=headers,
+            timeout=APIFY_WAIT_SECONDS + APIFY_REQUEST_TIMEOUT
+        )
+        response.raise_for_status()
+        run = response.json()["data"]
+
+    if run["status"] != "SUCCEEDED":
+        raise RuntimeError(f"Apify run {run.get('id')} ended with status {run['status']}")
+
+    yielded = 0
+    offset = 0
+    while yielded < num_posts:
+        limit = min(APIFY_PAGE_SIZE, num_posts - yielded)
+        response = session.get(
+            f"{APIFY_API_BASE}/v2/datasets/{run['defaultDatasetId']}/items",
+            params={"offset": offset, "limit": limit, "clean": "true", "format": "json"},
+            headers=headers,
+            timeout=APIFY_REQUEST_TIMEOUT
+        )
+        response.raise_for_status()
+        page = response.json()
+        if not page:
+            break
+        for item in page:
+            yield _normalize_apify_item(item)
+            yielded += 1
+        offset += len(page)
+        if len(page) < limit:
+            break
 
-    payload = {
+
+def _fetch_apify_linkedin_sync(
+    keywords: List[str],
+    num_posts: int,
+    apify_token: str
+) -> List[dict]:
+    """Single blocking call; capped by Apify's sync timeout and loads the whole dataset."""
+    run_url = f"{APIFY_API_BASE}/v2/acts/{APIFY_ACTOR_ID}/run-sync-get-dataset-items"
+
+    response = _get_session().post(
+        run_url,
+        json=_apify_payload(keywords, num_posts),
+        headers=_apify_headers(apify_token),
+        timeout=60
+    )
+    response.raise_for_status()
+
+    return [_normalize_apify_item(p) for p in response.json()]
+
+
+def _apify_payload(keywords: List[str], num_posts: int) -> dict:
+    return {
         "queries": keywords,
         "maxResults": num_posts,
         "proxy": {"useApifyProxy": True}
     }
 
-    headers = {
+
+def _apify_headers(apify_token: str) -> dict:
+    return {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {apify_token}"
     }
 
-    response = requests.post(
-        run_url,
-        json=payload,
-        headers=headers,
-        timeout=60
-    )
-    response.raise_for_status()
 
-    raw_posts = response.json()
-    normalized = []
-
-    for p in raw_posts:
-        normalized.append({
-            "url": p.get("url") or p.get("postUrl", ""),
-            "author": p.get("authorName") or p.get("author", {}).get("name", "Unknown"),
-            "author_title": p.get("authorTitle", ""),
-            "text": p.get("text") or p.get("content", ""),
-            "likes": p.get("likesCount") or p.get("likes", 0),
-            "comments": p.get("commentsCount") or p.get("comments", 0),
-            "shares": p.get("sharesCount") or p.get("shares", 0),
-            "comments_text": p.get("topComments", []),
-            "source": "apify"
-        })
-
-    return normalized
+def _normalize_apify_item(p: dict) -> dict:
+    return {
+        "url": p.get("url") or p.get("postUrl", ""),
+        "author": p.get("authorName") or p.get("author", {}).get("name", "Unknown"),
+        "author_title": p.get("authorTitle", ""),
+        "text": p.get("text") or p.get("content", ""),
+        "likes": p.get("likesCount") or p.get("likes", 0),
+        "comments": p.get("commentsCount") or p.get("comments", 0),
+        "shares": p.get("sharesCount") or p.get("shares", 0),
+        "comments_text": p.get("topComments", []),
+        "source": "apify"
+    }
+
+
+# ─── HTTP SESSION ─────────────────────────────────────────────────────────────
+
+_session: Optional["requests.Session"] = None
+_session_lock = threading.Lock()
+
+
+def _get_session() -> "requests.Session":
+    """
+    Shared keep-alive session for Apify calls. Idempotent requests are retried
+    with exponential backoff on connection errors, 429 and 5xx responses;
+    POSTs are only retried when the connection could not be established.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            # Imported here so mock-mode workers never load requests / urllib3
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            class _CountingRetry(Retry):
+                """Retry policy that counts each retry in viral_apify_retries_total."""
+
+                def increment(self, *args, **kwargs):
+                    metrics.APIFY_RETRIES.inc()
+                    return super().increment(*args, **kwargs)
+
+            retry = _CountingRetry(
+                total=APIFY_MAX_RETRIES,
+                connect=APIFY_MAX_RETRIES,
+                backoff_factor=0.5,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset({"GET"}),
+                respect_retry_after_header=True,
+                raise_on_status=False
+            )
+            adapter = HTTPAdapter(max_retries=retry, pool_connections=4, pool_maxsize=16)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+    return _session
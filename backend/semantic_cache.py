@@ -0,0 +1,151 @@
+"""
+Semantic cache for generated content
+- Requests are matched on niche + keywords as hashed TF-IDF vectors (word
+  stems plus character trigrams, no embedding service), so "growth mindset",
+  "growth and mindset" and "mindset growth" land on the same entry
+- lookup: cosine search (NumPy) over recent results for the same platform;
+  the best match at or above SEMANTIC_CACHE_THRESHOLD is served
+- store: remembers a run's generated posts; the cache is in-process, bounded
+  to SEMANTIC_CACHE_MAX_ENTRIES with LRU eviction and a TTL
+"""
+
+import os
+import re
+import copy
+import time
+import zlib
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+import numpy as np
+import metrics
+
+SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE", "1") == "1"
+# Cosine similarity (0-1) at or above which a cached result is served
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.85"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "256"))
+SEMANTIC_CACHE_TTL_SECONDS = int(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+
+_DIM = 2048
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {"a", "an", "and", "the", "of", "for", "in", "on", "to", "with", "or", "vs", "my", "your"}
+
+_lock = threading.Lock()
+# key → {"platform", "niche", "keywords", "counts", "posts", "created_at"}, least recently used first
+_entries: "OrderedDict[str, dict]" = OrderedDict()
+_stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+
+def _stem(word: str) -> str:
+    for suffix in ("ing", "ers", "er", "es", "s"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 4:
+            return word[:-len(suffix)]
+    return word
+
+
+def _terms(niche: str, keywords: Optional[List[str]]) -> List[str]:
+    text = " ".join([niche, *(keywords or [])]).lower()
+    words = [_stem(w) for w in _TOKEN.findall(text) if w not in _STOPWORDS]
+    trigrams = [f"#{w[i:i + 3]}" for w in words for i in range(max(1, len(w) - 2))]
+    return words + trigrams
+
+
+def _counts(niche: str, keywords: Optional[List[str]]) -> np.ndarray:
+    """Sublinear term frequencies, hashed into _DIM buckets."""
+    counts = np.zeros(_DIM, dtype=np.float32)
+    for term in _terms(niche, keywords):
+        counts[zlib.crc32(term.encode("utf-8")) % _DIM] += 1
+    nonzero = counts > 0
+    counts[nonzero] = 1 + np.log(counts[nonzero])
+    return counts
+
+
+def _key(platform: str, niche: str, keywords: Optional[List[str]]) -> str:
+    return platform + "|" + " ".join(sorted(set(_terms(niche, keywords))))
+
+
+def _expire(now: float):
+    for key in [k for k, e in _entries.items() if now - e["created_at"] > SEMANTIC_CACHE_TTL_SECONDS]:
+        del _entries[key]
+
+
+def lookup(niche: str, keywords: Optional[List[str]], platform: str) -> Optional[dict]:
+    """
+    Best cached result for a similar request on the same platform, as
+    {"posts", "similarity", "niche", "keywords"}, or None. IDF weights come
+    from the entries currently cached.
+    """
+    if not SEMANTIC_CACHE:
+        return None
+    query = _counts(niche, keywords)
+    with _lock:
+        _expire(time.time())
+        keys = [k for k, e in _entries.items() if e["platform"] == platform]
+        if not keys or not query.any():
+            _stats["misses"] += 1
+            metrics.SEMANTIC_CACHE_LOOKUPS.inc(outcome="miss")
+            return None
+
+        matrix = np.stack([_entries[k]["counts"] for k in keys])
+        df = np.count_nonzero(matrix, axis=0)
+        idf = np.log((1 + len(keys)) / (1 + df)) + 1
+        weighted = matrix * idf
+        q = query * idf
+        norms = np.linalg.norm(weighted, axis=1) * np.linalg.norm(q)
+        similarity = (weighted @ q) / np.maximum(norms, 1e-12)
+        best = int(np.argmax(similarity))
+        score = float(similarity[best])
+
+        if score < SEMANTIC_CACHE_THRESHOLD:
+            _stats["misses"] += 1
+            metrics.SEMANTIC_CACHE_LOOKUPS.inc(outcome="miss")
+            return None
+        _entries.move_to_end(keys[best])
+        entry = _entries[keys[best]]
+        _stats["hits"] += 1
+    metrics.SEMANTIC_CACHE_LOOKUPS.inc(outcome="hit")
+    return {
+        "posts": [{**p, "niche": niche} for p in copy.deepcopy(entry["posts"])],
+        "similarity": round(score, 4),
+        "niche": entry["niche"],
+        "keywords": entry["keywords"],
+    }
+
+
+def store(niche: str, keywords: Optional[List[str]], platform: str, posts: List[dict]):
+    """Remember a run's generated posts; mock fallbacks are not stored."""
+    if not SEMANTIC_CACHE or not posts or any(p.get("fallback") for p in posts):
+        return
+    key = _key(platform, niche, keywords)
+    entry = {
+        "platform": platform,
+        "niche": niche,
+        "keywords": list(keywords or []),
+        "counts": _counts(niche, keywords),
+        "posts": copy.deepcopy(posts),
+        "created_at": time.time(),
+    }
+    with _lock:
+        _entries[key] = entry
+        _entries.move_to_end(key)
+        _stats["writes"] += 1
+        while len(_entries) > SEMANTIC_CACHE_MAX_ENTRIES:
+            _entries.popitem(last=False)
+            _stats["evictions"] += 1
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+
+
+def stats() -> dict:
+    with _lock:
+        snapshot = dict(_stats)
+        snapshot["entries"] = len(_entries)
+    lookups = snapshot["hits"] + snapshot["misses"]
+    snapshot["hit_rate"] = round(snapshot["hits"] / lookups, 4) if lookups else 0.0
+    snapshot["threshold"] = SEMANTIC_CACHE_THRESHOLD
+    snapshot["max_entries"] = SEMANTIC_CACHE_MAX_ENTRIES
+    snapshot["ttl_seconds"] = SEMANTIC_CACHE_TTL_SECONDS
+    return snapshot
@@ -0,0 +1,456 @@
+"""
+SQLite storage layer for Viral Content System
+- A small pool of WAL-mode connections shared by every handler and cache
+- init_db: creates the application tables
+- save_run: writes all rows of a pipeline run in one transaction,
+  optionally through a background writer thread
+- query_history / get_run: indexed, keyset-paginated reads
+- iter_history: whole-table reads in keyset chunks, for exports
+"""
+
+import os
+import json
+import base64
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+import metrics
+
+DB_PATH = os.getenv("VIRAL_DB_PATH", "viral_content.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+# "NORMAL" is durable across application crashes in WAL mode; "FULL" also survives power loss
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+# Hand run writes to a background thread so responses don't wait on disk
+DB_BACKGROUND_WRITES = os.getenv("DB_BACKGROUND_WRITES", "0") == "1"
+
+
+# ─── CONNECTION POOL ──────────────────────────────────────────────────────────
+
+class ConnectionPool:
+    """Fixed-size pool of SQLite connections that can move between threads."""
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = max(1, size)
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._open()
+                except Exception:
+                    self._created -= 1
+                    raise
+        return self._idle.get()
+
+    def release(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._created = 0
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_PATH, DB_POOL_SIZE)
+    return _pool
+
+
+@contextmanager
+def connection() -> Iterator[sqlite3.Connection]:
+    """Borrow a pooled connection. Callers commit their own writes."""
+    pool = get_pool()
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+@contextmanager
+def transaction() -> Iterator[sqlite3.Connection]:
+    """Borrow a connection and commit on success / roll back on error."""
+    with connection() as conn:
+        with conn:
+            yield conn
+
+
+# ─── SCHEMA ───────────────────────────────────────────────────────────────────
+
+def init_db():
+    with transaction() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS analyses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at TEXT,
+                niche TEXT,
+                platform TEXT,
+                post_url TEXT,
+                post_text TEXT,
+                author TEXT,
+                likes INTEGER,
+                comments INTEGER,
+                shares INTEGER,
+                overall_sentiment INTEGER,
+                tool_usefulness INTEGER,
+                common_questions TEXT,
+                key_insights TEXT
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS generated_content (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at TEXT,
+                niche TEXT,
+                platform TEXT,
+                hook TEXT,
+                body TEXT,
+                cta TEXT,
+                hashtags TEXT,
+                viral_score INTEGER,
+                tone TEXT
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at TEXT,
+                niche TEXT,
+                platform TEXT
+            )
+        """)
+        for table in HISTORY_TABLES.values():
+            add_column_if_missing(conn, table, "run_id", "INTEGER")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_created ON {table}(created_at, id)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_niche ON {table}(niche, created_at, id)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_platform ON {table}(platform, created_at, id)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_run ON {table}(run_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_created ON runs(created_at, id)")
+
+
+def add_column_if_missing(conn: sqlite3.Connection, table: str, column: str, decl: str):
+    """Migrate a table created by an older version: ALTER TABLE ADD COLUMN unless it exists."""
+    existing = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in existing:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+# ─── RUN WRITES ───────────────────────────────────────────────────────────────
+
+def save_run(
+    created_at: str,
+    niche: str,
+    platform: str,
+    analyses: List[dict],
+    generated_posts: List[dict],
+    background: Optional[bool] = None
+) -> int:
+    """
+    Persist every analysis and generated post of one run in a single transaction.
+    Returns the run id linking those rows. With the background writer (see
+    DB_BACKGROUND_WRITES) only the run row is written before returning.
+    """
+    if background is None:
+        background = DB_BACKGROUND_WRITES
+
+    if background:
+        with metrics.DB_WRITE_SECONDS.time(op="insert_run"), transaction() as conn:
+            run_id = _insert_run(conn, created_at, niche, platform)
+        _get_writer().submit(
+            _write_run_rows,
+            _analysis_rows(created_at, niche, platform, run_id, analyses),
+            _generated_rows(created_at, niche, platform, run_id, generated_posts)
+        )
+        return run_id
+
+    with metrics.DB_WRITE_SECONDS.time(op="save_run"), transaction() as conn:
+        run_id = _insert_run(conn, created_at, niche, platform)
+        _insert_rows(
+            conn,
+            _analysis_rows(created_at, niche, platform, run_id, analyses),
+            _generated_rows(created_at, niche, platform, run_id, generated_posts)
+        )
+    return run_id
+
+
+def _analysis_rows(created_at: str, niche: str, platform: str, run_id: int, analyses: List[dict]) -> List[tuple]:
+    return [
+        (
+            created_at, niche, platform, run_id,
+            a.get("url", ""),
+            a.get("text", ""),
+            a.get("author", ""),
+            a.get("likes", 0),
+            a.get("comments", 0),
+            a.get("shares", 0),
+            a.get("overall_sentiment", 3),
+            a.get("tool_usefulness", 3),
+            json.dumps(a.get("common_questions", [])),
+            a.get("key_insights", "")
+        )
+        for a in analyses
+    ]
+
+
+def _generated_rows(created_at: str, niche: str, platform: str, run_id: int, posts: List[dict]) -> List[tuple]:
+    return [
+        (
+            created_at, niche, platform, run_id,
+            gp.get("hook", ""),
+            gp.get("body", ""),
+            gp.get("cta", ""),
+            json.dumps(gp.get("hashtags", [])),
+            gp.get("viral_score", 7),
+            gp.get("tone", "")
+        )
+        for gp in posts
+    ]
+
+
+def _insert_run(conn: sqlite3.Connection, created_at: str, niche: str, platform: str) -> int:
+    return conn.execute(
+        "INSERT INTO runs (created_at, niche, platform) VALUES (?, ?, ?)",
+        (created_at, niche, platform)
+    ).lastrowid
+
+
+def _write_run_rows(analysis_rows: List[tuple], generated_rows: List[tuple]):
+    with metrics.DB_WRITE_SECONDS.time(op="run_rows"), transaction() as conn:
+        _insert_rows(conn, analysis_rows, generated_rows)
+
+
+def _insert_rows(conn: sqlite3.Connection, analysis_rows: List[tuple], generated_rows: List[tuple]):
+    conn.executemany("""
+        INSERT INTO analyses
+        (created_at, niche, platform, run_id, post_url, post_text, author, likes, comments, shares,
+         overall_sentiment, tool_usefulness, common_questions, key_insights)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, analysis_rows)
+    conn.executemany("""
+        INSERT INTO generated_content
+        (created_at, niche, platform, run_id, hook, body, cta, hashtags, viral_score, tone)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, generated_rows)
+
+
+# ─── HISTORY READS ────────────────────────────────────────────────────────────
+
+# Public names for the paginated history tables
+HISTORY_TABLES = {"analyses": "analyses", "generated": "generated_content"}
+
+
+def encode_cursor(created_at: str, row_id: int) -> str:
+    raw = json.dumps([created_at, row_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """Raises ValueError for cursors not produced by encode_cursor."""
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(created_at), int(row_id)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def _history_filters(
+    niche: Optional[str],
+    platform: Optional[str],
+    since: Optional[str],
+    until: Optional[str]
+) -> Tuple[str, list]:
+    """SQL condition for the history filters ("" when none apply) and its parameters."""
+    clauses, params = [], []
+    if niche:
+        clauses.append("niche = ?")
+        params.append(niche)
+    if platform:
+        clauses.append("platform = ?")
+        params.append(platform)
+    if since:
+        clauses.append("created_at >= ?")
+        params.append(since)
+    if until:
+        clauses.append("created_at < ?")
+        params.append(until)
+    return " AND ".join(clauses), params
+
+
+def query_history(
+    table: str,
+    limit: int,
+    cursor: Optional[str] = None,
+    niche: Optional[str] = None,
+    platform: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None
+) -> Tuple[List[dict], Optional[str]]:
+    """
+    Newest-first page of a history table ("analyses" or "generated").
+    Uses keyset pagination on (created_at, id), so each page is an index range
+    scan regardless of table size. Returns (rows, cursor for the next page).
+    """
+    filters, params = _history_filters(niche, platform, since, until)
+    clauses = [filters] if filters else []
+    if cursor:
+        clauses.append("(created_at, id) < (?, ?)")
+        params.extend(decode_cursor(cursor))
+
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    sql = (
+        f"SELECT * FROM {HISTORY_TABLES[table]} {where} "
+        "ORDER BY created_at DESC, id DESC LIMIT ?"
+    )
+    with connection() as conn:
+        rows = [dict(row) for row in conn.execute(sql, (*params, limit + 1))]
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+    return rows, next_cursor
+
+
+def history_columns(table: str) -> List[str]:
+    with connection() as conn:
+        return [row["name"] for row in conn.execute(f"PRAGMA table_info({HISTORY_TABLES[table]})")]
+
+
+def iter_history(
+    table: str,
+    chunk_size: int,
+    niche: Optional[str] = None,
+    platform: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None
+) -> Iterator[List[dict]]:
+    """
+    Every matching row of a history table, oldest first, in chunks of up to
+    chunk_size. Each chunk is its own keyset query on (created_at, id), so a
+    connection is only borrowed (and a read snapshot only held) per chunk.
+    """
+    filters, params = _history_filters(niche, platform, since, until)
+    clauses = [filters] if filters else []
+
+    position: Optional[Tuple[str, int]] = None
+    while True:
+        where = list(clauses)
+        if position:
+            where.append("(created_at, id) > (?, ?)")
+        sql = (
+            f"SELECT * FROM {HISTORY_TABLES[table]} "
+            f"{'WHERE ' + ' AND '.join(where) if where else ''} "
+            "ORDER BY created_at, id LIMIT ?"
+        )
+        with connection() as conn:
+            rows = [dict(row) for row in conn.execute(sql, (*params, *(position or ()), chunk_size))]
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        position = (rows[-1]["created_at"], rows[-1]["id"])
+
+
+def get_run(run_id: int) -> Optional[dict]:
+    """A run with all of its analyses and generated posts (indexed on run_id)."""
+    with connection() as conn:
+        run = conn.execute("SELECT * FROM runs WHERE id = ?", (run_id,)).fetchone()
+        if run is None:
+            return None
+        analyses = [dict(row) for row in conn.execute(
+            "SELECT * FROM analyses WHERE run_id = ? ORDER BY id", (run_id,)
+        )]
+        generated = [dict(row) for row in conn.execute(
+            "SELECT * FROM generated_content WHERE run_id = ? ORDER BY id", (run_id,)
+        )]
+    return {**dict(run), "analyses": analyses, "generated": generated}
+
+
+# ─── BACKGROUND WRITER ────────────────────────────────────────────────────────
+
+class BackgroundWriter:
+    """Single thread that applies queued write callables in submission order."""
+
+    def __init__(self):
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args):
+        self._queue.put((fn, args))
+
+    def flush(self):
+        """Block until every write submitted so far has been applied."""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            fn, args = self._queue.get()
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"[Storage] Background write failed: {e}")
+            finally:
+                self._queue.task_done()
+
+
+_writer: Optional[BackgroundWriter] = None
+
+
+def _get_writer() -> BackgroundWriter:
+    global _writer
+    with _pool_lock:
+        if _writer is None:
+            _writer = BackgroundWriter()
+    return _writer
+
+
+def flush_writes():
+    """Wait for pending background writes (no-op if the writer never started)."""
+    if _writer is not None:
+        _writer.flush()
+
+
+def close():
+    flush_writes()
+    if _pool is not None:
+        _pool.close()
@@ -0,0 +1,245 @@
+"""
+Structured model output for Viral Content System
+- Analysis / BatchAnalysis / GeneratedPost: pydantic schemas for Gemini's answers
+- ANALYSIS_SCHEMA / BATCH_ANALYSIS_SCHEMA / GENERATED_POSTS_SCHEMA: the same
+  shapes as Gemini response_schema dicts for JSON response mode
+- ArrayStreamParser: incremental parser yielding each complete element of a
+  top-level JSON array as chunks arrive
+- parse_object / parse_array: validate a whole response; parse_array salvages
+  the complete elements of truncated or partly malformed output (PartialOutput)
+"""
+
+import re
+import json
+from typing import Any, List, Optional, Type
+from pydantic import BaseModel, ValidationError, field_validator
+
+
+class PartialOutput(ValueError):
+    """Raised when only part of a response could be used; result holds what was salvaged."""
+
+    def __init__(self, result: list, message: str = "Model output was truncated or partly invalid"):
+        super().__init__(message)
+        self.result = result
+
+
+def _clamp_int(value: Any, low: int, high: int) -> int:
+    return max(low, min(high, int(round(float(value)))))
+
+
+def _required_text(value: Any) -> str:
+    text = str(value).strip() if value is not None else ""
+    if not text:
+        raise ValueError("must not be empty")
+    return text
+
+
+def _string_list(value: Any) -> List[str]:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = [value]
+    return [str(v).strip() for v in value if str(v).strip()]
+
+
+# ─── SCHEMAS ──────────────────────────────────────────────────────────────────
+
+# Scores and text the rest of the system relies on are required, so an element
+# that is empty or unrelated fails validation (salvage drops it, or the call
+# falls back) instead of passing as a neutral analysis or blank post
+
+class Analysis(BaseModel):
+    overall_sentiment: int
+    tool_usefulness: int
+    common_questions: List[str] = []
+    key_insights: str
+
+    @field_validator("overall_sentiment", "tool_usefulness", mode="before")
+    @classmethod
+    def _score(cls, value):
+        return _clamp_int(value, 1, 5)
+
+    @field_validator("key_insights", mode="before")
+    @classmethod
+    def _insights(cls, value):
+        return _required_text(value)
+
+    @field_validator("common_questions", mode="before")
+    @classmethod
+    def _questions(cls, value):
+        return _string_list(value)
+
+
+class BatchAnalysis(Analysis):
+    post_id: str
+
+
+class GeneratedPost(BaseModel):
+    hook: str
+    body: str
+    cta: str = ""
+    hashtags: List[str] = []
+    viral_score: int = 7
+    tone: str = "Bold"
+
+    @field_validator("hook", "body", mode="before")
+    @classmethod
+    def _text(cls, value):
+        return _required_text(value)
+
+    @field_validator("viral_score", mode="before")
+    @classmethod
+    def _score(cls, value):
+        return _clamp_int(value, 1, 10)
+
+    @field_validator("hashtags", mode="before")
+    @classmethod
+    def _hashtags(cls, value):
+        return [tag.lstrip("#") for tag in _string_list(value)]
+
+
+_ANALYSIS_PROPERTIES = {
+    "overall_sentiment": {"type": "integer"},
+    "tool_usefulness": {"type": "integer"},
+    "common_questions": {"type": "array", "items": {"type": "string"}},
+    "key_insights": {"type": "string"},
+}
+
+ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": _ANALYSIS_PROPERTIES,
+    "required": list(_ANALYSIS_PROPERTIES),
+}
+
+BATCH_ANALYSIS_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {"post_id": {"type": "string"}, **_ANALYSIS_PROPERTIES},
+        "required": ["post_id", *_ANALYSIS_PROPERTIES],
+    },
+}
+
+GENERATED_POSTS_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "hook": {"type": "string"},
+            "body": {"type": "string"},
+            "cta": {"type": "string"},
+            "hashtags": {"type": "array", "items": {"type": "string"}},
+            "viral_score": {"type": "integer"},
+            "tone": {"type": "string"},
+        },
+        "required": ["hook", "body", "cta", "hashtags", "viral_score", "tone"],
+    },
+}
+
+
+# ─── PARSING ──────────────────────────────────────────────────────────────────
+
+_FENCE = re.compile(r"```(?:json)?")
+_STRUCTURAL = re.compile(r'[\[\]{}"\\]')
+
+
+def strip_fences(text: str) -> str:
+    return _FENCE.sub("", text).strip()
+
+
+class ArrayStreamParser:
+    """
+    Feed text chunks of a JSON array; feed() returns the elements completed by
+    that chunk. Anything before the first "[" (fences, preamble) is skipped,
+    and only object/array elements are emitted. closed turns True once the
+    array's closing bracket has been seen.
+    """
+
+    def __init__(self):
+        self.closed = False
+        self.errors = 0
+        self._text = ""
+        self._scan_from = 0
+        self._depth = 0
+        self._in_string = False
+        self._element_start: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[Any]:
+        self._text += chunk
+        elements = []
+        for match in _STRUCTURAL.finditer(self._text, self._scan_from):
+            if self.closed:
+                break
+            i, ch = match.start(), match.group()
+            if i < self._scan_from:
+                continue  # the character after a backslash escape
+            self._scan_from = i + 1
+
+            if self._depth == 0:
+                if ch == "[":
+                    self._depth = 1
+                continue
+            if self._in_string:
+                if ch == "\\":
+                    self._scan_from = i + 2
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                if self._depth == 1:
+                    self._element_start = i
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 1 and self._element_start is not None:
+                    try:
+                        elements.append(json.loads(self._text[self._element_start:i + 1]))
+                    except json.JSONDecodeError:
+                        self.errors += 1
+                    self._element_start = None
+                elif self._depth == 0:
+                    self.closed = True
+        return elements
+
+
+def validate_item(item: Any, schema: Type[BaseModel]) -> Optional[dict]:
+    """Validated dict for one parsed element, or None if it does not fit the schema."""
+    if not isinstance(item, dict):
+        return None
+    try:
+        return schema.model_validate(item).model_dump()
+    except (ValidationError, TypeError, ValueError):
+        return None
+
+
+def parse_array(text: str, schema: Type[BaseModel]) -> List[dict]:
+    """
+    Validated elements of the JSON array in text. Raises PartialOutput (with
+    the usable elements) when the array is truncated or some elements are
+    invalid, and ValueError when nothing is usable.
+    """
+    parser = ArrayStreamParser()
+    raw = parser.feed(strip_fences(text))
+    items = [v for v in (validate_item(item, schema) for item in raw) if v is not None]
+    if not items:
+        raise ValueError("No valid JSON array elements in model output")
+    if not parser.closed or parser.errors or len(items) < len(raw):
+        raise PartialOutput(items)
+    return items
+
+
+def parse_object(text: str, schema: Type[BaseModel]) -> dict:
+    """Validated first JSON object in text (also accepts a one-element array). Raises ValueError."""
+    text = strip_fences(text)
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        raise ValueError("No JSON object in model output")
+    value, _ = json.JSONDecoder().raw_decode(text, min(starts))
+    if isinstance(value, list) and value:
+        value = value[0]
+    result = validate_item(value, schema)
+    if result is None:
+        raise ValueError("Model output does not match the expected schema")
+    return result
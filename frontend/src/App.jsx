@@ -12,14 +12,16 @@ export default function App() {
   const [results, setResults] = useState(null)
   const [error, setError] = useState(null)
   const [activeTab, setActiveTab] = useState('generated')
+  const [progress, setProgress] = useState(null)
 
   const handleRun = useCallback(async (formData) => {
     setPhase('loading')
     setError(null)
     setResults(null)
+    setProgress({ step: 0 })
 
     try {
-      const response = await fetch(`${API_BASE}/api/run`, {
+      const response = await fetch(`${API_BASE}/api/run/stream`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify(formData),
@@ -30,7 +32,49 @@ export default function App() {
         throw new Error(err.detail || 'Pipeline failed')
       }
 
-      const data = await response.json()
+      // NDJSON: one {event, data} object per line
+      const reader = response.body.getReader()
+      const decoder = new TextDecoder()
+      let buffer = ''
+      let total = 0
+      let analysed = 0
+      let written = 0
+      let ready = 0
+      let data = null
+
+      const handleEvent = ({ event, data: payload }) => {
+        if (event === 'posts') {
+          total = payload.length
+          setProgress({ step: 1, detail: `0 / ${total} posts analysed` })
+        } else if (event === 'analysis') {
+          analysed += 1
+          setProgress(analysed < total
+            ? { step: 1, detail: `${analysed} / ${total} posts analysed` }
+            : { step: 2 })
+        } else if (event === 'generation_token') {
+          written += payload.length
+          setProgress({ step: 3, detail: `${written} characters written` })
+        } else if (event === 'generated_post') {
+          ready += 1
+          setProgress({ step: 3, detail: `${ready} post${ready === 1 ? '' : 's'} ready` })
+        } else if (event === 'done') {
+          data = payload
+        } else if (event === 'error') {
+          throw new Error(payload.detail || 'Pipeline failed')
+        }
+      }
+
+      while (true) {
+        const { value, done } = await reader.read()
+        if (done) break
+        buffer += decoder.decode(value, { stream: true })
+        const lines = buffer.split('\n')
+        buffer = lines.pop()
+        lines.filter(line => line.trim()).forEach(line => handleEvent(JSON.parse(line)))
+      }
+      if (buffer.trim()) handleEvent(JSON.parse(buffer))
+      if (!data) throw new Error('Pipeline ended without a result')
+
       setResults(data)
       setPhase('results')
       setActiveTab('generated')
@@ -82,7 +126,7 @@ export default function App() {
           </div>
         )}
 
-        {phase === 'loading' && <LoadingScreen />}
+        {phase === 'loading' && <LoadingScreen progress={progress} />}
 
         {phase === 'results' && results && (
           <div className="fade-up">
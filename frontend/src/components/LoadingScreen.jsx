@@ -7,16 +7,20 @@ const STEPS = [
   { id: 4, label: 'Generating viral content…', sub: 'Crafting 3 posts built to spread' },
 ]
 
-export default function LoadingScreen() {
-  const [currentStep, setCurrentStep] = useState(0)
+// progress (optional): { step, detail } reported by the streaming API.
+// Without it the steps advance on a timer.
+export default function LoadingScreen({ progress }) {
+  const [timedStep, setTimedStep] = useState(0)
   const [dots, setDots] = useState('')
+  const currentStep = progress ? progress.step : timedStep
 
   useEffect(() => {
+    if (progress) return
     const stepTimer = setInterval(() => {
-      setCurrentStep(s => Math.min(s + 1, STEPS.length - 1))
+      setTimedStep(s => Math.min(s + 1, STEPS.length - 1))
     }, 1800)
     return () => clearInterval(stepTimer)
-  }, [])
+  }, [progress])
 
   useEffect(() => {
     const dotTimer = setInterval(() => {
@@ -103,7 +107,7 @@ export default function LoadingScreen() {
                     marginTop: '3px', fontFamily: 'var(--font-mono)',
                     letterSpacing: '0.02em',
                   }}>
-                    {step.sub}
+                    {progress?.detail || step.sub}
                   </div>
                 )}
               </div>